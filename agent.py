@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 import settings
+import crn
 import routes
+import scenario
 from points import Point
-import math
-import random
 import events
 import logging
+import math
 
 import copy
 
@@ -31,7 +32,8 @@ class Agent:
         self.remaining_endurance = endurance
         self.speed = speed
         self.maintenance_time = maintenance
-        self.remaining_maintenance = 0
+        # World time at which the current maintenance is done
+        self.maintenance_end = settings.world_time
 
         self.current_return_distance = 0
         self.patrol_location = None
@@ -40,8 +42,8 @@ class Agent:
         self.route = None
         self.returning = False
         self.called_replacement = False
-
-        self.plot_object = None
+        # Before this time the return and replacement checks cannot succeed, see Searcher.schedule_next_check
+        self.next_check_time = -math.inf
 
     def __str__(self):
         return (f"Agent {self.agent_id} - "
@@ -53,22 +55,29 @@ class Agent:
                 f"Endurance: {self.remaining_endurance} - "
                 f"Rem Maint: {self.remaining_maintenance}")
 
+    @property
+    def remaining_maintenance(self) -> float:
+        return max(0, self.maintenance_end - settings.world_time)
+
+    @remaining_maintenance.setter
+    def remaining_maintenance(self, value: float) -> None:
+        self.maintenance_end = settings.world_time + value
+
     def start_maintenance(self):
-        self.remaining_maintenance = self.maintenance_time
+        # Maintenance counts from the end of the step in which the agent entered the base
+        self.maintenance_end = settings.world_time + settings.time_step + self.maintenance_time
 
-    def update_maintenance(self) -> bool:
-        finished = False
-        self.remaining_maintenance = max(0, self.remaining_maintenance - settings.TIME_DELTA)
-        if self.remaining_maintenance == 0:
-            self.remaining_endurance = self.endurance
-            finished = True
-        return finished
+    def finish_maintenance(self) -> None:
+        self.remaining_endurance = self.endurance
 
     def update_endurance(self):
-        self.remaining_endurance = max(0, self.remaining_endurance - (settings.TIME_DELTA*self.speed))
+        self.remaining_endurance = max(0, self.remaining_endurance - (settings.time_step*self.speed))
 
-    def move_through_route(self) -> None:
-        turn_travel = self.speed * settings.TIME_DELTA
+    def move_through_route(self, duration: float = None) -> None:
+        """
+        :param duration: Time to move for, defaults to the current time step
+        """
+        turn_travel = self.speed * (settings.time_step if duration is None else duration)
 
         i = 0
         while turn_travel > 0:
@@ -84,7 +93,8 @@ class Agent:
             else:
                 self.remaining_endurance -= dist
                 self.location.x,  self.location.y = self.base.x, self.base.y
-                if self.returning:
+                # Routes to the base may pass other waypoints first, see routes.FieldRoute
+                if self.returning and goal is self.base:
                     self.enter_base()
                     self.current_return_distance = 0
                     return events.ENTERED_BASE
@@ -108,25 +118,16 @@ class Agent:
 
     def enter_base(self) -> None:
         logger.debug(f"{self} is entering base")
-        self.remaining_maintenance = self.maintenance_time
         self.returning = False
         self.called_replacement = False
         self.start_maintenance()
 
-        if self.plot_object is not None:
-            self.plot_object.set_visible(False)
-
     def activate(self, patrol_location) -> None:
+        self.next_check_time = -math.inf
         self.patrol_location = patrol_location
-        self.route = patrol_location.boustrophedon_path
+        self.route = patrol_location.create_patrol_route()
         self.move_through_route()
 
-        if self.plot_object is not None:
-            self.plot_object.set_visible(True)
-
-    def deactivate(self) -> None:
-        self.plot_object.set_visible(False)
-
 
 class Traveller(Agent):
     def __init__(self, model: str,
@@ -136,10 +137,17 @@ class Traveller(Agent):
                  base: Point,
                  air_visibility: str,
                  surface_visibility: str,
+                 target_id: int = None,
                  ):
         super().__init__(model, endurance, speed, maintenance, base)
+        # Order of entry, keys the detection draws on this target with common random numbers
+        self.target_id = target_id
+        self.detection_random = crn.detection_random(target_id)
         self.air_visibility = air_visibility
         self.surface_visibility = surface_visibility
+        self.air_visibility_code = scenario.encode(air_visibility, scenario.SIZE_CLASSES, "air visibility")
+        self.surface_visibility_code = scenario.encode(surface_visibility, scenario.SIZE_CLASSES,
+                                                       "surface visibility")
 
 
 class Searcher(Agent):
@@ -153,6 +161,8 @@ class Searcher(Agent):
         super().__init__(model, endurance, speed, maintenance, base)
         self.operating_domain = operating_domain
         self.skill_level = skill_level
+        self.domain_code = scenario.encode(operating_domain, scenario.OPERATING_DOMAINS, "operating domain")
+        self.skill_code = scenario.encode(skill_level, scenario.SKILL_LEVELS, "skill level")
 
     def check_if_need_to_return(self) -> None:
         if not self.returning:
@@ -166,18 +176,32 @@ class Searcher(Agent):
                 return True
         return False
 
+    def schedule_next_check(self) -> None:
+        """
+        Predicts the earliest time the return or replacement threshold can be crossed. Per unit of time the remaining
+        endurance drops by at most the speed and the return distance changes by at most the speed, so the slack
+        E - (f + margin) R shrinks by at most (1 + f + margin) speed. Before next_check_time both checks are
+        guaranteed to fail and are skipped.
+        """
+        if self.called_replacement:
+            factor = 1 + settings.DISTANCE_SAFETY_MARGIN
+            if self.returning:
+                self.next_check_time = math.inf
+                return
+        else:
+            factor = 2 + settings.DISTANCE_SAFETY_MARGIN
+        slack = self.remaining_endurance - factor * self.current_return_distance
+        self.next_check_time = settings.world_time + max(slack, 0) / ((1 + factor) * self.speed)
+
     def check_detection(self, agent) -> bool:
-        if self.operating_domain == settings.SURFACE_SEARCHER:
+        if self.domain_code == scenario.SURFACE_CODE:
             success = self.surface_to_surface_detection(agent)
-        elif self.operating_domain == settings.AIR_SEARCHER:
-            success = self.air_to_surface_detection(agent)
         else:
-            raise ValueError(f"Unknown operating domain {self.operating_domain}.")
+            success = self.air_to_surface_detection(agent)
         return success
 
     def surface_to_surface_detection(self, agent: Traveller) -> bool:
-        target_size = agent.surface_visibility
-        detection_range = settings.SURFACE_DETECTING_SURFACE[self.skill_level][target_size]
+        detection_range = settings.COMPILED_SCENARIO.detection_range[self.skill_code, agent.surface_visibility_code]
         distance = self.location.distance_to(agent.location)
 
         if detection_range < distance:
@@ -186,27 +210,21 @@ class Searcher(Agent):
             return True
 
     def air_to_surface_detection(self, agent: Traveller) -> bool:
-        if self.skill_level == settings.BASIC_SKILL:
-            k = 2747
-        elif self.skill_level == settings.ADVANCED_SKILL:
-            k = 39633
-        else:
-            raise ValueError(f"Unknown Skill Level {self.skill_level}")
-
         distance = self.location.distance_to(agent.location)
-        if distance > 300:
+        if distance > settings.MAX_AIR_DETECTION_DISTANCE:
             return False
 
-        sea_state = settings.world.receptor_grid.get_receptor_at_location(self.location).sea_state
-        h = 10
-        s = settings.sea_state_values.get(sea_state, 0.4)
-        r = settings.rcs_dict[agent.air_visibility]
-        if distance < 1:
-            distance = 1
+        sea_state = settings.world.receptor_grid.sea_state_at(self.location)
 
-        detection_probability = (1 - math.exp(-(k * h * r * s) / distance ** 3))
+        detection_probability = settings.COMPILED_SCENARIO.air_detection_probability(self.skill_code,
+                                                                                     agent.air_visibility_code,
+                                                                                     sea_state, distance)
+        if settings.time_step != settings.DETECTION_REFERENCE_TIME:
+            # Constant hazard over the step, so the chance of detection does not depend on the step size
+            exposure = settings.time_step / settings.DETECTION_REFERENCE_TIME
+            detection_probability = 1 - (1 - detection_probability) ** exposure
         logger.debug(f"Detection prob {self} - {agent} is {detection_probability}")
-        if random.uniform(0, 1) < detection_probability:
+        if agent.detection_random.uniform(0, 1) < detection_probability:
             return True
         else:
             return False
@@ -0,0 +1,275 @@
+"""
+Online aggregators for the traveller statistics.
+
+Every aggregator is updated one observation at a time in constant memory, can be merged with another aggregator of
+the same configuration (e.g. from another replication or worker process) and converts to and from a JSON compatible
+dict for checkpoints.
+"""
+import math
+
+import numpy as np
+
+import settings
+
+
+class RunningMoments:
+    def __init__(self):
+        """
+        Count, mean and variance with Welford's update, merged with the parallel formula of Chan et al.
+        """
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other: "RunningMoments") -> None:
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def variance(self) -> float:
+        """
+        Sample variance, nan for less than two observations
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "minimum": self.minimum,
+                "maximum": self.maximum}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "RunningMoments":
+        moments = cls()
+        moments.count, moments.mean, moments.m2 = state["count"], state["mean"], state["m2"]
+        moments.minimum, moments.maximum = state["minimum"], state["maximum"]
+        return moments
+
+
+class Histogram:
+    def __init__(self, bin_width: float = None, maximum: float = None):
+        """
+        Fixed bins [0, bin_width), [bin_width, 2 bin_width), ... up to maximum, with one extra bin for values beyond.
+        :param bin_width: Defaults to STATS_BIN_WIDTH
+        :param maximum: Defaults to STATS_MAX_TIME
+        """
+        self.bin_width = settings.STATS_BIN_WIDTH if bin_width is None else bin_width
+        self.maximum = settings.STATS_MAX_TIME if maximum is None else maximum
+        self.counts = np.zeros(int(math.ceil(self.maximum / self.bin_width)) + 1, dtype=np.int64)
+
+    @property
+    def edges(self) -> np.ndarray:
+        """
+        Lower edges of the bins, the last bin is open ended
+        """
+        return np.arange(len(self.counts)) * self.bin_width
+
+    def update(self, value: float) -> None:
+        self.counts[min(max(int(value // self.bin_width), 0), len(self.counts) - 1)] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        if other.bin_width != self.bin_width or len(other.counts) != len(self.counts):
+            raise ValueError("Can only merge histograms with the same bins.")
+        self.counts += other.counts
+
+    def to_dict(self) -> dict:
+        return {"bin_width": self.bin_width, "maximum": self.maximum, "counts": self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "Histogram":
+        histogram = cls(state["bin_width"], state["maximum"])
+        histogram.counts[:] = state["counts"]
+        return histogram
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = None):
+        """
+        Streaming quantiles with a relative error guarantee: values are counted in logarithmic buckets
+        (gamma^(i-1), gamma^i] with gamma = (1 + a) / (1 - a), so any reported quantile is within a relative
+        accuracy a of an actual observation. Memory grows with the log of the value range, not the count.
+        :param relative_accuracy: Defaults to STATS_SKETCH_ACCURACY
+        """
+        self.relative_accuracy = settings.STATS_SKETCH_ACCURACY if relative_accuracy is None else relative_accuracy
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        # Values at or below zero are counted separately
+        self.zero_count = 0
+        self.count = 0
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same relative accuracy.")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self) -> dict:
+        return {"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count, "count": self.count,
+                "buckets": [[key, count] for key, count in sorted(self.buckets.items())]}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "QuantileSketch":
+        sketch = cls(state["relative_accuracy"])
+        sketch.zero_count, sketch.count = state["zero_count"], state["count"]
+        sketch.buckets = {int(key): int(count) for key, count in state["buckets"]}
+        return sketch
+
+
+class TimeAggregate:
+    AGGREGATORS = {"moments": RunningMoments, "histogram": Histogram, "sketch": QuantileSketch}
+
+    def __init__(self):
+        """
+        All aggregators of one time measure.
+        """
+        self.moments = RunningMoments()
+        self.histogram = Histogram()
+        self.sketch = QuantileSketch()
+
+    def update(self, value: float) -> None:
+        self.moments.update(value)
+        self.histogram.update(value)
+        self.sketch.update(value)
+
+    def merge(self, other: "TimeAggregate") -> None:
+        for name in self.AGGREGATORS:
+            getattr(self, name).merge(getattr(other, name))
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)) -> dict:
+        result = {"count": self.moments.count, "mean": self.moments.mean if self.moments.count else math.nan,
+                  "std": self.moments.std if self.moments.count > 1 else math.nan}
+        for q in quantiles:
+            result[f"q{round(q * 100)}"] = self.sketch.quantile(q)
+        return result
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name).to_dict() for name in self.AGGREGATORS}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "TimeAggregate":
+        aggregate = cls()
+        for name, aggregator in cls.AGGREGATORS.items():
+            setattr(aggregate, name, aggregator.from_dict(state[name]))
+        return aggregate
+
+
+class DetectionStatistics:
+    def __init__(self):
+        """
+        Per traveller model: number of finished travellers, number detected, the time to detection of the detected
+        and the transit time of the travellers that made it through.
+        """
+        self.models = {}
+
+    def model_aggregates(self, model: str) -> dict:
+        if model not in self.models:
+            self.models[model] = {"travellers": 0, "detected": 0,
+                                  "time_to_detection": TimeAggregate(), "transit_time": TimeAggregate()}
+        return self.models[model]
+
+    def update(self, model: str, detected: bool, time: float) -> None:
+        aggregates = self.model_aggregates(model)
+        aggregates["travellers"] += 1
+        if detected:
+            aggregates["detected"] += 1
+            aggregates["time_to_detection"].update(time)
+        else:
+            aggregates["transit_time"].update(time)
+
+    def merge(self, other: "DetectionStatistics") -> None:
+        for model, other_aggregates in other.models.items():
+            aggregates = self.model_aggregates(model)
+            aggregates["travellers"] += other_aggregates["travellers"]
+            aggregates["detected"] += other_aggregates["detected"]
+            aggregates["time_to_detection"].merge(other_aggregates["time_to_detection"])
+            aggregates["transit_time"].merge(other_aggregates["transit_time"])
+
+    @property
+    def travellers(self) -> int:
+        return sum(a["travellers"] for a in self.models.values())
+
+    @property
+    def detected(self) -> int:
+        return sum(a["detected"] for a in self.models.values())
+
+    @property
+    def detection_rate(self) -> float:
+        return self.detected / self.travellers if self.travellers else math.nan
+
+    def summary(self) -> dict:
+        """
+        :return: Per model the detection rate and summaries of the time to detection and transit time
+        """
+        result = {}
+        for model, aggregates in self.models.items():
+            result[model] = {"travellers": aggregates["travellers"],
+                             "detected": aggregates["detected"],
+                             "detection_rate": aggregates["detected"] / aggregates["travellers"],
+                             "time_to_detection": aggregates["time_to_detection"].summary(),
+                             "transit_time": aggregates["transit_time"].summary()}
+        return result
+
+    def to_dict(self) -> dict:
+        return {model: {"travellers": a["travellers"], "detected": a["detected"],
+                        "time_to_detection": a["time_to_detection"].to_dict(),
+                        "transit_time": a["transit_time"].to_dict()}
+                for model, a in self.models.items()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "DetectionStatistics":
+        statistics = cls()
+        for model, a in state.items():
+            statistics.models[model] = {"travellers": a["travellers"], "detected": a["detected"],
+                                        "time_to_detection": TimeAggregate.from_dict(a["time_to_detection"]),
+                                        "transit_time": TimeAggregate.from_dict(a["transit_time"])}
+        return statistics
+
+
+def merge_statistics(statistics: list[DetectionStatistics]) -> DetectionStatistics:
+    merged = DetectionStatistics()
+    for s in statistics:
+        merged.merge(s)
+    return merged
@@ -0,0 +1,281 @@
+"""
+Analytic estimate of the detection rate of a tessellated world, for screening fleets without simulating time.
+
+Travellers cross in a straight line from (ENTRY_X, y) to the exit at the base, with y uniform over the entry range.
+Per patrol zone the searcher on station is modelled as a random search (Koopman): a traveller spending time T in a
+zone of area A is detected with probability 1 - exp(-f W w T / A), where
+    - f is the share of time the zone has an agent on station, implied by the rotation behind
+      AgentType.calculate_concurrent_locations (uptime against maintenance and twice the ingress)
+    - W is the sweep width of the agent type: twice the surface detection range (SURFACE_DETECTING_SURFACE), or
+      for air searchers the integral of the lateral range curve of the air detection model, averaged over the
+      stationary distribution of the sea states
+    - w is the relative speed of searcher and traveller, sqrt(u^2 + v^2) for random headings
+Zone areas follow from the receptors each patrol location owns, i.e. from the strengths the zones were relaxed to.
+The zones crossed by every entry position are sampled once per tessellation, after which an estimate for other fleet
+quantities on the same zones costs a few array operations.
+Calibration compares the estimate against the object-based reference engine (replications.run_replication) by
+default, or against the faster but itself approximate batched engine, and flags estimates that lie more than
+BIAS_WARNING_ERRORS standard errors from the simulated rate.
+
+    python analytic.py [--calibrate 0.5 1 2] [--engine reference] [--replications 16] [--simulation-time 1000]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import math
+import random
+import time
+
+import numpy as np
+
+import scenario
+import settings
+import weather
+from manager import TravelManager
+
+logger = logging.getLogger(__name__)
+
+# Number of traveller entry positions the crossing is averaged over
+ENTRY_SAMPLES = 64
+# Simulation engines calibrate can compare against
+REFERENCE = "reference"
+BATCHED = "batched"
+# Distance in standard errors between estimate and simulation above which the calibration warns
+BIAS_WARNING_ERRORS = 2
+
+
+def on_station_fraction(agent_type, quantity: int = None) -> float:
+    """
+    Share of time a patrol location of the agent type has an agent on station, with the agents spread evenly over the
+    concurrent locations. Each agent spends uptime on station per cycle of uptime + maintenance + twice the ingress.
+    :param quantity: Number of agents, defaults to the quantity of the agent type
+    """
+    if agent_type.concurrent_locations == 0:
+        return 0.
+    quantity = agent_type.quantity if quantity is None else quantity
+    ingress_time = agent_type.max_ingress_distance / agent_type.speed
+    uptime = max((agent_type.endurance - 2 * agent_type.max_ingress_distance) / agent_type.speed, 0)
+    cycle = uptime + agent_type.maintenance + 2 * ingress_time
+    return min(1., quantity / agent_type.concurrent_locations * uptime / cycle)
+
+
+def sweep_width(agent_type, relative_speed: float) -> float:
+    """
+    Effective sweep width of an agent type against the placeholder traveller.
+    :param relative_speed: Speed at which the searcher passes the traveller
+    """
+    compiled = settings.COMPILED_SCENARIO
+    skill = scenario.encode(agent_type.skill_level, scenario.SKILL_LEVELS, "skill level")
+    if agent_type.operating_domain == settings.SURFACE_SEARCHER:
+        size = scenario.encode(TravelManager.TRAVELLER_SURFACE_VISIBILITY, scenario.SIZE_CLASSES, "size")
+        return 2 * float(min(compiled.detection_range[skill, size], settings.MAX_DISCOVER_DISTANCE))
+
+    # Lateral range curve: chance of detection on a straight pass at lateral distance x, from the per-tick
+    # detection probability turned into a hazard per unit of time
+    reach = min(settings.MAX_AIR_DETECTION_DISTANCE, settings.MAX_DISCOVER_DISTANCE)
+    step = min(compiled.bin_width, reach / 50)
+    lateral = np.arange(step / 2, reach, step)
+    along = np.arange(-reach + step / 2, reach, step)
+    distance = np.hypot(lateral[:, None], along[None, :])
+    rcs = scenario.encode(TravelManager.TRAVELLER_AIR_VISIBILITY, scenario.SIZE_CLASSES, "air visibility")
+    sea_states = np.arange(len(scenario.SEA_STATES))
+    probability = compiled.air_detection_probabilities(skill, rcs, sea_states[:, None, None], distance[None])
+    probability = np.where(distance[None] <= reach, np.minimum(probability, 1 - 1e-12), 0.)
+    hazard = -np.log1p(-probability) / settings.DETECTION_REFERENCE_TIME
+    lateral_range = 1 - np.exp(-hazard.sum(axis=2) * step / relative_speed)
+    return 2 * float(weather.stationary_distribution() @ lateral_range.sum(axis=1) * step)
+
+
+class AnalyticEstimator:
+    def __init__(self, world, entries: int = None):
+        """
+        Samples the zones crossed from every entry position on the tessellation of the world.
+        :param entries: Number of entry positions, defaults to ENTRY_SAMPLES
+        """
+        self.search_manager = world.search_manager
+        grid = world.receptor_grid
+        entries = ENTRY_SAMPLES if entries is None else entries
+        zone_owner = self.search_manager.zone_owner
+        zones = len(self.search_manager.patrol_locations)
+
+        entry_y = settings.ENTRY_Y_MIN + (np.arange(entries) + 0.5) / entries * (settings.ENTRY_Y_MAX
+                                                                               - settings.ENTRY_Y_MIN)
+        length = np.hypot(settings.ENTRY_X - settings.BASE_X, entry_y - settings.BASE_Y)
+        samples = int(math.ceil(length.max() / (settings.GRID_SIZE / 2)))
+        share = (np.arange(samples) + 0.5) / samples
+        x = settings.ENTRY_X + (settings.BASE_X - settings.ENTRY_X) * share[None, :]
+        y = entry_y[:, None] + (settings.BASE_Y - entry_y[:, None]) * share[None, :]
+        row = np.floor((y - grid.area_y_start) / settings.GRID_SIZE).astype(np.int64)
+        col = np.floor((x - grid.area_x_start) / settings.GRID_SIZE).astype(np.int64)
+        inside = (row >= 0) & (row < grid.max_rows) & (col >= 0) & (col < grid.max_cols)
+        owner = np.where(inside, zone_owner[np.clip(row, 0, grid.max_rows - 1), np.clip(col, 0, grid.max_cols - 1)],
+                         -1)
+
+        # (entries, zones) length of the crossing within every zone
+        segment = np.broadcast_to((length / samples)[:, None], owner.shape)
+        rows = np.broadcast_to(np.arange(entries)[:, None], owner.shape)
+        self.crossing = np.zeros((entries, zones))
+        np.add.at(self.crossing, (rows[owner >= 0], owner[owner >= 0]), segment[owner >= 0])
+        self.zone_area = np.bincount(zone_owner[zone_owner >= 0], minlength=zones) * settings.GRID_SIZE ** 2
+
+        self.zone_type = np.zeros(zones, dtype=np.int64)
+        for type_index, at in enumerate(self.search_manager.agent_types):
+            for pl in at.patrol_locations:
+                self.zone_type[pl.zone_index] = type_index
+        self.suspended = np.array([pl.suspended for pl in self.search_manager.patrol_locations], dtype=bool)
+
+        self.relative_speed = np.array([math.hypot(at.speed, TravelManager.TRAVELLER_SPEED)
+                                        for at in self.search_manager.agent_types])
+        self.sweep_widths = np.array([sweep_width(at, w) for at, w in zip(self.search_manager.agent_types,
+                                                                            self.relative_speed)])
+
+    def estimate(self, quantities: dict[str, int] = None) -> dict:
+        """
+        :param quantities: Agents per model on the same zones, defaults to the quantities of the agent types
+        :return: Estimated detection rate, the detection probability per entry position and per agent type the
+            on-station fraction and sweep width
+        """
+        quantities = {} if quantities is None else quantities
+        agent_types = self.search_manager.agent_types
+        on_station = np.array([on_station_fraction(at, quantities.get(at.model)) for at in agent_types])
+
+        # Sweep rate per unit of area and time of every zone, times the time spent in it
+        rate = on_station * self.sweep_widths * self.relative_speed
+        zone_rate = np.where(self.suspended | (self.zone_area == 0), 0.,
+                             rate[self.zone_type] / np.maximum(self.zone_area, 1))
+        exposure = self.crossing @ zone_rate / TravelManager.TRAVELLER_SPEED
+        detection = 1 - np.exp(-exposure)
+        return {"detection_rate": float(detection.mean()),
+                "entries": detection,
+                "types": {at.model: {"on_station": float(f), "sweep_width": float(w)}
+                          for at, f, w in zip(agent_types, on_station, self.sweep_widths)}}
+
+
+def calibrate(configurations: dict[str, dict], replications: int = 16, simulation_time: float = None,
+              seed: int = 0, engine: str = REFERENCE, processes: int = None) -> dict:
+    """
+    Compares the analytic estimate against simulation runs.
+    :param configurations: Agent data per configuration name
+    :param replications: Simulated replications per configuration
+    :param engine: REFERENCE for replications.run_replications, BATCHED for batched.run_batched_replications
+    :param processes: Worker processes of the reference engine, see replications.run_replications
+    :return: Per configuration the estimate, the simulated rate with its standard error, the distance between both
+        in standard errors and the time the estimate took, plus the bias with its standard error, mean absolute error,
+        RMSE and rank correlation over all configurations
+    """
+    from batched import run_batched_replications
+    from replications import run_replications
+    from world import World
+
+    if engine not in (REFERENCE, BATCHED):
+        raise ValueError(f"Unknown calibration engine {engine}")
+
+    scenario_data = settings.AGENT_DATA
+    report = {"configurations": {}}
+    try:
+        for name, agent_data in configurations.items():
+            settings.set_scenario(agent_data)
+            random.seed(seed)
+            np.random.seed(seed)
+            settings.world_time = 0
+            world = World(plot=False)
+
+            start = time.perf_counter()
+            estimate = AnalyticEstimator(world).estimate()["detection_rate"]
+            elapsed = time.perf_counter() - start
+
+            if engine == REFERENCE:
+                results = run_replications(world, list(range(seed, seed + replications)), simulation_time,
+                                           processes=processes)
+            else:
+                results = run_batched_replications(world, replications, seed=seed, simulation_time=simulation_time)
+            rates = np.array([r["detection_rate"] for r in results if not math.isnan(r["detection_rate"])])
+            simulated = float(rates.mean()) if len(rates) else math.nan
+            error = float(rates.std(ddof=1) / math.sqrt(len(rates))) if len(rates) > 1 else math.nan
+            errors_off = abs(estimate - simulated) / error if error > 0 else math.nan
+            report["configurations"][name] = {"estimate": estimate, "simulated": simulated,
+                                              "standard_error": error, "errors_off": errors_off,
+                                              "estimate_seconds": elapsed}
+            logger.info(f"Calibration {name}: estimate {estimate:.4f}, simulated {simulated:.4f} +- {error:.4f}")
+            if errors_off > BIAS_WARNING_ERRORS:
+                logger.warning(f"Calibration {name}: estimate is {errors_off:.1f} standard errors off the "
+                               f"{engine} engine")
+    finally:
+        settings.set_scenario(scenario_data)
+        settings.world_time = 0
+
+    entries = [c for c in report["configurations"].values() if not math.isnan(c["simulated"])]
+    estimates = np.array([c["estimate"] for c in entries])
+    simulated = np.array([c["simulated"] for c in entries])
+    difference = estimates - simulated
+    report["engine"] = engine
+    report["bias"] = float(difference.mean()) if len(entries) else math.nan
+    report["bias_standard_error"] = float(np.sqrt(np.nansum([c["standard_error"] ** 2 for c in entries]))
+                                          / len(entries)) if len(entries) else math.nan
+    report["mean_absolute_error"] = float(np.abs(difference).mean()) if len(entries) else math.nan
+    report["rmse"] = float(np.sqrt((difference ** 2).mean())) if len(entries) else math.nan
+    report["rank_correlation"] = rank_correlation(estimates, simulated)
+    return report
+
+
+def rank_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Spearman rank correlation (ties broken by order), nan for fewer than two values or constant ranks
+    """
+    if len(a) < 2:
+        return math.nan
+    rank_a = np.argsort(np.argsort(a, kind="stable"), kind="stable").astype(float)
+    rank_b = np.argsort(np.argsort(b, kind="stable"), kind="stable").astype(float)
+    if rank_a.std() == 0 or rank_b.std() == 0:
+        return math.nan
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def format_calibration(report: dict) -> str:
+    lines = [f"{'configuration':<24} {'estimate':>9} {'simulated':>10} {'std err':>8} {'errors':>7} {'ms':>8}"]
+    flagged = []
+    for name, c in report["configurations"].items():
+        if c["errors_off"] > BIAS_WARNING_ERRORS:
+            flagged.append(name)
+        lines.append(f"{name:<24} {c['estimate']:9.4f} {c['simulated']:10.4f} {c['standard_error']:8.4f} "
+                     f"{c['errors_off']:7.1f} {c['estimate_seconds'] * 1000:8.2f}")
+    lines.append(f"bias {report['bias']:.4f} +- {report['bias_standard_error']:.4f}, "
+                 f"mean absolute error {report['mean_absolute_error']:.4f}, rmse {report['rmse']:.4f}, "
+                 f"rank correlation {report['rank_correlation']:.3f} (against the {report['engine']} engine)")
+    if flagged:
+        lines.append(f"WARNING: the estimate is more than {BIAS_WARNING_ERRORS} standard errors off the simulation "
+                     f"for {', '.join(flagged)}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    from comparison import variant_agent_data
+    from world import World
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calibrate", type=float, nargs="*", default=None, metavar="SCALE",
+                        help="Calibrate against simulation for the fleet scaled by each factor")
+    parser.add_argument("--engine", choices=[REFERENCE, BATCHED], default=REFERENCE,
+                        help="Simulation engine the calibration compares against")
+    parser.add_argument("--replications", type=int, default=16)
+    parser.add_argument("--simulation-time", type=float, default=None)
+    args = parser.parse_args()
+
+    settings.load_scenario()
+    if args.calibrate is None:
+        world = World(plot=False)
+        start = time.perf_counter()
+        result = AnalyticEstimator(world).estimate()
+        print(f"Estimated detection rate {result['detection_rate']:.4f} "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for model, values in result["types"].items():
+            print(f"{model:<24} on station {values['on_station']:.3f}, sweep width {values['sweep_width']:.1f}")
+    else:
+        configurations = {}
+        for scale in args.calibrate:
+            quantities = {model: max(int(round(values["quantity"] * scale)), 0)
+                          for model, values in settings.AGENT_DATA.items() if values["team"] == settings.SEARCHER}
+            configurations[f"fleet x{scale:g}"] = variant_agent_data(quantities)
+        print(format_calibration(calibrate(configurations, args.replications, args.simulation_time,
+                                           engine=args.engine)))
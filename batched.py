@@ -0,0 +1,414 @@
+"""
+Batched replications: R replications of one scenario advance in lockstep in a single process.
+
+Every piece of dynamic state is an array with a leading replication axis: searcher positions, endurance and status
+(R, agents), the shared route cursors of the patrol locations (R, locations), the traveller pool (R, slots) and the
+sea states (R, receptors). Each step runs movement, detection and the weather update as a handful of array operations
+over all replications at once, so the Python overhead per tick is paid once for R replications instead of R times.
+The weather of every replication draws its own Perlin noise field per tick, the fields of all replications are
+evaluated in one call of weather.uniform_fields. Every replication keeps its own DetectionStatistics.
+
+The step follows World.simulate with the semantics of the object model, with these simplifications:
+    - steps are always TIME_DELTA, boustrophedon routes only (no pheromone search), travellers fly straight (no
+      evasive travel), no coverage or trajectory trace
+    - zones of suspended patrol locations are not handed to their neighbours, they are resumed when an agent is free
+    - agents sharing a zone during a handover follow the shared route cursor concurrently instead of one by one
+    - air searchers outside the receptor grid see the DEFAULT_SEA_STATE
+All replications start from the current state of the given world.
+"""
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+
+import checkpoint
+import settings
+import scenario
+import weather
+from aggregators import DetectionStatistics
+from manager import TravelManager
+
+logger = logging.getLogger(__name__)
+
+# Movement sub-steps after which an agent is considered stuck, as in Agent.move_through_route
+MAX_MOVE_ITERATIONS = 100
+# Tolerance on maintenance end times, see fleet.TIME_TOLERANCE
+TIME_TOLERANCE = 1e-9
+
+
+class BatchedSimulation:
+    def __init__(self, world, replications: int, seed: int = None, weather_fields: np.ndarray = None):
+        """
+        :param world: World providing the layout and the initial state of every replication
+        :param replications: Number of replications R
+        :param seed: Seed of the random generator of the batch
+        :param weather_fields: Optional (t, n_receptors) noise fields, see weather.precompute_weather_fields. All
+            replications then cycle through this shared pool, each from its own offset, so their weather is not
+            independent. By default every replication draws a fresh field per tick like ReceptorGrid.
+        """
+        if settings.SEARCH_BEHAVIOUR == settings.PHEROMONE_SEARCH:
+            raise ValueError("Batched replications only support the boustrophedon search behaviour.")
+        if settings.TRAVEL_BEHAVIOUR == settings.EVASIVE_TRAVEL:
+            raise ValueError("Batched replications only support direct travel.")
+        self.replications = replications
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.time = settings.world_time
+        self.time_step = settings.TIME_DELTA
+        self.grid = world.receptor_grid
+        self.base = np.array([settings.BASE_X, settings.BASE_Y], dtype=float)
+
+        self.init_routes(world.search_manager)
+        self.init_searchers(world.search_manager)
+        self.init_travellers(world.travel_manager)
+        self.init_weather(weather_fields)
+
+        self.aggregates = [DetectionStatistics() for _ in range(replications)]
+        self.stats = [[] for _ in range(replications)]
+
+    def init_routes(self, search_manager) -> None:
+        patrol_locations = search_manager.patrol_locations
+        self.waypoints, self.route_offsets = checkpoint.flatten([pl.boustrophedon_path.coordinates
+                                                                 for pl in patrol_locations])
+        self.route_lengths = np.diff(self.route_offsets)
+        cursors = np.array([pl.boustrophedon_path.cursor for pl in patrol_locations], dtype=np.int64)
+        self.cursor = np.tile(cursors, (self.replications, 1))
+        self.suspended = np.tile(np.array([pl.suspended for pl in patrol_locations], dtype=bool),
+                                 (self.replications, 1))
+        self.zone_type = np.full(len(patrol_locations), -1, dtype=np.int64)
+        for type_index, at in enumerate(search_manager.agent_types):
+            for pl in at.patrol_locations:
+                self.zone_type[pl.zone_index] = type_index
+
+    def init_searchers(self, search_manager) -> None:
+        """
+        Agents are stored type by type, self.type_slices[t] selects the agents of type t.
+        """
+        agents, status = [], []
+        self.type_slices = []
+        for at in search_manager.agent_types:
+            start = len(agents)
+            for state, group in ((checkpoint.ACTIVE, at.active_agents), (checkpoint.INACTIVE, at.inactive_agents),
+                                 (checkpoint.MAINTENANCE, at.maintenance_agents)):
+                agents.extend(group)
+                status.extend([state] * len(group))
+            self.type_slices.append(slice(start, len(agents)))
+        for a in agents:
+            if a.route is not None and not a.returning and a.route is not a.patrol_location.boustrophedon_path:
+                raise ValueError(f"{a} is not on the route of its patrol location.")
+
+        self.speed = np.array([a.speed for a in agents], dtype=float)
+        self.endurance = np.array([a.endurance for a in agents], dtype=float)
+        self.maintenance_time = np.array([a.maintenance_time for a in agents], dtype=float)
+        self.air_searcher = np.array([a.domain_code != scenario.SURFACE_CODE for a in agents], dtype=bool)
+        self.skill_code = np.array([a.skill_code for a in agents], dtype=np.int64)
+
+        def tiled(values, dtype):
+            return np.tile(np.array(values, dtype=dtype), (self.replications, 1))
+
+        self.status = tiled(status, np.int8)
+        self.x = tiled([a.location.x for a in agents], float)
+        self.y = tiled([a.location.y for a in agents], float)
+        self.remaining_endurance = tiled([a.remaining_endurance for a in agents], float)
+        self.maintenance_end = tiled([a.maintenance_end for a in agents], float)
+        self.return_distance = tiled([a.current_return_distance for a in agents], float)
+        self.returning = tiled([a.returning for a in agents], bool)
+        self.called_replacement = tiled([a.called_replacement for a in agents], bool)
+        self.zone = tiled([-1 if a.patrol_location is None else a.patrol_location.zone_index for a in agents],
+                          np.int64)
+
+    def init_travellers(self, travel_manager) -> None:
+        travellers = list(travel_manager.active_agents)
+        if any(t.speed != TravelManager.TRAVELLER_SPEED for t in travellers):
+            raise ValueError("Batched replications assume all travellers have the TravelManager placeholder speed.")
+        capacity = max(2 * len(travellers), 16)
+        self.traveller_x = np.zeros((self.replications, capacity))
+        self.traveller_y = np.zeros((self.replications, capacity))
+        self.traveller_spawn = np.zeros((self.replications, capacity))
+        self.traveller_alive = np.zeros((self.replications, capacity), dtype=bool)
+        for slot, t in enumerate(travellers):
+            self.traveller_x[:, slot], self.traveller_y[:, slot] = t.location.x, t.location.y
+            self.traveller_spawn[:, slot] = t.spawn_time
+            self.traveller_alive[:, slot] = True
+
+        self.traveller_air_code = scenario.encode(TravelManager.TRAVELLER_AIR_VISIBILITY, scenario.SIZE_CLASSES,
+                                                  "air visibility")
+        self.traveller_surface_code = scenario.encode(TravelManager.TRAVELLER_SURFACE_VISIBILITY,
+                                                      scenario.SIZE_CLASSES, "surface visibility")
+
+    def init_weather(self, weather_fields: np.ndarray = None) -> None:
+        self.weather_fields = weather_fields
+        if weather_fields is not None:
+            self.weather_offset = self.rng.integers(len(weather_fields), size=self.replications)
+        self.weather_tick = 0
+        self.sea_state = np.tile(self.grid.sea_states, (self.replications, 1))
+        self.transition_tables = weather.transition_tables()
+
+    def simulate(self, until: float = None) -> None:
+        until = settings.SIMULATION_TIME if until is None else until
+        while self.time < until - TIME_TOLERANCE:
+            self.step()
+
+    def step(self) -> None:
+        self.update_searchers()
+        self.update_travellers()
+        self.check_detection()
+        self.update_sea_states()
+        self.time += self.time_step
+
+    def update_searchers(self) -> None:
+        """
+        AgentType.update_agents for all types, followed by the resumption of suspended patrol locations of
+        SearchManager.rebalance_on_capacity_change.
+        """
+        step_end = self.time + self.time_step
+        finished = (self.status == checkpoint.MAINTENANCE) & (self.maintenance_end <= step_end + TIME_TOLERANCE)
+        self.status[finished] = checkpoint.INACTIVE
+        self.remaining_endurance[finished] = np.broadcast_to(self.endurance, self.status.shape)[finished]
+
+        active = self.status == checkpoint.ACTIVE
+        margin = settings.DISTANCE_SAFETY_MARGIN
+        self.returning |= active & ~self.returning & (self.remaining_endurance
+                                                      < (1 + margin) * self.return_distance)
+        requests = active & ~self.called_replacement & (self.remaining_endurance
+                                                        < (2 + margin) * self.return_distance)
+        self.called_replacement |= requests
+
+        travel = np.where(active, self.speed * self.time_step, 0.)
+        replacements, denied = self.dispatch(requests, self.zone)
+        # A replacement moves once when activated and once more with the other agents of the step
+        travel[replacements] = 2 * self.speed[replacements[1]] * self.time_step
+        suspended_now = np.zeros_like(self.suspended)
+        rows, columns = np.nonzero(denied)
+        suspended_now[rows, self.zone[rows, columns]] = True
+        self.suspended |= suspended_now
+        self.move_searchers(travel)
+
+        waiting = self.suspended & ~suspended_now
+        rows, zones = np.nonzero(waiting)
+        resume_requests = np.zeros_like(self.status, dtype=bool)
+        resume_zones = np.full_like(self.zone, -1)
+        # A request per suspended location, placed in the agent slots of its type to reuse dispatch
+        for t, type_slice in enumerate(self.type_slices):
+            of_type = self.zone_type[zones] == t
+            for r in np.unique(rows[of_type]):
+                type_zones = zones[of_type & (rows == r)][:type_slice.stop - type_slice.start]
+                resume_requests[r, type_slice.start:type_slice.start + len(type_zones)] = True
+                resume_zones[r, type_slice.start:type_slice.start + len(type_zones)] = type_zones
+        resumed, _ = self.dispatch(resume_requests, resume_zones)
+        if len(resumed[0]):
+            self.suspended[resumed[0], self.zone[resumed]] = False
+            travel = np.zeros_like(self.x)
+            travel[resumed] = self.speed[resumed[1]] * self.time_step
+            self.move_searchers(travel)
+
+    def dispatch(self, requests: np.ndarray, zones: np.ndarray) -> tuple[tuple, np.ndarray]:
+        """
+        Activates an inactive agent of the same type for every request, in agent order, as far as available.
+        :param requests: (R, agents) mask of requesting agent slots
+        :param zones: (R, agents) patrol location each request is for
+        :return: Indices (rows, agents) of the activated agents and the (R, agents) mask of denied requests
+        """
+        activated_rows, activated_agents = [], []
+        denied = np.zeros_like(requests)
+        for type_slice in self.type_slices:
+            type_requests = requests[:, type_slice]
+            if not type_requests.any():
+                continue
+            inactive = self.status[:, type_slice] == checkpoint.INACTIVE
+            rank = np.cumsum(type_requests, axis=1) - 1
+            granted = type_requests & (rank < inactive.sum(axis=1)[:, None])
+            denied[:, type_slice] = type_requests & ~granted
+            # Inactive agents first, in agent order
+            order = np.argsort(~inactive, axis=1, kind="stable")
+            rows, columns = np.nonzero(granted)
+            chosen = order[rows, rank[rows, columns]] + type_slice.start
+            self.zone[rows, chosen] = zones[rows, columns + type_slice.start]
+            activated_rows.append(rows)
+            activated_agents.append(chosen)
+
+        activated = (np.concatenate(activated_rows) if activated_rows else np.empty(0, dtype=np.int64),
+                     np.concatenate(activated_agents) if activated_agents else np.empty(0, dtype=np.int64))
+        self.status[activated] = checkpoint.ACTIVE
+        self.returning[activated] = False
+        self.called_replacement[activated] = False
+        return activated, denied
+
+    def move_searchers(self, travel: np.ndarray) -> None:
+        """
+        Agent.move_through_route for every agent with a travel budget: patrolling agents follow the shared route of
+        their patrol location, returning agents head for the base and enter maintenance there.
+        :param travel: (R, agents) distance to travel
+        """
+        travel = travel.ravel().copy()
+        x, y = self.x.reshape(-1), self.y.reshape(-1)
+        remaining_endurance = self.remaining_endurance.reshape(-1)
+        returning = self.returning.reshape(-1)
+        zone = self.zone.reshape(-1)
+        agents = self.x.shape[1]
+        moved = travel > 0
+
+        for _ in range(MAX_MOVE_ITERATIONS):
+            movers = np.flatnonzero(travel > 0)
+            if len(movers) == 0:
+                break
+            rows = movers // agents
+            heading_home = returning[movers]
+            mover_zone = np.maximum(zone[movers], 0)
+            waypoint = self.route_offsets[mover_zone] + self.cursor[rows, mover_zone]
+            goal_x = np.where(heading_home, self.base[0], self.waypoints[waypoint, 0])
+            goal_y = np.where(heading_home, self.base[1], self.waypoints[waypoint, 1])
+            distance = np.hypot(goal_x - x[movers], goal_y - y[movers])
+            budget = travel[movers]
+
+            partial = distance > budget
+            share = np.where(partial, budget / np.where(partial, distance, 1.), 0.)
+            x[movers] = np.where(partial, x[movers] * (1 - share) + goal_x * share, goal_x)
+            y[movers] = np.where(partial, y[movers] * (1 - share) + goal_y * share, goal_y)
+            travel[movers] = np.where(partial, 0., budget - distance)
+
+            reached = ~partial
+            remaining_endurance[movers[reached]] -= distance[reached]
+            home = movers[reached & heading_home]
+            travel[home] = 0.
+            self.enter_base(home)
+            on_route = reached & ~heading_home
+            route_rows, route_zones = rows[on_route], mover_zone[on_route]
+            self.cursor[route_rows, route_zones] = (self.cursor[route_rows, route_zones] + 1) \
+                % self.route_lengths[route_zones]
+        else:
+            raise ValueError("Batched searcher movement not converging.")
+
+        patrolling = moved & (self.status.reshape(-1) == checkpoint.ACTIVE)
+        self.return_distance.reshape(-1)[patrolling] = np.hypot(x[patrolling] - self.base[0],
+                                                                y[patrolling] - self.base[1])
+
+    def enter_base(self, flat_indices: np.ndarray) -> None:
+        """
+        Agent.enter_base for the given flat (replication * agents + agent) indices.
+        """
+        agents = self.x.shape[1]
+        maintenance_time = self.maintenance_time[flat_indices % agents]
+        for values, value in ((self.status, checkpoint.MAINTENANCE), (self.returning, False),
+                              (self.called_replacement, False), (self.return_distance, 0.),
+                              (self.x, self.base[0]), (self.y, self.base[1])):
+            values.reshape(-1)[flat_indices] = value
+        self.maintenance_end.reshape(-1)[flat_indices] = self.time + self.time_step + maintenance_time
+
+    def update_travellers(self) -> None:
+        """
+        TravelManager.manage_agents: one entry draw per replication, then every traveller heads for the exit.
+        """
+        entering = np.flatnonzero(self.rng.uniform(0, 1, self.replications) > 1 - TravelManager.ENTRY_PROBABILITY)
+        entry_y = self.rng.uniform(settings.ENTRY_Y_MIN, settings.ENTRY_Y_MAX, self.replications)
+        if len(entering):
+            if self.traveller_alive[entering].all(axis=1).any():
+                self.grow_traveller_pool()
+            slots = np.argmin(self.traveller_alive[entering], axis=1)
+            self.traveller_x[entering, slots] = settings.ENTRY_X
+            self.traveller_y[entering, slots] = entry_y[entering]
+            self.traveller_spawn[entering, slots] = self.time
+            self.traveller_alive[entering, slots] = True
+
+        alive = self.traveller_alive
+        distance = np.hypot(self.base[0] - self.traveller_x, self.base[1] - self.traveller_y)
+        budget = TravelManager.TRAVELLER_SPEED * self.time_step
+        share = np.minimum(budget / np.maximum(distance, budget), 1.)
+        self.traveller_x += np.where(alive, (self.base[0] - self.traveller_x) * share, 0.)
+        self.traveller_y += np.where(alive, (self.base[1] - self.traveller_y) * share, 0.)
+        self.finish_travellers(alive & (distance <= budget), detected=False)
+
+    def grow_traveller_pool(self) -> None:
+        for name in ("traveller_x", "traveller_y", "traveller_spawn", "traveller_alive"):
+            values = getattr(self, name)
+            setattr(self, name, np.concatenate([values, np.zeros_like(values)], axis=1))
+
+    def check_detection(self) -> None:
+        """
+        SearchManager.check_detection: a traveller is detected if any active searcher within MAX_DISCOVER_DISTANCE
+        detects it, surface searchers by range and air searchers with the probability of the sea state below them.
+        """
+        rows, slots = np.nonzero(self.traveller_alive)
+        if len(rows) == 0:
+            return
+        active = self.status[rows] == checkpoint.ACTIVE
+        distance = np.hypot(self.x[rows] - self.traveller_x[rows, slots][:, None],
+                            self.y[rows] - self.traveller_y[rows, slots][:, None])
+        candidate = active & (distance <= settings.MAX_DISCOVER_DISTANCE)
+
+        compiled = settings.COMPILED_SCENARIO
+        surface_range = compiled.detection_range[self.skill_code, self.traveller_surface_code]
+        surface_detected = ~self.air_searcher & (distance <= surface_range)
+
+        probability = compiled.air_detection_probabilities(self.skill_code, self.traveller_air_code,
+                                                           self.searcher_sea_states()[rows], distance)
+        if self.time_step != settings.DETECTION_REFERENCE_TIME:
+            probability = 1 - (1 - probability) ** (self.time_step / settings.DETECTION_REFERENCE_TIME)
+        air_detected = self.air_searcher & (self.rng.uniform(0, 1, distance.shape) < probability)
+
+        detected = (candidate & (surface_detected | air_detected)).any(axis=1)
+        mask = np.zeros_like(self.traveller_alive)
+        mask[rows[detected], slots[detected]] = True
+        self.finish_travellers(mask, detected=True)
+
+    def searcher_sea_states(self) -> np.ndarray:
+        """
+        :return: (R, agents) sea state of the receptor below every searcher
+        """
+        grid = self.grid
+        row = np.minimum(((self.y - grid.area_y_start) / settings.GRID_SIZE).astype(np.int64), grid.max_rows - 1)
+        col = np.minimum(((self.x - grid.area_x_start) / settings.GRID_SIZE).astype(np.int64), grid.max_cols - 1)
+        inside = ((grid.area_x_start <= self.x) & (self.x <= grid.area_x_end)
+                  & (grid.area_y_start <= self.y) & (self.y <= grid.area_y_end))
+        receptor = np.where(inside, grid.dense_to_sparse[np.where(inside, row * grid.max_cols + col, 0)], -1)
+        replication = np.arange(self.replications)[:, None]
+        return np.where(receptor >= 0, self.sea_state[replication, np.maximum(receptor, 0)],
+                        settings.DEFAULT_SEA_STATE)
+
+    def finish_travellers(self, mask: np.ndarray, detected: bool) -> None:
+        """
+        TravelManager.write_to_stat for the travellers in the mask, which leave the pool.
+        """
+        for r, slot in zip(*np.nonzero(mask)):
+            time_spent = float(self.time + self.time_step - self.traveller_spawn[r, slot])
+            self.aggregates[r].update(TravelManager.TRAVELLER_MODEL, detected, time_spent)
+            if settings.KEEP_RAW_STATS:
+                self.stats[r].append({"model": TravelManager.TRAVELLER_MODEL, "detected": detected,
+                                      "time": time_spent})
+        self.traveller_alive &= ~mask
+
+    def update_sea_states(self) -> None:
+        """
+        ReceptorGrid.update_sea_states for all replications: every sea state moves to the first state whose
+        cumulative transition probability exceeds the receptor's uniform value, or stays if none does.
+        """
+        fields = self.weather_fields
+        if fields is None:
+            # One noise seed per replication, drawn like the default seed of PerlinNoise
+            seeds = self.rng.integers(1, 10 ** 5, endpoint=True, size=self.replications).tolist()
+            uniform = weather.uniform_fields(seeds, self.grid.max_rows, self.grid.max_cols)[:, self.grid.dense_indices]
+        else:
+            uniform = fields[(self.weather_offset + self.weather_tick) % len(fields)].astype(float)
+        self.weather_tick += 1
+        self.sea_state = weather.next_sea_states(self.sea_state, uniform, self.transition_tables)
+
+    def summaries(self) -> list[dict]:
+        """
+        :return: One summary per replication, in the format of replications.summarize_replication
+        """
+        return [{"seed": self.seed, "replication": r, "travellers": a.travellers, "detected": a.detected,
+                 "detection_rate": a.detection_rate, "aggregates": a, "stats": self.stats[r]}
+                for r, a in enumerate(self.aggregates)]
+
+
+def run_batched_replications(world, replications: int, seed: int = None, simulation_time: float = None,
+                             weather_fields: np.ndarray = None) -> list[dict]:
+    """
+    Simulates R replications from the state of the world in one batch.
+    :return: List of replication summaries, see BatchedSimulation.summaries
+    """
+    batch = BatchedSimulation(world, replications, seed=seed, weather_fields=weather_fields)
+    batch.simulate(until=simulation_time)
+    logger.info(f"Finished {replications} batched replications at time {batch.time}")
+    return batch.summaries()
@@ -0,0 +1,384 @@
+"""
+Snapshots of a running World, stored as a compressed set of fixed-dtype arrays (numpy .npz, no pickles).
+
+A checkpoint is split in two parts:
+    - static: the patrol layout (centres, receptor owners, hulls and routes) that does not change during a run
+    - dynamic: agents, route cursors, travellers, sea states, statistics, RNG states (including the common random
+      number streams), the world time and the current time step
+
+Restoring rebuilds the World from the arrays without re-running the tessellation, so a warmed-up state can be
+simulated once and forked into many replications with fresh seeds.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import random
+
+import numpy as np
+
+import agent
+from aggregators import DetectionStatistics
+from crn import RandomStreams
+from fleet import IndexedSet
+import points
+import routes
+import settings
+
+logger = logging.getLogger(__name__)
+
+INACTIVE = 0
+ACTIVE = 1
+MAINTENANCE = 2
+
+NO_ROUTE = 0
+BASE_ROUTE = 1
+PATROL_ROUTE = 2
+PHEROMONE_ROUTE = 3
+
+# Settings that determine the layout of the world and are restored along with the checkpoint
+CHECKPOINT_SETTINGS = ["GRID_SIZE", "AREA_BORDER", "SPARSE_GRID", "SPARSE_GRID_HALO", "TIME_DELTA",
+                       "SEARCH_VERTICAL_ALIGNMENT", "STEADY_STATE_START", "SEARCH_BEHAVIOUR"]
+
+
+def flatten(arrays: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stacks a list of (n_i, 2) arrays into one (sum n_i, 2) array plus offsets, such that
+    arrays[i] == flat[offsets[i]:offsets[i + 1]].
+    """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    flat = np.concatenate([np.asarray(a, dtype=float).reshape(-1, 2) for a in arrays]) if arrays else np.empty((0, 2))
+    return flat, offsets
+
+
+def capture_static(world) -> dict:
+    """
+    Collects the patrol layout of the world as arrays.
+    """
+    search_manager = world.search_manager
+    grid = world.receptor_grid
+    patrol_locations = search_manager.patrol_locations
+
+    patrol_types = np.full(len(patrol_locations), -1, dtype=np.int32)
+    for type_index, at in enumerate(search_manager.agent_types):
+        for pl in at.patrol_locations:
+            patrol_types[patrol_locations.index(pl)] = type_index
+
+    route_coordinates, route_offsets = flatten([pl.boustrophedon_path.coordinates for pl in patrol_locations])
+    hull_coordinates, hull_offsets = flatten([[p.get_tuple() for p in pl.convex_hull] for pl in patrol_locations])
+
+    meta = {"settings": {name: getattr(settings, name) for name in CHECKPOINT_SETTINGS},
+            "agent_data": settings.AGENT_DATA,
+            "agent_types": [at.model for at in search_manager.agent_types]}
+
+    return {"meta": np.array(json.dumps(meta)),
+            "receptor_coordinates": grid.coordinates,
+            "receptor_in_zone": grid.in_zone_mask,
+            "receptor_dense_indices": grid.dense_indices,
+            "receptor_dense_to_sparse": grid.dense_to_sparse,
+            "receptor_owner": search_manager.receptor_owner,
+            "patrol_centers": search_manager.patrol_layout(),
+            "patrol_strengths": np.array([pl.strength for pl in patrol_locations], dtype=float),
+            "patrol_radii": np.array([pl.radius for pl in patrol_locations], dtype=float),
+            "patrol_colors": np.array([pl.color_name or "" for pl in patrol_locations], dtype=str),
+            "patrol_types": patrol_types,
+            "route_coordinates": route_coordinates,
+            "route_offsets": route_offsets,
+            "hull_coordinates": hull_coordinates,
+            "hull_offsets": hull_offsets}
+
+
+def capture_dynamic(world) -> dict:
+    """
+    Collects everything that changes during a run as arrays.
+    """
+    world.resume()
+    search_manager = world.search_manager
+    travel_manager = world.travel_manager
+    patrol_index = {pl: index for index, pl in enumerate(search_manager.patrol_locations)}
+
+    searchers = []
+    for type_index, at in enumerate(search_manager.agent_types):
+        for status, agents in ((ACTIVE, at.active_agents),
+                               (INACTIVE, at.inactive_agents),
+                               (MAINTENANCE, at.maintenance_agents)):
+            for a in agents:
+                if a.route is None:
+                    route_kind = NO_ROUTE
+                elif a.patrol_location is not None and a.route is a.patrol_location.boustrophedon_path:
+                    route_kind = PATROL_ROUTE
+                elif isinstance(a.route, routes.PheromoneRoute):
+                    route_kind = PHEROMONE_ROUTE
+                else:
+                    route_kind = BASE_ROUTE
+                searchers.append((type_index, a.agent_id, status, a.location.x, a.location.y, a.remaining_endurance,
+                                  a.remaining_maintenance, a.current_return_distance, a.returning,
+                                  a.called_replacement, patrol_index.get(a.patrol_location, -1), route_kind,
+                                  a.spawn_time, *(a.route.next_point.get_tuple() if route_kind == PHEROMONE_ROUTE
+                                                  else (np.nan, np.nan))))
+    searcher_columns = list(zip(*searchers)) if searchers else [()] * 15
+
+    travellers = travel_manager.active_agents
+    stats = travel_manager.stats
+
+    python_state = random.getstate()
+    numpy_state = np.random.get_state()
+    streams = settings.random_streams
+    stream_states = [] if streams is None else [streams.arrivals.getstate(), streams.weather.getstate()]
+
+    return {"world_time": np.array(settings.world_time, dtype=float),
+            "time_step": np.array(settings.time_step, dtype=float),
+            "stream_seed": np.array(-1 if streams is None else streams.seed, dtype=np.int64),
+            "stream_rng_states": np.array([state[1] for state in stream_states], dtype=np.uint64).reshape(-1, 625),
+            "stream_rng_gauss": np.array([np.nan if state[2] is None else state[2] for state in stream_states],
+                                         dtype=float),
+            "counters": np.array([agent.agent_id, points.point_id, world.receptor_grid.weather_tick],
+                                 dtype=np.int64),
+            "patrol_cursors": np.array([pl.boustrophedon_path.cursor for pl in search_manager.patrol_locations],
+                                       dtype=np.int64),
+            "patrol_suspended": np.array([pl.suspended for pl in search_manager.patrol_locations], dtype=bool),
+            "searcher_type": np.array(searcher_columns[0], dtype=np.int32),
+            "searcher_id": np.array(searcher_columns[1], dtype=np.int64),
+            "searcher_status": np.array(searcher_columns[2], dtype=np.int8),
+            "searcher_x": np.array(searcher_columns[3], dtype=float),
+            "searcher_y": np.array(searcher_columns[4], dtype=float),
+            "searcher_endurance": np.array(searcher_columns[5], dtype=float),
+            "searcher_maintenance": np.array(searcher_columns[6], dtype=float),
+            "searcher_return_distance": np.array(searcher_columns[7], dtype=float),
+            "searcher_returning": np.array(searcher_columns[8], dtype=bool),
+            "searcher_called_replacement": np.array(searcher_columns[9], dtype=bool),
+            "searcher_patrol": np.array(searcher_columns[10], dtype=np.int32),
+            "searcher_route": np.array(searcher_columns[11], dtype=np.int8),
+            "searcher_spawn_time": np.array(searcher_columns[12], dtype=float),
+            "searcher_goal_x": np.array(searcher_columns[13], dtype=float),
+            "searcher_goal_y": np.array(searcher_columns[14], dtype=float),
+            "traveller_model": np.array([t.model for t in travellers], dtype=str),
+            "traveller_id": np.array([t.agent_id for t in travellers], dtype=np.int64),
+            "traveller_target": np.array([-1 if t.target_id is None else t.target_id for t in travellers],
+                                         dtype=np.int64),
+            "traveller_entries": np.array(travel_manager.entries, dtype=np.int64),
+            "traveller_x": np.array([t.location.x for t in travellers], dtype=float),
+            "traveller_y": np.array([t.location.y for t in travellers], dtype=float),
+            "traveller_speed": np.array([t.speed for t in travellers], dtype=float),
+            "traveller_spawn_time": np.array([t.spawn_time for t in travellers], dtype=float),
+            "traveller_air_visibility": np.array([t.air_visibility for t in travellers], dtype=str),
+            "traveller_surface_visibility": np.array([t.surface_visibility for t in travellers], dtype=str),
+            "sea_state": world.receptor_grid.sea_states.astype(np.int8),
+            "last_uniform_value": world.receptor_grid.last_uniform_values,
+            "new_uniform_value": world.receptor_grid.new_uniform_values,
+            "pheromones": world.receptor_grid.pheromones,
+            "stats_aggregates": np.array(json.dumps(travel_manager.aggregates.to_dict())),
+            "stats_model": np.array([s["model"] for s in stats], dtype=str),
+            "stats_detected": np.array([s["detected"] for s in stats], dtype=bool),
+            "stats_time": np.array([s["time"] for s in stats], dtype=float),
+            "python_rng_state": np.array(python_state[1], dtype=np.uint64),
+            "python_rng_gauss": np.array(np.nan if python_state[2] is None else python_state[2]),
+            "numpy_rng_keys": numpy_state[1],
+            "numpy_rng_position": np.array([numpy_state[2], numpy_state[3]], dtype=np.int64),
+            "numpy_rng_gauss": np.array(numpy_state[4], dtype=float)}
+
+
+def save_checkpoint(world, path: str) -> None:
+    """
+    Writes the full state of the world at the current world time to a compressed .npz file.
+    """
+    np.savez_compressed(path, **capture_static(world), **capture_dynamic(world))
+    logger.info(f"Saved checkpoint at world time {settings.world_time} to {path}")
+
+
+def build_world(static) -> "World":
+    """
+    Creates a headless World from the static arrays, without running the tessellation.
+    Agents are all inactive at the base, apply dynamic arrays (or activate the patrol locations) afterwards.
+    :param static: Mapping with the arrays produced by capture_static
+    """
+    from world import World, initiate_world_polygon
+    from receptors import ReceptorGrid
+    from manager import SearchManager, TravelManager
+    from coverage import CoverageMap
+
+    meta = json.loads(str(static["meta"]))
+    for name, value in meta["settings"].items():
+        setattr(settings, name, value)
+    settings.set_scenario(meta["agent_data"])
+
+    world = World.__new__(World)
+    world.fig = None
+    world.ax = None
+    world.live_view = None
+    world.recorder = None
+    world.callbacks = []
+    world.stop_conditions = []
+    settings.world = world
+    initiate_world_polygon()
+
+    world.receptor_grid = ReceptorGrid(layout={name: static[name] for name in ("receptor_coordinates",
+                                                                              "receptor_in_zone",
+                                                                              "receptor_dense_indices",
+                                                                              "receptor_dense_to_sparse")})
+    if "weather_fields" in static:
+        world.receptor_grid.weather_fields = static["weather_fields"]
+
+    search_manager = SearchManager(tessellate=False)
+    world.search_manager = search_manager
+    if [at.model for at in search_manager.agent_types] != meta["agent_types"]:
+        raise ValueError(f"Checkpoint agent types {meta['agent_types']} do not match the scenario.")
+
+    for index, ((x, y), strength, radius, color, type_index) in enumerate(zip(static["patrol_centers"],
+                                                                            static["patrol_strengths"],
+                                                                            static["patrol_radii"],
+                                                                            static["patrol_colors"],
+                                                                            static["patrol_types"])):
+        pl = points.PatrolLocation(float(x), float(y), strength=float(strength), radius=float(radius),
+                                   color=str(color) or None)
+        search_manager.patrol_locations.append(pl)
+        if type_index >= 0:
+            search_manager.agent_types[type_index].patrol_locations.append(pl)
+
+        route_offsets, hull_offsets = static["route_offsets"], static["hull_offsets"]
+        pl.set_route(static["hull_coordinates"][hull_offsets[index]:hull_offsets[index + 1]],
+                     static["route_coordinates"][route_offsets[index]:route_offsets[index + 1]])
+
+    owner = np.asarray(static["receptor_owner"])
+    search_manager.update_patrol_assignments(owner[world.receptor_grid.in_zone_mask])
+
+    world.travel_manager = TravelManager()
+    world.coverage = CoverageMap(world.receptor_grid, search_manager) if settings.TRACK_COVERAGE else None
+    world.suspend()
+    return world
+
+
+def apply_dynamic(world, dynamic) -> None:
+    """
+    Overwrites the agents, travellers, weather, statistics and RNG states of a world built by build_world.
+    :param dynamic: Mapping with the arrays produced by capture_dynamic
+    """
+    from manager import exit_point
+
+    search_manager = world.search_manager
+    travel_manager = world.travel_manager
+    settings.world_time = float(dynamic["world_time"])
+    settings.time_step = float(dynamic["time_step"])
+    settings.random_streams = None
+    if int(dynamic["stream_seed"]) >= 0:
+        settings.random_streams = RandomStreams(int(dynamic["stream_seed"]))
+        for stream, state, gauss in zip((settings.random_streams.arrivals, settings.random_streams.weather),
+                                        dynamic["stream_rng_states"], dynamic["stream_rng_gauss"].tolist()):
+            stream.setstate((3, tuple(int(v) for v in state), None if np.isnan(gauss) else gauss))
+
+    for pl, cursor in zip(search_manager.patrol_locations, dynamic["patrol_cursors"]):
+        pl.boustrophedon_path.cursor = int(cursor)
+    for pl, suspended in zip(search_manager.patrol_locations, dynamic["patrol_suspended"]):
+        pl.suspended = bool(suspended)
+        pl.boustrophedon_path.next_point = None
+
+    pools = {}
+    for type_index, at in enumerate(search_manager.agent_types):
+        pools[type_index] = at.all_agents()
+        at.reset_fleet()
+
+    for index in range(len(dynamic["searcher_id"])):
+        type_index = int(dynamic["searcher_type"][index])
+        at = search_manager.agent_types[type_index]
+        a = pools[type_index].pop(0)
+
+        a.agent_id = int(dynamic["searcher_id"][index])
+        a.location = points.Point(float(dynamic["searcher_x"][index]), float(dynamic["searcher_y"][index]))
+        a.remaining_endurance = float(dynamic["searcher_endurance"][index])
+        a.remaining_maintenance = float(dynamic["searcher_maintenance"][index])
+        a.current_return_distance = float(dynamic["searcher_return_distance"][index])
+        a.returning = bool(dynamic["searcher_returning"][index])
+        a.called_replacement = bool(dynamic["searcher_called_replacement"][index])
+        a.spawn_time = float(dynamic["searcher_spawn_time"][index])
+
+        patrol = int(dynamic["searcher_patrol"][index])
+        a.patrol_location = search_manager.patrol_locations[patrol] if patrol >= 0 else None
+        route_kind = int(dynamic["searcher_route"][index])
+        if route_kind == PATROL_ROUTE:
+            a.route = a.patrol_location.boustrophedon_path
+        elif route_kind == PHEROMONE_ROUTE:
+            goal = points.Point(float(dynamic["searcher_goal_x"][index]), float(dynamic["searcher_goal_y"][index]))
+            a.route = a.patrol_location.create_patrol_route(start=goal)
+        elif route_kind == BASE_ROUTE:
+            a.route = routes.Route([a.base])
+        else:
+            a.route = None
+
+        status = int(dynamic["searcher_status"][index])
+        if status == ACTIVE:
+            at.active_agents.append(a)
+        elif status == MAINTENANCE:
+            at.maintenance_agents.append(a)
+        else:
+            at.inactive_agents.append(a)
+
+    travel_manager.active_agents = IndexedSet()
+    travel_manager.entries = int(dynamic["traveller_entries"])
+    for index in range(len(dynamic["traveller_id"])):
+        target_id = int(dynamic["traveller_target"][index])
+        traveller = agent.Traveller(str(dynamic["traveller_model"][index]),
+                                    endurance=np.inf,
+                                    speed=float(dynamic["traveller_speed"][index]),
+                                    maintenance=0,
+                                    base=exit_point,
+                                    air_visibility=str(dynamic["traveller_air_visibility"][index]),
+                                    surface_visibility=str(dynamic["traveller_surface_visibility"][index]),
+                                    target_id=None if target_id < 0 else target_id)
+        traveller.agent_id = int(dynamic["traveller_id"][index])
+        traveller.spawn_time = float(dynamic["traveller_spawn_time"][index])
+        traveller.location = points.Point(float(dynamic["traveller_x"][index]),
+                                          float(dynamic["traveller_y"][index]))
+        travel_manager.route_traveller(traveller)
+        travel_manager.active_agents.append(traveller)
+
+    travel_manager.aggregates = DetectionStatistics.from_dict(json.loads(str(dynamic["stats_aggregates"])))
+    travel_manager.stats = [{"model": str(model), "detected": bool(detected), "time": float(time)}
+                            for model, detected, time in zip(dynamic["stats_model"],
+                                                             dynamic["stats_detected"],
+                                                             dynamic["stats_time"])]
+
+    world.receptor_grid.sea_states = dynamic["sea_state"].astype(np.int64)
+    world.receptor_grid.last_uniform_values = dynamic["last_uniform_value"].astype(float)
+    world.receptor_grid.new_uniform_values = dynamic["new_uniform_value"].astype(float)
+    world.receptor_grid.pheromones[:] = dynamic["pheromones"]
+    agent.agent_id, points.point_id, world.receptor_grid.weather_tick = (int(c) for c in dynamic["counters"])
+
+    gauss = float(dynamic["python_rng_gauss"])
+    random.setstate((3, tuple(int(v) for v in dynamic["python_rng_state"]), None if np.isnan(gauss) else gauss))
+    position, has_gauss = (int(v) for v in dynamic["numpy_rng_position"])
+    np.random.set_state(("MT19937", dynamic["numpy_rng_keys"], position, has_gauss,
+                         float(dynamic["numpy_rng_gauss"])))
+
+
+def restore_world(path: str, seed: int = None) -> "World":
+    """
+    Rebuilds a headless World from a checkpoint file.
+    :param path: File written by save_checkpoint
+    :param seed: If given, reseeds the random generators (and the common random number streams, if the checkpoint
+        used them) after restoring, giving a fresh replication
+    """
+    # Building draws the first entry, keep it off the streams of the world that ran last
+    settings.random_streams = None
+    with np.load(path, allow_pickle=False) as data:
+        world = build_world(data)
+        apply_dynamic(world, data)
+
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        if settings.random_streams is not None:
+            settings.random_streams = RandomStreams(seed)
+    # The clock and generators of the world are only complete now, see World.resume
+    world.suspend()
+    logger.info(f"Restored checkpoint {path} at world time {settings.world_time}")
+    return world
+
+
+def fork_worlds(path: str, seeds: list[int]):
+    """
+    Yields one restored World per seed, each continuing from the same checkpoint with its own random streams.
+    Every world keeps its own clock and generators (see World.resume), so the forks can also run interleaved.
+    """
+    for seed in seeds:
+        yield restore_world(path, seed=seed)
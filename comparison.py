@@ -0,0 +1,184 @@
+"""
+Paired comparison of two fleet configurations with common random numbers.
+
+Both variants are simulated with the same seeds, and per seed they share the traveller arrivals, the weather and the
+detection draws on every target (see crn.py). The difference in detection rate is estimated from the per-seed
+differences, which vary far less than two independent samples would, so a decision needs fewer replications.
+
+    python comparison.py --baseline test2=2 --alternative test4=4 [--replications 10] [--max-replications 50]
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import logging
+import math
+import random
+from statistics import NormalDist
+
+import numpy as np
+
+import replications
+import settings
+
+logger = logging.getLogger(__name__)
+
+BASELINE = "baseline"
+ALTERNATIVE = "alternative"
+UNDECIDED = "undecided"
+
+
+def variant_agent_data(quantities: dict[str, int], agent_data: dict = None) -> dict:
+    """
+    :param quantities: Number of agents per model, models not given keep their quantity
+    :param agent_data: Defaults to the loaded scenario
+    :return: Copy of the agent data with the given quantities
+    """
+    agent_data = copy.deepcopy(settings.AGENT_DATA if agent_data is None else agent_data)
+    for model, quantity in quantities.items():
+        if model not in agent_data:
+            raise ValueError(f"Unknown model {model}, the scenario has {list(agent_data)}.")
+        agent_data[model]["quantity"] = quantity
+    return agent_data
+
+
+def t_quantile(p: float, df: int) -> float:
+    """
+    Quantile of Student's t distribution. Exact for one and two degrees of freedom, otherwise the Cornish-Fisher
+    expansion around the normal quantile (Abramowitz and Stegun 26.7.5), within 0.005 from three degrees of freedom.
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+
+def paired_difference(baseline: list[dict], alternative: list[dict], confidence: float = 0.95) -> dict:
+    """
+    Difference in detection rate (alternative - baseline) over the seeds both variants ran and had travellers in.
+    :param baseline: Replication summaries of the baseline, see replications.summarize_replication
+    :param alternative: Replication summaries of the alternative
+    :return: Number of pairs, mean difference, its confidence interval and the decision, plus the half width an
+        unpaired comparison of the same runs would have had
+    """
+    alternative_rates = {r["seed"]: r["detection_rate"] for r in alternative}
+    pairs = [(r["detection_rate"], alternative_rates[r["seed"]]) for r in baseline
+             if r["seed"] in alternative_rates
+             and not math.isnan(r["detection_rate"]) and not math.isnan(alternative_rates[r["seed"]])]
+    count = len(pairs)
+    result = {"pairs": count, "confidence": confidence, "mean_difference": math.nan, "std_difference": math.nan,
+              "half_width": math.inf, "interval": (-math.inf, math.inf), "unpaired_half_width": math.inf,
+              "decision": UNDECIDED}
+    if count == 0:
+        return result
+
+    baseline_rates, alternative_rates = np.array(pairs, dtype=float).T
+    differences = alternative_rates - baseline_rates
+    mean = float(differences.mean())
+    result["mean_difference"] = mean
+    if count < 2:
+        return result
+
+    t = t_quantile(0.5 + confidence / 2, count - 1)
+    std = float(differences.std(ddof=1))
+    half_width = t * std / math.sqrt(count)
+    result.update({"std_difference": std, "half_width": half_width, "interval": (mean - half_width, mean + half_width),
+                   "unpaired_half_width": t * math.sqrt((baseline_rates.var(ddof=1)
+                                                         + alternative_rates.var(ddof=1)) / count)})
+    if mean - half_width > 0:
+        result["decision"] = ALTERNATIVE
+    elif mean + half_width < 0:
+        result["decision"] = BASELINE
+    return result
+
+
+def compare_variants(baseline: dict, alternative: dict, seeds: list[int], simulation_time: float = None,
+                     processes: int = None, max_replications: int = None, confidence: float = 0.95,
+                     layout_seed: int = 0) -> dict:
+    """
+    Runs both variants on the same seeds with common random numbers and reports their paired difference.
+    :param baseline: Agent data of the baseline, see variant_agent_data
+    :param alternative: Agent data of the alternative
+    :param seeds: Seeds of the first batch of replications
+    :param simulation_time: Defaults to settings.SIMULATION_TIME
+    :param processes: See replications.run_replications
+    :param max_replications: If given, keeps adding batches of len(seeds) new seeds until the interval excludes zero
+        or this many replications ran
+    :param confidence: Confidence level of the interval
+    :param layout_seed: Seed of the tessellation of both variants
+    :return: paired_difference of all replications, with the replication summaries per variant under "results"
+    """
+    from world import World
+
+    seeds = list(seeds)
+    max_replications = len(seeds) if max_replications is None else max_replications
+    scenario = settings.AGENT_DATA
+    variants = {BASELINE: baseline, ALTERNATIVE: alternative}
+    worlds = {}
+    try:
+        for name, agent_data in variants.items():
+            settings.set_scenario(agent_data)
+            random.seed(layout_seed)
+            np.random.seed(layout_seed)
+            worlds[name] = World(plot=False)
+
+        results = {BASELINE: [], ALTERNATIVE: []}
+        batch = seeds
+        while True:
+            for name, world in worlds.items():
+                # The static layout captured for the replications includes the agent data of the scenario
+                settings.set_scenario(variants[name])
+                results[name].extend(replications.run_replications(world, batch, simulation_time, processes,
+                                                                   common_random_numbers=True))
+            comparison = paired_difference(results[BASELINE], results[ALTERNATIVE], confidence)
+            ran = len(results[BASELINE])
+            logger.info(f"Paired difference after {ran} replications: {comparison['mean_difference']:.4f} "
+                        f"+- {comparison['half_width']:.4f}")
+            if comparison["decision"] != UNDECIDED or ran >= max_replications:
+                break
+            start = max(r["seed"] for r in results[BASELINE]) + 1
+            batch = list(range(start, start + min(len(seeds), max_replications - ran)))
+    finally:
+        settings.set_scenario(scenario)
+
+    comparison["results"] = results
+    return comparison
+
+
+def parse_quantities(values: list[str]) -> dict[str, int]:
+    quantities = {}
+    for value in values:
+        model, _, quantity = value.partition("=")
+        quantities[model] = int(quantity)
+    return quantities
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", nargs="*", default=[], metavar="MODEL=QUANTITY")
+    parser.add_argument("--alternative", nargs="*", default=[], metavar="MODEL=QUANTITY")
+    parser.add_argument("--replications", type=int, default=10)
+    parser.add_argument("--max-replications", type=int, default=None)
+    parser.add_argument("--simulation-time", type=float, default=None)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    args = parser.parse_args()
+
+    settings.load_scenario()
+    outcome = compare_variants(variant_agent_data(parse_quantities(args.baseline)),
+                               variant_agent_data(parse_quantities(args.alternative)),
+                               seeds=list(range(args.replications)), simulation_time=args.simulation_time,
+                               processes=args.processes, max_replications=args.max_replications,
+                               confidence=args.confidence)
+    low, high = outcome["interval"]
+    print(f"Detection rate difference (alternative - baseline) over {outcome['pairs']} pairs: "
+          f"{outcome['mean_difference']:.4f}, {outcome['confidence']:.0%} interval [{low:.4f}, {high:.4f}]")
+    print(f"Unpaired half width would have been {outcome['unpaired_half_width']:.4f}, "
+          f"paired is {outcome['half_width']:.4f}")
+    print(f"Decision: {outcome['decision']}")
@@ -0,0 +1,165 @@
+"""
+Sensor coverage accumulated on the receptor grid.
+
+Every step the detection footprint of each active searcher is stamped onto dense (rows, cols) arrays with a
+precomputed disk stencil, touching only the cells under the sensors. The cost is proportional to the number of
+searchers, not to the grid size. Longer steps are stamped once per base tick along the line each searcher moved, and
+every stamp is weighted by its share of the step, so counts are in base ticks whatever the step size.
+"""
+import logging
+
+import numpy as np
+
+import scenario
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+def disk_stencil(radius_cells: int) -> np.ndarray:
+    """
+    :return: (2r + 1, 2r + 1) boolean mask of the cells whose centre lies within radius_cells of the centre cell
+    """
+    offsets = np.arange(-radius_cells, radius_cells + 1)
+    return offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius_cells ** 2
+
+
+def footprint_radius(agent_type) -> float:
+    """
+    Radius within which an agent type is counted as covering a cell: the surface detection range against
+    COVERAGE_REFERENCE_SIZE, or for air searchers the distance up to which the detection probability against that
+    size (at DEFAULT_SEA_STATE) is at least COVERAGE_MIN_DETECTION_PROBABILITY.
+    Capped at MAX_DISCOVER_DISTANCE, as in SearchManager.check_detection.
+    """
+    compiled = settings.COMPILED_SCENARIO
+    skill = scenario.encode(agent_type.skill_level, scenario.SKILL_LEVELS, "skill level")
+    size = scenario.encode(settings.COVERAGE_REFERENCE_SIZE, scenario.SIZE_CLASSES, "size")
+
+    if agent_type.operating_domain == settings.SURFACE_SEARCHER:
+        radius = compiled.detection_range[skill, size]
+    else:
+        probabilities = compiled.air_detection_table[skill, size, settings.DEFAULT_SEA_STATE]
+        reached = compiled.distance_bins[probabilities >= settings.COVERAGE_MIN_DETECTION_PROBABILITY]
+        radius = reached.max() if len(reached) else 0
+    return float(min(radius, settings.MAX_DISCOVER_DISTANCE))
+
+
+class CoverageMap:
+    def __init__(self, receptor_grid, search_manager):
+        self.receptor_grid = receptor_grid
+        self.search_manager = search_manager
+        self.shape = (receptor_grid.max_rows, receptor_grid.max_cols)
+
+        self.in_zone = receptor_grid.to_dense(receptor_grid.in_zone_mask, fill=False)
+        self.zone_cells = max(int(self.in_zone.sum()), 1)
+
+        agent_types = search_manager.agent_types
+        # Time each cell was last inside the footprint of an agent type, -inf if never
+        self.last_visit = np.full((len(agent_types),) + self.shape, -np.inf, dtype=np.float32)
+        # Number of base ticks each cell was inside any footprint
+        self.visits = np.zeros(self.shape, dtype=np.float32)
+
+        self.stencils = []
+        for at in agent_types:
+            radius_cells = int(footprint_radius(at) // settings.GRID_SIZE)
+            self.stencils.append(disk_stencil(radius_cells))
+
+        # Running sums of the in-zone cells swept per agent type, and the number of base ticks stamped
+        self.swept = np.zeros(len(agent_types))
+        self.stamps = 0.
+        # Location of every active searcher at the last stamp, the start of the line stamped next
+        self.previous = {}
+
+    def cell_of(self, x: float, y: float) -> tuple[int, int]:
+        grid = self.receptor_grid
+        return (int(np.floor((y - grid.area_y_start) / settings.GRID_SIZE)),
+                int(np.floor((x - grid.area_x_start) / settings.GRID_SIZE)))
+
+    def stamp(self, start: float, end: float) -> None:
+        """
+        Stamps the footprint of every active searcher once per base tick (TIME_DELTA) of the step from start to end,
+        at points spread evenly along the straight line from its location at the previous stamp to its current one.
+        Every stamp weighs its share of the step in base ticks, so the sums do not depend on the step size under
+        ADAPTIVE_TIME_STEP. Steps shorter than a base tick get a single stamp at the current location.
+        """
+        ticks = (end - start) / settings.TIME_DELTA
+        count = max(int(np.ceil(ticks - 1e-9)), 1)
+        weight = ticks / count
+        fractions = np.arange(1, count + 1) / count
+
+        rows, cols = self.shape
+        previous = self.previous
+        self.previous = {}
+        for type_index, at in enumerate(self.search_manager.agent_types):
+            stencil = self.stencils[type_index]
+            radius = stencil.shape[0] // 2
+            last_visit = self.last_visit[type_index]
+            cells = 0
+
+            for agent in at.active_agents:
+                x, y = agent.location.x, agent.location.y
+                self.previous[agent] = (x, y)
+                x0, y0 = previous.get(agent, (x, y))
+                for fraction in fractions.tolist():
+                    time = start + fraction * (end - start)
+                    row, col = self.cell_of(x0 + (x - x0) * fraction, y0 + (y - y0) * fraction)
+                    r0, r1 = max(row - radius, 0), min(row + radius + 1, rows)
+                    c0, c1 = max(col - radius, 0), min(col + radius + 1, cols)
+                    if r0 >= r1 or c0 >= c1:
+                        continue
+                    mask = stencil[r0 - row + radius:r1 - row + radius, c0 - col + radius:c1 - col + radius]
+
+                    window = last_visit[r0:r1, c0:c1]
+                    cells += int((mask & (window < time) & self.in_zone[r0:r1, c0:c1]).sum())
+                    window[mask] = time
+                    self.visits[r0:r1, c0:c1] += mask * weight
+
+            self.swept[type_index] += cells * weight
+        self.stamps += ticks
+
+    def time_since_last_visit(self, time: float, type_index: int = None) -> np.ndarray:
+        """
+        :return: (rows, cols) array of the time since a cell was last covered (inf if never), by any agent type or
+            by the given one
+        """
+        last_visit = self.last_visit.max(axis=0) if type_index is None else self.last_visit[type_index]
+        return time - last_visit
+
+    def cumulative_coverage(self) -> np.ndarray:
+        """
+        :return: (rows, cols) array with the number of base ticks each cell was covered
+        """
+        return self.visits
+
+    def coverage_fraction(self, type_index: int = None) -> float:
+        """
+        :return: Share of the in-zone cells covered at least once, by any agent type or by the given one
+        """
+        covered = np.isfinite(self.last_visit if type_index is None else self.last_visit[type_index])
+        if type_index is None:
+            covered = covered.any(axis=0)
+        return float((covered & self.in_zone).sum() / self.zone_cells)
+
+    def coverage_by_patrol_location(self) -> np.ndarray:
+        """
+        :return: (k,) share of the cells of each patrol zone covered at least once
+        """
+        owner = self.receptor_grid.to_dense(self.search_manager.receptor_owner, fill=-1)
+        covered = np.isfinite(self.last_visit).any(axis=0)
+
+        k = len(self.search_manager.patrol_locations)
+        zone = owner >= 0
+        totals = np.bincount(owner[zone], minlength=k)
+        hits = np.bincount(owner[zone & covered], minlength=k)
+        return hits / np.maximum(totals, 1)
+
+    def summary(self) -> dict:
+        """
+        :return: Overall and per agent type covered shares, and the mean share of the zone swept per tick by type
+        """
+        ticks = max(self.stamps, 1.)
+        result = {"covered": self.coverage_fraction()}
+        for type_index, at in enumerate(self.search_manager.agent_types):
+            result[f"{at.model}-covered"] = self.coverage_fraction(type_index)
+            result[f"{at.model}-swept_per_tick"] = float(self.swept[type_index] / ticks / self.zone_cells)
+        return result
@@ -0,0 +1,61 @@
+"""
+Common random numbers for paired comparisons of scenario variants.
+
+RandomStreams splits the randomness of a replication into separate streams: the traveller arrivals, the weather and
+one stream of detection draws per target, keyed by the order in which the targets entered. Two variants simulated
+with the same seed then see the same travellers at the same times, the same weather and the same luck on every
+target, however differently their fleets consume random numbers. Without streams (settings.random_streams is None)
+everything draws from the global generators as before. Checkpoints store the seed and the arrival and weather streams;
+the detection streams of travellers under way restart from their seed on restore.
+"""
+import random
+
+import numpy as np
+
+import settings
+
+ARRIVALS = 0
+WEATHER = 1
+DETECTION = 2
+
+
+def stream_seed(seed: int, *key: int) -> int:
+    """
+    :return: Seed of the stream with the given key, independent of the seeds of all other keys
+    """
+    return int(np.random.SeedSequence([seed, *key]).generate_state(1)[0])
+
+
+class RandomStreams:
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.arrivals = random.Random(stream_seed(seed, ARRIVALS))
+        self.weather = random.Random(stream_seed(seed, WEATHER))
+
+    def detection(self, target_id: int) -> random.Random:
+        return random.Random(stream_seed(self.seed, DETECTION, target_id))
+
+
+def arrival_random():
+    """
+    :return: Generator of the traveller entries, the random module without common random numbers
+    """
+    return random if settings.random_streams is None else settings.random_streams.arrivals
+
+
+def detection_random(target_id: int = None):
+    """
+    :return: Generator of the detection draws on a target, the random module without common random numbers
+    """
+    if settings.random_streams is None or target_id is None:
+        return random
+    return settings.random_streams.detection(target_id)
+
+
+def weather_seed() -> int | None:
+    """
+    :return: Seed of the next Perlin noise field, None (the global generator picks one) without common random numbers
+    """
+    if settings.random_streams is None:
+        return None
+    return settings.random_streams.weather.randint(1, 10 ** 5)
@@ -0,0 +1,408 @@
+"""
+Statistical equivalence of the optimized paths against the object-based reference engine.
+
+Exact tests feed both paths the same random inputs and require identical results:
+    - weather: ReceptorGrid.update_sea_states against BatchedSimulation.update_sea_states on the same noise fields
+    - detection: SearchManager.check_detection against BatchedSimulation.check_detection on the same uniform draws
+    - movement: Agent.move_through_route against BatchedSimulation.move_searchers, no randomness involved
+Distributional tests run replications of both engines on their own random numbers (the reference through
+replications.run_replication, the optimized path as one BatchedSimulation) from the same layout and compare:
+    - sea states: share of time in every sea state per replication, permutation test on the squared distance between
+      the mean shares
+    - detection rates per replication, permutation test on the difference in means
+    - times to detection, two-sample Kolmogorov-Smirnov test
+Every row reports the time per replication of both paths, the speed-up and the p-value, or the number of mismatches
+for the exact tests. A distributional test without observations on either side (e.g. no traveller was detected) is
+inconclusive rather than passed. The harness runs with the searcher fleet scaled down (FLEET_SCALE), as the full fleet
+of the bundled scenario detects every traveller and the detection rates would be trivially equal. In the
+distributional tests both engines sample their own Perlin weather, so the sea state test also covers the noise; the
+exact tests share a pool of BATCH_WEATHER_FIELDS precomputed fields.
+The simulation time has to exceed the time a traveller needs to cross to the exit, otherwise no traveller finishes.
+The command line exits with status 1 unless every test passed.
+
+    python equivalence.py [--replications 16] [--simulation-time 300] [--alpha 0.01] [--fleet-scale 0.25]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import checkpoint
+import comparison
+import events
+import points
+import replications
+import scenario
+import settings
+import weather
+from aggregators import DetectionStatistics
+from batched import BatchedSimulation
+from manager import TravelManager
+
+logger = logging.getLogger(__name__)
+
+EXACT = "exact"
+DISTRIBUTIONAL = "distributional"
+
+# Permutations per permutation test, and the ticks between two samples of the sea states
+PERMUTATIONS = 2000
+SEA_STATE_SAMPLE_EVERY = 10
+# Share of every searcher model kept in the harness, at least one agent per model
+FLEET_SCALE = 0.25
+
+
+class SharedDraws:
+    def __init__(self, values):
+        """
+        Stands in for a random generator with prepared uniform values, handed out one at a time or all at once as an
+        array of the requested shape.
+        """
+        self.values = np.asarray(values, dtype=float)
+        self.position = 0
+
+    def uniform(self, low: float = 0., high: float = 1., size=None):
+        if size is None:
+            value = float(self.values.flat[self.position])
+            self.position += 1
+            return low + (high - low) * value
+        return low + (high - low) * self.values.reshape(size)
+
+
+def permutation_test(a: np.ndarray, b: np.ndarray, statistic, permutations: int = PERMUTATIONS,
+                     seed: int = 0) -> tuple[float, float]:
+    """
+    Two-sample permutation test, the observations are the rows of a and b.
+    :param statistic: Function of two samples, large values speak against equal distributions
+    :return: Observed statistic and its p-value, both NaN if either sample is empty
+    """
+    if len(a) == 0 or len(b) == 0:
+        return math.nan, math.nan
+    rng = np.random.default_rng(seed)
+    pooled = np.concatenate([a, b])
+    observed = statistic(a, b)
+    exceeded = 0
+    for _ in range(permutations):
+        order = rng.permutation(len(pooled))
+        exceeded += statistic(pooled[order[:len(a)]], pooled[order[len(a):]]) >= observed
+    return float(observed), (exceeded + 1) / (permutations + 1)
+
+
+def mean_difference(a: np.ndarray, b: np.ndarray) -> float:
+    return float(abs(a.mean(axis=0) - b.mean(axis=0)).sum())
+
+
+def squared_mean_distance(a: np.ndarray, b: np.ndarray) -> float:
+    return float(((a.mean(axis=0) - b.mean(axis=0)) ** 2).sum())
+
+
+def ks_two_sample(a: np.ndarray, b: np.ndarray) -> tuple[float, float]:
+    """
+    Two-sample Kolmogorov-Smirnov test with the asymptotic p-value (Numerical Recipes 14.3).
+    :return: Largest distance between the empirical distribution functions and its p-value
+    """
+    if len(a) == 0 or len(b) == 0:
+        return math.nan, math.nan
+    a, b = np.sort(a), np.sort(b)
+    values = np.concatenate([a, b])
+    distance = float(np.abs(np.searchsorted(a, values, side="right") / len(a)
+                            - np.searchsorted(b, values, side="right") / len(b)).max())
+    effective = math.sqrt(len(a) * len(b) / (len(a) + len(b)))
+    scale = (effective + 0.12 + 0.11 / effective) * distance
+    if scale < 1e-3:
+        return distance, 1.
+    p = 2 * sum((-1) ** (k - 1) * math.exp(-2 * k ** 2 * scale ** 2) for k in range(1, 101))
+    return distance, min(max(p, 0.), 1.)
+
+
+def row(test: str, kind: str, reference_time: float, optimized_time: float, statistic: float, p_value: float = None,
+        mismatches: int = None, alpha: float = 0.01) -> dict:
+    """
+    :return: Result of one test, "passed" is None for a distributional test without a p-value (inconclusive)
+    """
+    if kind == EXACT:
+        passed = mismatches == 0
+    else:
+        passed = None if math.isnan(p_value) else p_value >= alpha
+    return {"test": test, "kind": kind, "reference_time": reference_time, "optimized_time": optimized_time,
+            "speed_up": reference_time / optimized_time if optimized_time > 0 else math.inf,
+            "statistic": statistic, "p_value": p_value, "mismatches": mismatches, "passed": passed}
+
+
+def batched_agents(search_manager) -> tuple[list, set]:
+    """
+    :return: The searchers in the agent order of BatchedSimulation.init_searchers, and the ids of the active ones
+    """
+    agents = [a for at in search_manager.agent_types
+              for group in (at.active_agents, at.inactive_agents, at.maintenance_agents) for a in group]
+    return agents, {a.agent_id for at in search_manager.agent_types for a in at.active_agents}
+
+
+def exact_weather(path: str, fields: np.ndarray, ticks: int) -> dict:
+    world = checkpoint.restore_world(path)
+    grid = world.receptor_grid
+    grid.weather_fields, grid.weather_tick = fields, 0
+    batch = BatchedSimulation(world, 1, seed=0, weather_fields=fields)
+    batch.weather_offset[:] = 0
+
+    reference_time, optimized_time, mismatches = 0., 0., 0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        grid.update_sea_states()
+        reference_time += time.perf_counter() - start
+        start = time.perf_counter()
+        batch.update_sea_states()
+        optimized_time += time.perf_counter() - start
+        mismatches += int((grid.sea_states != batch.sea_state[0]).sum())
+    return row("weather", EXACT, reference_time / ticks, optimized_time / ticks, statistic=ticks,
+               mismatches=mismatches)
+
+
+def exact_detection(path: str, fields: np.ndarray, repeat: int, seed: int = 0) -> dict:
+    world = checkpoint.restore_world(path)
+    settings.time_step = settings.TIME_DELTA
+    travellers = list(world.travel_manager.active_agents)
+    agents, active = batched_agents(world.search_manager)
+    rng = np.random.default_rng(seed)
+
+    # Travellers still under way are mostly out of reach, move every one next to an active searcher
+    searchers = [a for a in agents if a.agent_id in active]
+    for index, traveller in enumerate(travellers):
+        searcher = searchers[index % len(searchers)]
+        angle, distance = rng.uniform(0, 2 * math.pi), rng.uniform(0, 1.2 * settings.MAX_DISCOVER_DISTANCE)
+        traveller.location = points.Point(searcher.location.x + distance * math.cos(angle),
+                                          searcher.location.y + distance * math.sin(angle))
+    batch = BatchedSimulation(world, 1, seed=0, weather_fields=fields)
+    draws = rng.uniform(size=(len(travellers), len(agents)))
+
+    # The reference draws once per active air searcher in reach of the traveller, in agent order
+    reach = min(settings.MAX_DISCOVER_DISTANCE, settings.MAX_AIR_DETECTION_DISTANCE)
+    drawing = np.array([[a.agent_id in active and a.domain_code == scenario.AIR_CODE
+                         and a.location.distance_to(t.location) <= reach for a in agents]
+                        for t in travellers], dtype=bool).reshape(len(travellers), len(agents))
+    feeds = [SharedDraws(draws[index, drawing[index]]) for index in range(len(travellers))]
+    for traveller, feed in zip(travellers, feeds):
+        traveller.detection_random = feed
+    batch.rng = SharedDraws(draws)
+
+    alive = batch.traveller_alive.copy()
+    reference_time, optimized_time = 0., 0.
+    for _ in range(repeat):
+        for feed in feeds:
+            feed.position = 0
+        start = time.perf_counter()
+        detected = world.search_manager.check_detection(travellers)
+        reference_time += time.perf_counter() - start
+        batch.traveller_alive, batch.aggregates = alive.copy(), [DetectionStatistics()]
+        start = time.perf_counter()
+        batch.check_detection()
+        optimized_time += time.perf_counter() - start
+
+    reference = np.array([t in detected for t in travellers], dtype=bool)
+    optimized = alive[0, :len(travellers)] & ~batch.traveller_alive[0, :len(travellers)]
+    return row("detection", EXACT, reference_time / repeat, optimized_time / repeat, statistic=int(reference.sum()),
+               mismatches=int((reference != optimized).sum()))
+
+
+def exact_movement(path: str, fields: np.ndarray, steps: int) -> dict:
+    world = checkpoint.restore_world(path)
+    settings.time_step = settings.TIME_DELTA
+    batch = BatchedSimulation(world, 1, seed=0, weather_fields=fields)
+    agents, active = batched_agents(world.search_manager)
+    moving = [a.agent_id in active for a in agents]
+
+    reference_time, optimized_time = 0., 0.
+    for _ in range(steps):
+        start = time.perf_counter()
+        for index, a in enumerate(agents):
+            if moving[index] and a.move_through_route() == events.ENTERED_BASE:
+                moving[index] = False
+        reference_time += time.perf_counter() - start
+        start = time.perf_counter()
+        travel = np.where(batch.status == checkpoint.ACTIVE, batch.speed * batch.time_step, 0.)
+        batch.move_searchers(travel)
+        batch.time += batch.time_step
+        optimized_time += time.perf_counter() - start
+        settings.world_time += settings.time_step
+
+    reference = np.array([(a.location.x, a.location.y, a.remaining_endurance) for a in agents])
+    optimized = np.stack([batch.x[0], batch.y[0], batch.remaining_endurance[0]], axis=1)
+    difference = np.abs(reference - optimized)
+    return row("movement", EXACT, reference_time / steps, optimized_time / steps, statistic=float(difference.max()),
+               mismatches=int((difference > 1e-6).any(axis=1).sum()))
+
+
+class SeaStateSampler:
+    def __init__(self, every: int = SEA_STATE_SAMPLE_EVERY):
+        """
+        World callback counting the sea states of all receptors every given number of snapshots.
+        """
+        self.every = every
+        self.calls = 0
+        self.counts = np.zeros(len(scenario.SEA_STATES), dtype=np.int64)
+        self.elapsed = 0.
+
+    def __call__(self, snapshot: dict) -> None:
+        self.calls += 1
+        if self.calls % self.every:
+            return
+        start = time.perf_counter()
+        states = settings.world.receptor_grid.sea_states
+        self.counts += np.bincount(states, minlength=len(self.counts))
+        self.elapsed += time.perf_counter() - start
+
+
+def run_reference(world, seeds: list[int], simulation_time: float) -> tuple[list, np.ndarray, float]:
+    """
+    :return: Replication summaries, (replications, sea states) shares of time and the seconds per replication
+    """
+    static = checkpoint.capture_static(world)
+    summaries, shares, elapsed = [], [], 0.
+    for seed in seeds:
+        sampler = SeaStateSampler()
+        start = time.perf_counter()
+        summaries.append(replications.run_replication(seed, simulation_time, static=static, callbacks=[sampler]))
+        elapsed += time.perf_counter() - start - sampler.elapsed
+        shares.append(sampler.counts / max(sampler.counts.sum(), 1))
+    return summaries, np.array(shares), elapsed / len(seeds)
+
+
+def run_optimized(world, count: int, simulation_time: float, seed: int) -> tuple[list, np.ndarray, float]:
+    """
+    :return: Replication summaries, (replications, sea states) shares of time and the seconds per replication
+    """
+    start = time.perf_counter()
+    batch = BatchedSimulation(world, count, seed=seed)
+    counts = np.zeros((count, len(scenario.SEA_STATES)), dtype=np.int64)
+    sampling = 0.
+    tick = settings.world_time
+    while tick < simulation_time:
+        tick = min(tick + SEA_STATE_SAMPLE_EVERY * settings.TIME_DELTA, simulation_time)
+        batch.simulate(until=tick)
+        sample_start = time.perf_counter()
+        for r in range(count):
+            counts[r] += np.bincount(batch.sea_state[r], minlength=counts.shape[1])
+        sampling += time.perf_counter() - sample_start
+    elapsed = time.perf_counter() - start - sampling
+    return batch.summaries(), counts / np.maximum(counts.sum(axis=1, keepdims=True), 1), elapsed / count
+
+
+def detection_times(summaries: list[dict]) -> np.ndarray:
+    return np.array([record["time"] for summary in summaries for record in summary["stats"] if record["detected"]])
+
+
+def distributional_tests(world, count: int, simulation_time: float, seed: int, alpha: float) -> list[dict]:
+    reference, reference_shares, reference_time = run_reference(world, list(range(seed, seed + count)),
+                                                                simulation_time)
+    settings.world, settings.world_time = world, 0
+    optimized, optimized_shares, optimized_time = run_optimized(world, count, simulation_time, seed)
+
+    rows = []
+    statistic, p_value = permutation_test(reference_shares, optimized_shares, squared_mean_distance, seed=seed)
+    rows.append(row("sea state shares", DISTRIBUTIONAL, reference_time, optimized_time, statistic, p_value,
+                    alpha=alpha))
+
+    rates = [np.array([s["detection_rate"] for s in summaries if not math.isnan(s["detection_rate"])])
+             for summaries in (reference, optimized)]
+    statistic, p_value = permutation_test(rates[0], rates[1], mean_difference, seed=seed)
+    rows.append(row("detection rate", DISTRIBUTIONAL, reference_time, optimized_time, statistic, p_value,
+                    alpha=alpha))
+
+    statistic, p_value = ks_two_sample(detection_times(reference), detection_times(optimized))
+    rows.append(row("time to detection", DISTRIBUTIONAL, reference_time, optimized_time, statistic, p_value,
+                    alpha=alpha))
+    return rows
+
+
+def scaled_fleet(scale: float) -> dict:
+    """
+    :return: Copy of the loaded agent data with every searcher model scaled by the given factor, at least one agent
+    """
+    quantities = {model: max(int(round(values["quantity"] * scale)), 1)
+                  for model, values in settings.AGENT_DATA.items() if values["team"] == settings.SEARCHER}
+    return comparison.variant_agent_data(quantities)
+
+
+def run_harness(replication_count: int = 16, simulation_time: float = 300, warm_up: float = 200, seed: int = 0,
+                alpha: float = 0.01, exact_ticks: int = 50, fleet_scale: float = FLEET_SCALE) -> list[dict]:
+    """
+    Runs all tests on the loaded scenario with a scaled searcher fleet, tessellated with the given seed.
+    :param replication_count: Replications per engine in the distributional tests
+    :param warm_up: Time the reference world runs before the state the exact tests start from
+    :param exact_ticks: Ticks of the exact weather and movement tests, and repeats of the detection test
+    :param fleet_scale: Factor on the number of agents of every searcher model, see scaled_fleet
+    :return: One row per test, see format_report
+    """
+    from world import World
+
+    crossing_time = (settings.ENTRY_X - settings.BASE_X) / TravelManager.TRAVELLER_SPEED
+    if simulation_time <= crossing_time:
+        raise ValueError(f"Simulation time {simulation_time} does not exceed the {crossing_time} a traveller needs to "
+                         f"reach the exit, the detection tests would be inconclusive.")
+
+    scenario_data = settings.AGENT_DATA
+    keep_raw_stats = settings.KEEP_RAW_STATS
+    settings.KEEP_RAW_STATS = True
+    path = os.path.join(tempfile.mkdtemp(), "equivalence.npz")
+    try:
+        settings.set_scenario(scaled_fleet(fleet_scale))
+        random.seed(seed)
+        np.random.seed(seed)
+        settings.world_time = 0
+        world = World(plot=False)
+        rows = distributional_tests(world, replication_count, simulation_time, seed, alpha)
+
+        settings.world, settings.world_time = world, 0
+        fields = weather.precompute_weather_fields(world.receptor_grid, settings.BATCH_WEATHER_FIELDS)
+        world.receptor_grid.weather_fields = fields
+        world.simulate(until=warm_up)
+        checkpoint.save_checkpoint(world, path)
+        rows = [exact_weather(path, fields, exact_ticks),
+                exact_detection(path, fields, exact_ticks, seed),
+                exact_movement(path, fields, exact_ticks)] + rows
+    finally:
+        settings.set_scenario(scenario_data)
+        settings.KEEP_RAW_STATS = keep_raw_stats
+        settings.world_time = 0
+        if os.path.exists(path):
+            os.remove(path)
+    return rows
+
+
+def format_report(rows: list[dict]) -> str:
+    lines = [f"{'test':<18} {'kind':<14} {'reference s':>12} {'optimized s':>12} {'speed-up':>9} {'statistic':>10} "
+             f"{'p-value':>8}  result"]
+    results = {True: "pass", False: "FAIL", None: "inconclusive"}
+    for r in rows:
+        if r["kind"] == EXACT:
+            p_value = f"{r['mismatches']} off"
+        else:
+            p_value = "n/a" if math.isnan(r["p_value"]) else f"{r['p_value']:.4f}"
+        lines.append(f"{r['test']:<18} {r['kind']:<14} {r['reference_time']:12.6f} {r['optimized_time']:12.6f} "
+                     f"{r['speed_up']:9.1f} {r['statistic']:10.4g} {p_value:>8}  {results[r['passed']]}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replications", type=int, default=16)
+    parser.add_argument("--simulation-time", type=float, default=300)
+    parser.add_argument("--warm-up", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--alpha", type=float, default=0.01)
+    parser.add_argument("--fleet-scale", type=float, default=FLEET_SCALE)
+    args = parser.parse_args()
+
+    settings.load_scenario()
+    report = run_harness(args.replications, args.simulation_time, args.warm_up, args.seed, args.alpha,
+                         fleet_scale=args.fleet_scale)
+    print(format_report(report))
+    if not all(r["passed"] for r in report):
+        sys.exit(1)
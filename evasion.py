@@ -0,0 +1,274 @@
+"""
+Cost-to-go field that lets travellers route around the patrol zones.
+
+For every cell of the receptor grid inside the world polygon the field holds the least cost of reaching the exit at
+the base, where the cost of a path is its travel time plus EVASION_RISK_WEIGHT times the expected number of detections
+along it. The detection rate of a zone follows the random search model of analytic.py: the area swept per unit of time
+by the agent type on station, over the area of the zone. The searcher is equally likely anywhere in its zone and
+detects within its sensor reach, so the rate of a cell is the mean zone rate over the disk of sensor reach around it.
+Cells deep inside a zone get its full rate, cells along the polygon edge about half of it, and the zones of suspended
+patrol locations none. Cells outside the world polygon are impassable.
+
+The field is computed with Dijkstra's algorithm over the 8-connected cells, seeded at the exit: from every cell whose
+straight leg to the exit leaves the polygon through its western edge a traveller may fly straight out, at the cost of
+the leg priced by the rates of the cells it crosses. The field stores the next cell on the best path from every cell,
+-1 for the final leg. Travellers follow these next cells (routes.FieldRoute), so a step costs O(1) whatever the layout.
+After the patrol layout changed only the cells whose best path ran through a cell or a leg of changed cost are
+recomputed.
+"""
+import heapq
+import logging
+import math
+import time
+
+import numpy as np
+
+import analytic
+import coverage
+import points
+import settings
+
+logger = logging.getLogger(__name__)
+
+# (row offset, col offset, length in cells) of the 8 neighbours of a cell
+NEIGHBOURS = [(dr, dc, math.hypot(dr, dc)) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+
+
+def spread(values: np.ndarray, stencil: np.ndarray) -> np.ndarray:
+    """
+    :return: (rows, cols) array with per cell the mean value within the (odd sized, centred) stencil around it,
+        cells beyond the array counting as 0
+    """
+    radius = stencil.shape[0] // 2
+    rows, cols = values.shape
+    padded = np.pad(values, radius)
+    result = np.zeros(values.shape)
+    for dr, dc in np.argwhere(stencil).tolist():
+        result += padded[dr:dr + rows, dc:dc + cols]
+    return result / stencil.sum()
+
+
+class CostToGoField:
+    def __init__(self, receptor_grid, search_manager, speed: float):
+        """
+        :param receptor_grid: Grid the field is laid over
+        :param search_manager: Provides the patrol zones, read again on every refresh
+        :param speed: Speed of the travellers following the field
+        """
+        self.grid = receptor_grid
+        self.search_manager = search_manager
+        self.speed = speed
+        self.rows, self.cols = receptor_grid.max_rows, receptor_grid.max_cols
+
+        # Area swept per unit of time by the agent on station at a patrol location, per agent type
+        relative_speed = [math.hypot(at.speed, speed) for at in search_manager.agent_types]
+        self.type_rates = np.array([analytic.on_station_fraction(at) * analytic.sweep_width(at, w) * w
+                                    for at, w in zip(search_manager.agent_types, relative_speed)])
+        # Cells within sensor reach of a cell, per agent type
+        self.stencils = [coverage.disk_stencil(int(at.sensor_reach() // settings.GRID_SIZE))
+                         for at in search_manager.agent_types]
+
+        # Cells lie at the receptor locations, the ones inside the world polygon are passable
+        cells = np.arange(self.rows * self.cols)
+        self.cell_x = receptor_grid.area_x_start + (cells % self.cols) * settings.GRID_SIZE
+        self.cell_y = receptor_grid.area_y_start + (cells // self.cols) * settings.GRID_SIZE
+        inside = receptor_grid.to_dense(receptor_grid.in_zone_mask, fill=False)
+        self.inside = inside.ravel()
+        inside_cols = np.flatnonzero(inside.any(axis=0))
+        self.entry_cells = cells[self.inside & (cells % self.cols == inside_cols[-1])]
+        self.exit_cells = cells[self.inside & self.leaves_west(self.cell_x, self.cell_y)]
+
+        # Detection rate and cost per unit of length of every cell, the cost of the straight leg to the exit (inf where
+        # there is none), and per cell the cost to go and the next cell (-1 for the exit)
+        self.detection_rate = None
+        self.cost = None
+        self.exit_cost = None
+        self.distance = np.full(len(cells), math.inf)
+        self.next_cell = np.full(len(cells), -1, dtype=np.int64)
+        self.refresh_time = -math.inf
+
+    @staticmethod
+    def leaves_west(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        :return: Mask of the locations whose straight leg to the exit crosses the western boundary of the world
+            polygon on its edge, so that the leg only leaves the (convex) polygon towards the exit
+        """
+        import shapely
+        west = settings.WORLD_POLYGON.bounds[0]
+        share = (x - west) / np.maximum(x - settings.BASE_X, 1e-9)
+        crossing_y = y + (settings.BASE_Y - y) * share
+        return shapely.intersects_xy(settings.WORLD_POLYGON, np.full(len(x), west), crossing_y)
+
+    def leg_costs(self, x: np.ndarray, y: np.ndarray, target_x: np.ndarray, target_y: np.ndarray) -> np.ndarray:
+        """
+        :return: Cost of flying straight from every (x, y) to its target: the travel time plus EVASION_RISK_WEIGHT
+            times the detection rate of the cells passed, sampled every half cell (0 beyond the grid)
+        """
+        length = np.hypot(target_x - x, target_y - y)
+        samples = np.maximum(np.ceil(length / (settings.GRID_SIZE / 2)), 1).astype(np.int64)
+        exposure = np.zeros(len(x))
+        for k in range(int(samples.max(initial=0))):
+            legs = np.flatnonzero(samples > k)
+            share = (k + 0.5) / samples[legs]
+            col = np.rint((x[legs] + (target_x[legs] - x[legs]) * share - self.grid.area_x_start)
+                          / settings.GRID_SIZE).astype(np.int64)
+            row = np.rint((y[legs] + (target_y[legs] - y[legs]) * share - self.grid.area_y_start)
+                          / settings.GRID_SIZE).astype(np.int64)
+            on_grid = (0 <= row) & (row < self.rows) & (0 <= col) & (col < self.cols)
+            rate = np.where(on_grid, self.detection_rate[np.where(on_grid, row * self.cols + col, 0)], 0.)
+            exposure[legs] += rate * length[legs] / samples[legs]
+        return (length + settings.EVASION_RISK_WEIGHT * exposure) / self.speed
+
+    def detection_rates(self) -> np.ndarray:
+        """
+        :return: Expected detections per unit of time, per cell of the current layout
+        """
+        search_manager = self.search_manager
+        zone_owner = search_manager.zone_owner.ravel()
+        zones = len(search_manager.patrol_locations)
+        area = np.bincount(zone_owner[zone_owner >= 0], minlength=zones) * settings.GRID_SIZE ** 2
+        zone_type = np.zeros(zones, dtype=np.int64)
+        for type_index, at in enumerate(search_manager.agent_types):
+            for pl in at.patrol_locations:
+                zone_type[pl.zone_index] = type_index
+        suspended = np.array([pl.suspended for pl in search_manager.patrol_locations], dtype=bool)
+
+        zone_rate = np.where(suspended | (area == 0), 0., self.type_rates[zone_type] / np.maximum(area, 1))
+        owner_rate = np.where(zone_owner >= 0, zone_rate[np.maximum(zone_owner, 0)], 0.)
+        owner_type = np.where(zone_owner >= 0, zone_type[np.maximum(zone_owner, 0)], -1)
+
+        # The zones of one type do not overlap, the rates of different types add up
+        detection_rate = np.zeros((self.rows, self.cols))
+        for type_index, stencil in enumerate(self.stencils):
+            type_rate = np.where(owner_type == type_index, owner_rate, 0.).reshape(self.rows, self.cols)
+            detection_rate += spread(type_rate, stencil)
+        return detection_rate.ravel()
+
+    def refresh(self) -> int:
+        """
+        Brings the field up to date with the patrol layout.
+        :return: Number of cells recomputed
+        """
+        start = time.perf_counter()
+        self.refresh_time = settings.world_time
+        detection_rate = self.detection_rates()
+        if self.detection_rate is not None and (detection_rate == self.detection_rate).all():
+            return 0
+        self.detection_rate = detection_rate
+        cost = np.where(self.inside, (1 + settings.EVASION_RISK_WEIGHT * detection_rate) / self.speed, math.inf)
+        exit_cost = np.full(len(cost), math.inf)
+        exit_cost[self.exit_cells] = self.leg_costs(self.cell_x[self.exit_cells], self.cell_y[self.exit_cells],
+                                                    np.full(len(self.exit_cells), float(settings.BASE_X)),
+                                                    np.full(len(self.exit_cells), float(settings.BASE_Y)))
+        if self.cost is None:
+            affected = np.ones(len(cost), dtype=bool)
+        else:
+            affected = self.upstream_cells((cost != self.cost) | (exit_cost != self.exit_cost))
+        self.cost, self.exit_cost = cost, exit_cost
+        self.propagate(affected)
+        self.check_paths()
+        recomputed = int(affected.sum())
+        logger.info(f"Recomputed the cost to go of {recomputed} cells in {time.perf_counter() - start:.3f}s")
+        return recomputed
+
+    def upstream_cells(self, changed: np.ndarray) -> np.ndarray:
+        """
+        :return: Mask of the changed cells and the cells whose best path runs through any of them
+        """
+        affected = changed.copy()
+        has_next = self.next_cell >= 0
+        next_cell = np.where(has_next, self.next_cell, 0)
+        while True:
+            grown = affected | (has_next & affected[next_cell])
+            if grown.sum() == affected.sum():
+                return grown
+            affected = grown
+
+    def propagate(self, affected: np.ndarray) -> None:
+        """
+        Dijkstra over the affected cells, starting from their unaffected neighbours and their legs to the exit, and
+        onwards into any cell whose cost to go improves. The cost of an edge is its length times the mean cost of its
+        two cells, impassable cells (infinite cost) are never entered.
+        """
+        rows, cols = self.rows, self.cols
+        cost = self.cost.tolist()
+        exit_cost = self.exit_cost.tolist()
+        distance = self.distance
+        next_cell = self.next_cell
+        distance[affected] = math.inf
+        next_cell[affected] = -1
+        distance = distance.tolist()
+        next_cell = next_cell.tolist()
+        is_affected = affected.tolist()
+
+        heap = []
+        for cell in np.flatnonzero(affected).tolist():
+            row, col = divmod(cell, cols)
+            best, best_next = exit_cost[cell], -1
+            for dr, dc, length in NEIGHBOURS:
+                r, c = row + dr, col + dc
+                if 0 <= r < rows and 0 <= c < cols:
+                    neighbour = r * cols + c
+                    if not is_affected[neighbour]:
+                        d = distance[neighbour] + length * settings.GRID_SIZE * (cost[cell] + cost[neighbour]) / 2
+                        if d < best:
+                            best, best_next = d, neighbour
+            if best < math.inf:
+                distance[cell], next_cell[cell] = best, best_next
+                heap.append((best, cell))
+        heapq.heapify(heap)
+
+        while heap:
+            d, cell = heapq.heappop(heap)
+            if d > distance[cell]:
+                continue
+            row, col = divmod(cell, cols)
+            for dr, dc, length in NEIGHBOURS:
+                r, c = row + dr, col + dc
+                if 0 <= r < rows and 0 <= c < cols:
+                    neighbour = r * cols + c
+                    candidate = d + length * settings.GRID_SIZE * (cost[cell] + cost[neighbour]) / 2
+                    if candidate < distance[neighbour]:
+                        distance[neighbour] = candidate
+                        next_cell[neighbour] = cell
+                        heapq.heappush(heap, (candidate, neighbour))
+
+        self.distance[:] = distance
+        self.next_cell[:] = next_cell
+
+    def check_paths(self) -> None:
+        """
+        Raises a RuntimeError if any cell on a best path lies outside the world polygon. The polygon is convex, so the
+        straight legs between the cells stay inside as well, and the final legs only leave it through its western edge.
+        """
+        import shapely
+        on_path = np.isfinite(self.distance)
+        outside = on_path & ~shapely.contains_xy(settings.WORLD_POLYGON, self.cell_x, self.cell_y)
+        if outside.any():
+            raise RuntimeError(f"The best paths of {int(outside.sum())} cells leave the world polygon")
+
+    def trace(self, cell: int) -> list[int]:
+        """
+        :return: The cells of the best path from the given cell to the exit
+        """
+        path = [cell]
+        while self.next_cell[path[-1]] >= 0:
+            path.append(int(self.next_cell[path[-1]]))
+        return path
+
+    def cell_point(self, cell: int) -> points.Point:
+        return points.Point(float(self.cell_x[cell]), float(self.cell_y[cell]))
+
+    def start_cell(self, location: points.Point) -> int:
+        """
+        :return: The cell containing the location, or for locations outside the world polygon the cell of the
+            eastmost column with the least cost to go including the straight flight to it
+        """
+        cell = self.grid.cell_at(location.x, location.y)
+        if cell is not None and self.inside[cell[0] * self.cols + cell[1]]:
+            return cell[0] * self.cols + cell[1]
+        cells = self.entry_cells
+        total = self.leg_costs(np.full(len(cells), location.x), np.full(len(cells), location.y),
+                               self.cell_x[cells].astype(float), self.cell_y[cells].astype(float)) \
+            + self.distance[cells]
+        return int(cells[np.argmin(total)])
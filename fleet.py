@@ -0,0 +1,99 @@
+"""
+Containers for the fleet state of an agent type.
+
+IndexedSet replaces the plain lists of active, inactive and agents in maintenance: membership tests, appends,
+removals and pops are O(1) and iteration keeps the insertion order, so swapping a list for an IndexedSet does not
+change the order in which agents are handled. MaintenanceQueue adds a min-heap on the time agents finish maintenance,
+so finished agents are found without visiting every agent in maintenance each step.
+"""
+import heapq
+import itertools
+
+# Tolerance on finish times, steps may end a rounding error before a time they should reach
+TIME_TOLERANCE = 1e-9
+
+
+class IndexedSet:
+    def __init__(self, items=()):
+        # Dicts keep their insertion order and remove keys in O(1)
+        self.items = dict.fromkeys(items)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self.items)})"
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item) -> bool:
+        return item in self.items
+
+    def append(self, item) -> None:
+        if item in self.items:
+            raise ValueError(f"{item} is already in the set.")
+        self.items[item] = None
+
+    def extend(self, items) -> None:
+        for item in items:
+            self.append(item)
+
+    def remove(self, item) -> None:
+        try:
+            del self.items[item]
+        except KeyError:
+            raise ValueError(f"{item} is not in the set.") from None
+
+    def pop(self):
+        """
+        Removes and returns the most recently added item, like list.pop()
+        """
+        if not self.items:
+            raise IndexError("pop from an empty set")
+        return self.items.popitem()[0]
+
+    def clear(self) -> None:
+        self.items.clear()
+
+
+class MaintenanceQueue(IndexedSet):
+    def __init__(self, items=()):
+        """
+        Agents in maintenance, ordered by their maintenance_end time in a heap. Removals are lazy: entries of agents
+        that left the queue (or were added again with another end time) are skipped when they surface.
+        """
+        self.heap = []
+        self.counter = itertools.count()
+        super().__init__()
+        self.extend(items)
+
+    def append(self, agent) -> None:
+        super().append(agent)
+        # The counter breaks ties in insertion order, as iterating the old list did
+        heapq.heappush(self.heap, (agent.maintenance_end, next(self.counter), agent))
+
+    def clear(self) -> None:
+        super().clear()
+        self.heap.clear()
+
+    def next_finish_time(self) -> float:
+        self.drop_stale()
+        return self.heap[0][0] if self.heap else float("inf")
+
+    def drop_stale(self) -> None:
+        while self.heap and (self.heap[0][2] not in self.items or self.heap[0][2].maintenance_end != self.heap[0][0]):
+            heapq.heappop(self.heap)
+
+    def pop_finished(self, time: float) -> list:
+        """
+        Removes and returns the agents whose maintenance ends at or before the given time, earliest first.
+        """
+        finished = []
+        self.drop_stale()
+        while self.heap and self.heap[0][0] <= time + TIME_TOLERANCE:
+            _, _, agent = heapq.heappop(self.heap)
+            super().remove(agent)
+            finished.append(agent)
+            self.drop_stale()
+        return finished
@@ -48,9 +48,10 @@ def graham_scan(points: list) -> list:
     Applies Graham Scan algorithm to make a convex hull out of a set of points.
     An exception is when the graham scan receives points with "force_maintain" characteristics
     This will create a non-convex hull that ensures that these points are contained
-    :param points: List of Points objects
+    :param points: List of Points objects, left untouched
     :return:
     """
+    points = list(points)
     starting_point = find_lowest_point_in_polygon(points)
     points.remove(starting_point)
 
@@ -0,0 +1,52 @@
+"""
+Measures how long a fresh interpreter takes to import the simulation modules used by headless batch workers, and
+checks that none of the plotting or DataFrame dependencies get pulled in.
+
+    python import_time.py [--budget SECONDS]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+HEADLESS_MODULES = ["settings", "world", "manager", "agent", "points", "receptors", "routes", "relaxation",
+                    "route_planning", "checkpoint", "replications", "live_view", "recorder",
+                    "replay", "memory", "crn", "comparison", "layout_optimizer",
+                    "batched", "analytic", "evasion",
+                    "stepping", "equivalence"]
+HEAVY_MODULES = ["matplotlib", "matplotlib.pyplot", "pandas", "shapely"]
+
+# Default budget in seconds for importing all headless modules, NumPy included
+IMPORT_TIME_BUDGET = 0.3
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+for name in {modules}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def measure_import_time(modules: list[str] = None) -> dict:
+    """
+    Imports the modules in a new interpreter.
+    :return: Dict with the import time in seconds and the heavy modules that ended up loaded
+    """
+    modules = HEADLESS_MODULES if modules is None else modules
+    code = MEASURE.format(modules=modules, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=float, default=IMPORT_TIME_BUDGET)
+    args = parser.parse_args()
+
+    result = measure_import_time()
+    print(f"Imported {len(HEADLESS_MODULES)} modules in {result['seconds']:.3f}s (budget {args.budget:.3f}s)")
+    if result["loaded"]:
+        print(f"Heavy modules loaded at import: {', '.join(result['loaded'])}")
+    sys.exit(0 if result["seconds"] <= args.budget and not result["loaded"] else 1)
@@ -0,0 +1,302 @@
+"""
+Searches over patrol layouts for the highest detection rate, scoring every candidate with a short batch of simulated
+replications.
+
+A layout is the set of patrol centres the relaxation starts from, the strengths of the patrol locations and
+SEARCH_VERTICAL_ALIGNMENT. The search starts from the layout of the given world and random layouts, then keeps
+perturbing the best layout found. Every candidate is snapped to a lattice and hashed together with the evaluation
+settings, so a layout that comes up again is read from the cache (optionally persisted as JSON between runs) instead
+of simulated. The candidates of a generation are simulated in parallel, one worker process per candidate, all on the
+same seeds with common random numbers.
+
+    python layout_optimizer.py [--generations 5] [--population 8] [--replications 4] [--cache layouts.json]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+import checkpoint
+import replications
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Layout:
+    def __init__(self, centers: np.ndarray, strengths: np.ndarray, vertical_alignment: float):
+        """
+        :param centers: (k, 2) start centres of the relaxation, in the order of SearchManager.patrol_locations
+        :param strengths: (k,) strengths of the patrol locations
+        :param vertical_alignment: Value for SEARCH_VERTICAL_ALIGNMENT
+        """
+        self.centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        self.strengths = np.asarray(strengths, dtype=float)
+        self.vertical_alignment = float(vertical_alignment)
+
+    def __repr__(self) -> str:
+        return f"Layout({len(self.centers)} centres, vertical alignment {self.vertical_alignment})"
+
+    @classmethod
+    def of_world(cls, world) -> "Layout":
+        search_manager = world.search_manager
+        return cls(search_manager.patrol_layout(), [pl.strength for pl in search_manager.patrol_locations],
+                   settings.SEARCH_VERTICAL_ALIGNMENT)
+
+    def snapped(self, resolution: float) -> "Layout":
+        """
+        :return: Layout with the centres on a lattice of the given spacing, the strengths to four decimals of their
+            share and the alignment to two decimals. Layouts that snap to the same values are treated as one.
+        """
+        total = self.strengths.sum()
+        return Layout(np.round(self.centers / resolution) * resolution,
+                      np.round(self.strengths / total, 4) * total,
+                      round(min(max(self.vertical_alignment, 0.), 1.), 2))
+
+    def key(self, context: str) -> str:
+        """
+        :param context: Description of everything besides the layout that determines the score
+        """
+        digest = hashlib.sha1(context.encode())
+        for values in (self.centers, self.strengths, np.array([self.vertical_alignment])):
+            digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def to_dict(self) -> dict:
+        return {"centers": self.centers.tolist(), "strengths": self.strengths.tolist(),
+                "vertical_alignment": self.vertical_alignment}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "Layout":
+        return cls(state["centers"], state["strengths"], state["vertical_alignment"])
+
+
+class EvaluationCache:
+    def __init__(self, path: str = None):
+        """
+        Scores of evaluated layouts by layout key, read from and saved to a JSON file if a path is given.
+        """
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                self.entries = json.load(file)
+            logger.info(f"Loaded {len(self.entries)} layout evaluations from {path}")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str) -> dict | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        self.entries[key] = entry
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with open(self.path, "w") as file:
+            json.dump(self.entries, file)
+
+
+def apply_layout(world, layout: Layout, relax: bool = True, owner: np.ndarray = None) -> None:
+    """
+    Rebuilds the patrol zones and routes of the world from a layout. Agents keep their current routes.
+    :param relax: Relax the zones starting from the layout centres, otherwise the centres are used as they are
+    :param owner: Owner per in-zone receptor to use without relaxing, see SearchManager.update_patrol_assignments
+    """
+    search_manager = world.search_manager
+    if len(layout.centers) != len(search_manager.patrol_locations):
+        raise ValueError(f"Layout has {len(layout.centers)} centres for {len(search_manager.patrol_locations)} "
+                         f"patrol locations.")
+    settings.SEARCH_VERTICAL_ALIGNMENT = layout.vertical_alignment
+    for pl, strength in zip(search_manager.patrol_locations, layout.strengths):
+        pl.strength = float(strength)
+    if relax:
+        search_manager.relaxation_history = search_manager.relax_patrol_locations(warm_start=layout.centers)
+    else:
+        for pl, (x, y) in zip(search_manager.patrol_locations, layout.centers):
+            pl.x, pl.y = float(x), float(y)
+        search_manager.update_patrol_assignments(owner)
+    search_manager.create_patrol_routes()
+
+
+def random_layout(world, rng: np.random.Generator) -> Layout:
+    """
+    :return: Layout with new random centres (see AgentType.generate_random__patrol_location), the current strengths
+        and a random vertical alignment
+    """
+    search_manager = world.search_manager
+    centers = np.empty((len(search_manager.patrol_locations), 2))
+    for at in search_manager.agent_types:
+        for pl in at.patrol_locations:
+            location = at.generate_random__patrol_location()
+            centers[search_manager.patrol_locations.index(pl)] = location.x, location.y
+    return Layout(centers, [pl.strength for pl in search_manager.patrol_locations], rng.uniform(0, 1))
+
+
+def perturb_layout(layout: Layout, rng: np.random.Generator, step: float, strength_step: float = 0.1,
+                   alignment_step: float = 0.1) -> Layout:
+    """
+    Moves every centre by a normal step (moves leaving the world polygon are not taken), scales the strengths by
+    log-normal factors at the same total and shifts the vertical alignment within [0, 1].
+    """
+    import shapely
+
+    centers = layout.centers.copy()
+    for index, (x, y) in enumerate(layout.centers + rng.normal(0, step, size=layout.centers.shape)):
+        if settings.WORLD_POLYGON.contains(shapely.Point(x, y)):
+            centers[index] = x, y
+    strengths = layout.strengths * np.exp(rng.normal(0, strength_step, size=len(layout.strengths)))
+    strengths *= layout.strengths.sum() / strengths.sum()
+    alignment = float(np.clip(layout.vertical_alignment + rng.normal(0, alignment_step), 0, 1))
+    return Layout(centers, strengths, alignment)
+
+
+def replicate_static(static: dict, seeds: list[int], simulation_time: float = None) -> list[dict]:
+    """
+    Runs the replications of one candidate, the unit of work handed to a worker process.
+    """
+    return [replications.run_replication(seed, simulation_time, static=static, common_random_numbers=True)
+            for seed in seeds]
+
+
+def score_replications(results: list[dict]) -> dict:
+    merged = replications.merge_replications(results)
+    return {"score": merged.detection_rate, "travellers": merged.travellers, "detected": merged.detected}
+
+
+class LayoutOptimizer:
+    def __init__(self, world, seeds: list[int], simulation_time: float = None, processes: int = None,
+                 cache: EvaluationCache = None, relax: bool = True, resolution: float = None):
+        """
+        :param world: World whose patrol layout is optimised, left with its original layout
+        :param seeds: Seeds of the replications every candidate is scored on
+        :param simulation_time: Length of each replication, defaults to settings.SIMULATION_TIME
+        :param processes: Number of worker processes, defaults to the number of cores. With 1 no pool is created.
+        :param cache: Defaults to an in-memory cache
+        :param relax: See apply_layout
+        :param resolution: Lattice spacing of the centres of a candidate, defaults to GRID_SIZE
+        """
+        self.world = world
+        self.seeds = list(seeds)
+        self.simulation_time = settings.SIMULATION_TIME if simulation_time is None else simulation_time
+        self.processes = processes
+        self.cache = EvaluationCache() if cache is None else cache
+        self.relax = relax
+        self.resolution = settings.GRID_SIZE if resolution is None else resolution
+        self.context = json.dumps({"seeds": self.seeds, "simulation_time": self.simulation_time, "relax": relax,
+                                   "agent_data": settings.AGENT_DATA,
+                                   "settings": {name: getattr(settings, name) for name in checkpoint.CHECKPOINT_SETTINGS
+                                                if name != "SEARCH_VERTICAL_ALIGNMENT"}}, sort_keys=True)
+        self.history = []
+
+    def evaluate(self, layouts: list[Layout], pool=None) -> list[dict]:
+        """
+        Scores the layouts, simulating only those not in the cache.
+        :return: Cache entry per layout: score (detection rate over all replications), travellers and detected
+        """
+        grid = self.world.receptor_grid
+        original = Layout.of_world(self.world)
+        original_owner = self.world.search_manager.receptor_owner[grid.in_zone_mask]
+        keys = [layout.key(self.context) for layout in layouts]
+        pending = {}
+        for key, layout in zip(keys, layouts):
+            if key not in pending and self.cache.get(key) is None:
+                apply_layout(self.world, layout, relax=self.relax)
+                pending[key] = checkpoint.capture_static(self.world)
+        apply_layout(self.world, original, relax=False, owner=original_owner)
+
+        if pending:
+            saved = {name: getattr(settings, name) for name in checkpoint.CHECKPOINT_SETTINGS}
+            world, world_time = settings.world, settings.world_time
+            tasks = [(static, self.seeds, self.simulation_time) for static in pending.values()]
+            if pool is None:
+                outcomes = [replicate_static(*task) for task in tasks]
+            else:
+                outcomes = pool.starmap(replicate_static, tasks)
+            for name, value in saved.items():
+                setattr(settings, name, value)
+            settings.world, settings.world_time, settings.random_streams = world, world_time, None
+
+            for key, results in zip(pending, outcomes):
+                self.cache.put(key, score_replications(results))
+            self.cache.save()
+        return [self.cache.entries[key] for key in keys]
+
+    def optimize(self, generations: int = 5, population: int = 8, step: float = None,
+                 seed: int = 0) -> tuple[Layout, dict]:
+        """
+        :param generations: Number of generations after the first
+        :param population: Candidates per generation. The first generation is the current layout and random layouts,
+            later generations perturb the best layout so far
+        :param step: Standard deviation of the centre moves, defaults to a tenth of AREA_WIDTH. Halved after every
+            generation without improvement.
+        :param seed: Seed of the candidate generation
+        :return: Best layout and its cache entry
+        """
+        rng = np.random.default_rng(seed)
+        np.random.seed(seed)
+        step = settings.AREA_WIDTH / 10 if step is None else step
+
+        candidates = [Layout.of_world(self.world)] + [random_layout(self.world, rng) for _ in range(population - 1)]
+        best, best_entry = None, None
+        pool = None if self.processes == 1 else multiprocessing.Pool(self.processes)
+        try:
+            for generation in range(generations + 1):
+                candidates = [c.snapped(self.resolution) for c in candidates]
+                hits = self.cache.hits
+                entries = self.evaluate(candidates, pool)
+                improved = False
+                for layout, entry in zip(candidates, entries):
+                    if best_entry is None or entry["score"] > best_entry["score"]:
+                        best, best_entry, improved = layout, entry, True
+                self.history.append({"generation": generation, "best_score": best_entry["score"], "step": step,
+                                     "cached": self.cache.hits - hits})
+                logger.info(f"Generation {generation}: best detection rate {best_entry['score']:.4f}, "
+                            f"{len(self.cache)} layouts evaluated")
+                if not improved and generation > 0:
+                    step /= 2
+                candidates = [perturb_layout(best, rng, step) for _ in range(population)]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return best, best_entry
+
+
+if __name__ == '__main__':
+    from world import World
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--population", type=int, default=8)
+    parser.add_argument("--replications", type=int, default=4)
+    parser.add_argument("--simulation-time", type=float, default=None)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--cache", default=None, help="JSON file to reuse and store layout evaluations in")
+    parser.add_argument("--save", default=None, help="JSON file to write the best layout to")
+    args = parser.parse_args()
+
+    settings.load_scenario()
+    world = World(plot=False)
+    optimizer = LayoutOptimizer(world, seeds=list(range(args.replications)), simulation_time=args.simulation_time,
+                                processes=args.processes, cache=EvaluationCache(args.cache))
+    layout, entry = optimizer.optimize(args.generations, args.population)
+    print(f"Best detection rate {entry['score']:.4f} ({entry['detected']}/{entry['travellers']}), {layout}")
+    if args.save is not None:
+        with open(args.save, "w") as file:
+            json.dump(layout.to_dict(), file)
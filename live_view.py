@@ -0,0 +1,80 @@
+"""
+Live view of a running simulation.
+
+The static layers (receptors, patrol locations) are drawn once and cached as a background bitmap. Every frame only
+restores that bitmap and redraws one scatter collection per manager from the position arrays of the active agents,
+so the cost of a frame does not grow with the number of artists ever created. Frames are throttled to PLOT_FPS,
+simulation ticks in between are not drawn.
+"""
+import logging
+import time
+
+import numpy as np
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LiveView:
+    def __init__(self, fig, ax, search_manager, travel_manager, fps: float = None):
+        """
+        :param fig: Figure holding the static layers, as created by World.establish_world_plot
+        :param ax: Axes to draw the agents on
+        :param fps: Maximum number of frames per second of wall clock time, defaults to PLOT_FPS
+        """
+        import matplotlib.colors as mcolors
+
+        self.fig = fig
+        self.ax = ax
+        self.canvas = fig.canvas
+        self.search_manager = search_manager
+        self.travel_manager = travel_manager
+        self.frame_interval = 1 / (settings.PLOT_FPS if fps is None else fps)
+        self.last_frame = -np.inf
+        self.frames = 0
+
+        # Searchers take the colour of their patrol location, looked up by zone index
+        self.zone_colors = np.array([mcolors.to_rgba(pl.color) for pl in search_manager.patrol_locations])
+
+        empty = np.empty((0, 2))
+        self.searchers = ax.scatter(empty[:, 0], empty[:, 1], marker="X", zorder=2, edgecolor="black",
+                                    animated=True)
+        self.travellers = ax.scatter(empty[:, 0], empty[:, 1], color="forestgreen", marker="<", zorder=2,
+                                     edgecolor="black", animated=True)
+        self.title = ax.text(0.5, 1.01, "", transform=ax.transAxes, ha="center", animated=True)
+
+        self.background = None
+        # Any full redraw (first show, resize, zoom) invalidates the cached background
+        self.canvas.mpl_connect("draw_event", self.cache_background)
+        self.canvas.draw()
+
+    def cache_background(self, event=None) -> None:
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def update(self, force: bool = False) -> bool:
+        """
+        Draws the current agent positions, unless the previous frame was drawn less than a frame interval ago.
+        :param force: Draw regardless of the frame rate
+        :return: Whether a frame was drawn
+        """
+        now = time.perf_counter()
+        if not force and now - self.last_frame < self.frame_interval:
+            return False
+        self.last_frame = now
+
+        searcher_xy, zone_index = self.search_manager.active_positions()
+        self.searchers.set_offsets(searcher_xy)
+        self.searchers.set_facecolor(self.zone_colors[zone_index])
+        self.travellers.set_offsets(self.travel_manager.active_positions())
+        self.title.set_text(f"World At {settings.world_time}")
+
+        if self.background is None:
+            self.cache_background()
+        self.canvas.restore_region(self.background)
+        for artist in (self.searchers, self.travellers, self.title):
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+        self.frames += 1
+        return True
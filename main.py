@@ -1,11 +1,9 @@
 # TODO - next steps:
 #   - Update Agent Location
-#   - Ensure agent types take over assigned zones during changes
 import logging
 import datetime
 
-import pandas as pd
-
+import settings
 from world import World
 
 today = datetime.date.today().strftime("%d_%m_%Y")
@@ -15,8 +13,17 @@ logging.basicConfig(filename=today+".log", encoding='utf-8', level=logging.DEBUG
 logging.getLogger("matplotlib.font_manager").setLevel(logging.WARNING)
 
 if __name__ == '__main__':
+    settings.load_scenario()
     world = World()
     world.simulate()
 
-    df = world.travel_manager.stats_to_df()
-    df[df["detected"]].hist(["time"])
+    for model, summary in world.travel_manager.aggregates.summary().items():
+        logger.info(f"{model}: {summary}")
+
+    from matplotlib import pyplot as plt
+    for model, aggregates in world.travel_manager.aggregates.models.items():
+        histogram = aggregates["time_to_detection"].histogram
+        plt.figure()
+        plt.bar(histogram.edges, histogram.counts, width=histogram.bin_width, align="edge")
+        plt.title(f"Time to detection - {model}")
+    plt.show()
@@ -1,16 +1,20 @@
-import copy
 import math
-import random
-import shapely
 import numpy as np
-import pandas as pd
 from abc import abstractmethod
 import logging
 import events
 
 import settings
+import crn
+import relaxation
+import route_planning
+import scenario
+import steady_state
 from agent import Searcher, Traveller
+from aggregators import DetectionStatistics
+from fleet import IndexedSet, MaintenanceQueue
 import points
+import routes
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +25,9 @@ exit_point = points.Point(settings.BASE_X, settings.BASE_Y)
 class AgentType:
     def __init__(self, model: str, values: dict):
         self.model = model
-        self.active_agents = []
-        self.inactive_agents = []
-        self.maintenance_agents = []
+        self.active_agents = IndexedSet()
+        self.inactive_agents = IndexedSet()
+        self.maintenance_agents = MaintenanceQueue()
 
         self.radius = values["radius"]
         self.quantity = values["quantity"]
@@ -40,6 +44,8 @@ class AgentType:
 
         self.patrol_locations = []
         self.activation_queue = []
+        # Patrol locations suspended for lack of agents since the last rebalance of the search manager
+        self.capacity_changes = []
 
     def __str__(self):
         return (f"{self.model} - "
@@ -59,6 +65,17 @@ class AgentType:
         logger.debug(f"{self.model} has {int(np.floor(self.quantity / required))} concurrent locations")
         return int(np.floor(self.quantity / required))
 
+    def sensor_reach(self) -> float:
+        """
+        Largest distance at which agents of this type can detect any traveller.
+        """
+        if self.operating_domain == settings.SURFACE_SEARCHER:
+            skill = scenario.encode(self.skill_level, scenario.SKILL_LEVELS, "skill level")
+            reach = settings.COMPILED_SCENARIO.detection_range[skill].max()
+        else:
+            reach = settings.MAX_AIR_DETECTION_DISTANCE
+        return float(min(reach, settings.MAX_DISCOVER_DISTANCE))
+
     def create_patrol_location(self) -> points.PatrolLocation:
         """
         Creates a patrol location, for this location, update the maximum applicable ingress distance.
@@ -78,6 +95,7 @@ class AgentType:
         Generates a random point that is within the world polygon.
         :return:
         """
+        import shapely
         x_coord = np.random.uniform(0, settings.AREA_WIDTH)
         y_coord = np.random.uniform(0, settings.TOTAL_HEIGHT)
         while not settings.WORLD_POLYGON.contains(shapely.Point(x_coord, y_coord)):
@@ -85,14 +103,31 @@ class AgentType:
             y_coord = np.random.uniform(0, settings.TOTAL_HEIGHT)
         return points.PatrolLocation(x_coord, y_coord, strength=self.speed * self.endurance, radius=self.radius)
 
+    def all_agents(self) -> list[Searcher]:
+        return list(self.active_agents) + list(self.inactive_agents) + list(self.maintenance_agents)
+
+    def reset_fleet(self) -> None:
+        """
+        Empties the active, inactive and maintenance sets, e.g. before placing the agents anew.
+        """
+        self.active_agents = IndexedSet()
+        self.inactive_agents = IndexedSet()
+        self.maintenance_agents = MaintenanceQueue()
+
     def update_agents(self) -> None:
         self.update_maintenance_agents()
 
         returned_agents = []
-        for agent in self.active_agents:
-            agent.check_if_need_to_return()
-            if agent.check_if_need_replacement():
-                self.call_next_agent(patrol_location=agent.patrol_location)
+        # Agents called in as replacement are appended and move in the same step
+        agents = list(self.active_agents)
+        for agent in agents:
+            if settings.world_time >= agent.next_check_time:
+                agent.check_if_need_to_return()
+                if agent.check_if_need_replacement():
+                    replacement = self.call_next_agent(patrol_location=agent.patrol_location)
+                    if replacement is not None:
+                        agents.append(replacement)
+                agent.schedule_next_check()
 
             event = agent.move_through_route()
 
@@ -104,33 +139,37 @@ class AgentType:
             self.maintenance_agents.append(agent)
 
     def update_maintenance_agents(self) -> None:
-        completed_maintenance = []
-        for agent in self.maintenance_agents:
-            completed = agent.update_maintenance()
-            if completed:
-                completed_maintenance.append(agent)
-
-        for agent in completed_maintenance:
-            self.maintenance_agents.remove(agent)
+        """
+        Releases the agents whose maintenance ends within the current step.
+        """
+        for agent in self.maintenance_agents.pop_finished(settings.world_time + settings.time_step):
+            agent.finish_maintenance()
             self.inactive_agents.append(agent)
 
-    def plot_agents(self, ax):
-        for agent in self.active_agents:
-            if agent.plot_object is None:
-                agent.plot_object = ax.scatter(agent.location.x, agent.location.y,
-                                               color=agent.patrol_location.color,
-                                               marker="X", zorder=2,
-                                               edgecolor="black")
-            else:
-                agent.plot_object.set_offsets([[agent.location.x, agent.location.y]])
-
-    def call_next_agent(self, patrol_location: points.PatrolLocation) -> None:
+    def active_positions(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (n, 2) locations of the active agents and the zone index of their patrol locations
+        """
+        xy = np.array([agent.location.get_tuple() for agent in self.active_agents], dtype=float).reshape(-1, 2)
+        zones = np.array([agent.patrol_location.zone_index for agent in self.active_agents], dtype=np.int64)
+        return xy, zones
+
+    def call_next_agent(self, patrol_location: points.PatrolLocation) -> Searcher | None:
+        """
+        Sends an inactive agent to the patrol location, or suspends the location if none is available.
+        :return: The activated agent, None if the location was suspended
+        """
         if len(self.inactive_agents) == 0:
-            raise ValueError(f"No inactive agents available for {self.model} "
-                             f"- agents in maint: {self.maintenance_agents}")
+            if not patrol_location.suspended:
+                logger.info(f"No inactive agents available for {self.model}, suspending {patrol_location} "
+                            f"- agents in maint: {len(self.maintenance_agents)}")
+                patrol_location.suspended = True
+                self.capacity_changes.append(patrol_location)
+            return None
         next_agent = self.inactive_agents.pop()
         self.active_agents.append(next_agent)
         next_agent.activate(patrol_location)
+        return next_agent
 
 
 class Manager:
@@ -151,8 +190,13 @@ class SearchManager(Manager):
     Oversees several Agent Types that each are responsible for assigned patrol locations.
     """
 
-    def __init__(self):
+    def __init__(self, tessellate: bool = True):
+        """
+        :param tessellate: Create the patrol locations, disable when the layout is restored from elsewhere
+        """
         super().__init__()
+        if settings.AGENT_DATA is None:
+            raise ValueError("No scenario loaded, call settings.load_scenario() before creating the world.")
         agent_types = settings.AGENT_DATA.keys()
 
         for at in agent_types:
@@ -161,7 +205,12 @@ class SearchManager(Manager):
 
         self.create_agents()
         self.patrol_locations = []
-        self.create_patrol_tessellation()
+        self.receptor_owner = None
+        # Dense (rows, cols) version of receptor_owner, -1 for cells outside the zones or not stored
+        self.zone_owner = None
+        self.relaxation_history = []
+        if tessellate:
+            self.create_patrol_tessellation()
 
     def create_agents(self) -> None:
         for at in self.agent_types:
@@ -179,6 +228,91 @@ class SearchManager(Manager):
     def manage_agents(self) -> None:
         for agent_type in self.agent_types:
             agent_type.update_agents()
+        self.rebalance_on_capacity_change()
+
+    def rebalance_on_capacity_change(self) -> None:
+        """
+        Hands the zones of patrol locations suspended for lack of agents to their neighbours, and takes zones back
+        for suspended locations whose agent type has an agent available again.
+        """
+        changed = []
+        resumed = []
+        for at in self.agent_types:
+            changed.extend(at.capacity_changes)
+            at.capacity_changes = []
+            available = len(at.inactive_agents)
+            for pl in at.patrol_locations:
+                if pl.suspended and pl not in changed and available > 0:
+                    pl.suspended = False
+                    resumed.append((at, pl))
+                    available -= 1
+        changed.extend(pl for _, pl in resumed)
+        if not changed:
+            return
+
+        self.rebalance_patrol_locations(changed)
+        for at, pl in resumed:
+            logger.info(f"Resuming {pl} with an agent of {at.model}")
+            at.call_next_agent(pl)
+
+    def rebalance_patrol_locations(self, changed: list[points.PatrolLocation]) -> set[int]:
+        """
+        Re-tessellates locally after the given patrol locations were suspended or resumed: only the receptors of
+        these locations and their neighbours are relaxed, warm started from the current centres and owners, over the
+        active locations among them. Routes are only rebuilt for zones whose receptors changed.
+        :return: Indices of the patrol locations whose zones changed
+        """
+        grid = settings.world.receptor_grid
+        changed_zones = {pl.zone_index for pl in changed}
+        affected = changed_zones | relaxation.adjacent_zones(self.zone_owner, changed_zones)
+        for pl in changed:
+            # A location that owns no cells (resumed after a suspension) borders the zone its centre lies in
+            cell = grid.cell_at(pl.x, pl.y)
+            if pl.zone_index not in self.zone_owner and cell is not None and self.zone_owner[cell] >= 0:
+                affected.add(int(self.zone_owner[cell]))
+                affected |= relaxation.adjacent_zones(self.zone_owner, [self.zone_owner[cell]])
+
+        active = np.array(sorted(z for z in affected if not self.patrol_locations[z].suspended), dtype=np.int32)
+        if len(active) == 0:
+            logger.warning(f"No active patrol locations left around {changed}, their zones stay unassigned")
+            return set()
+
+        in_zone_owner = self.receptor_owner[grid.in_zone_mask]
+        subset = np.isin(in_zone_owner, list(affected))
+        local_index = np.full(len(self.patrol_locations), -1, dtype=np.int32)
+        local_index[active] = np.arange(len(active))
+
+        strengths = np.array([self.patrol_locations[z].strength for z in active], dtype=float)
+        centers, owner, history = relaxation.relax_patrol_centers(grid.coordinates[grid.in_zone_mask][subset],
+                                                                  self.patrol_layout()[active], strengths,
+                                                                  owner=local_index[in_zone_owner[subset]])
+        for zone, (x, y) in zip(active, centers):
+            self.patrol_locations[zone].x, self.patrol_locations[zone].y = float(x), float(y)
+
+        new_owner = in_zone_owner.copy()
+        new_owner[subset] = active[owner]
+        moved = new_owner != in_zone_owner
+        rebuilt = set(np.unique(np.concatenate([in_zone_owner[moved], new_owner[moved]])).tolist())
+        rebuilt = {z for z in rebuilt if not self.patrol_locations[z].suspended}
+
+        self.update_patrol_assignments(new_owner)
+        self.create_patrol_routes(sorted(rebuilt))
+        self.reroute_agents(rebuilt)
+        logger.info(f"Rebalanced {len(affected)} patrol locations around {sorted(changed_zones)} in "
+                    f"{len(history)} iterations, rebuilt {len(rebuilt)} routes")
+        return rebuilt
+
+    def reroute_agents(self, zones: set[int]) -> None:
+        """
+        Moves the patrolling agents of the given zones onto the rebuilt routes.
+        """
+        if settings.SEARCH_BEHAVIOUR == settings.PHEROMONE_SEARCH:
+            # Pheromone routes read the zone owners as they go
+            return
+        for at in self.agent_types:
+            for agent in at.active_agents:
+                if not agent.returning and agent.patrol_location.zone_index in zones:
+                    agent.route = agent.patrol_location.boustrophedon_path
 
     def check_detection(self, target_agents: list[Traveller]) -> list[Traveller]:
         # TODO: Partition search space to reduce dimensionality
@@ -214,126 +348,258 @@ class SearchManager(Manager):
         for pl in self.patrol_locations:
             pl.strength = (pl.strength / total_strength) * math.sqrt(area_size)
 
-    def distribute_patrol_locations(self) -> None:
-        for _ in range(settings.PATROL_ZONE_ITERATIONS):
-            for pl in self.patrol_locations:
-                pl.update()
+    def distribute_patrol_locations(self, warm_start: np.ndarray = None) -> list[dict]:
+        """
+        Relaxes the patrol locations over the receptor grid until converged, creates their routes and activates an
+        agent for every location.
+        :param warm_start: Optional (k, 2) array of centres of a previous layout to start the relaxation from
+        :return: Convergence history of the relaxation, one dict per iteration
+        """
+        self.relaxation_history = self.relax_patrol_locations(warm_start)
+        logger.info(f"Patrol locations score: {self.score_patrol_locations()} "
+                    f"after {len(self.relaxation_history)} iterations")
 
-            self.update_patrol_assignments()
-        self.score_patrol_locations()
+        self.create_patrol_routes()
+        self.activate_patrol_locations()
+        logger.info(f"Created {len(self.patrol_locations)} patrol locations")
+        return self.relaxation_history
 
-        for p in self.patrol_locations:
-            p.create_boustrophedon_path()
+    def activate_patrol_locations(self) -> None:
+        """
+        Sends an agent to every patrol location, or places the fleets in their steady-state rotation if
+        STEADY_STATE_START is set.
+        """
+        if settings.STEADY_STATE_START:
+            steady_state.initialize_fleet(self)
+            return
 
         for at in self.agent_types:
             for pl in at.patrol_locations:
                 at.call_next_agent(pl)
-        logger.info(f"Created {len(self.patrol_locations)} patrol locations")
 
-    def update_patrol_assignments(self) -> None:
+    def create_patrol_routes(self, zones: list[int] = None) -> None:
+        """
+        Builds the convex hulls and boustrophedon paths of all patrol locations in one pass over the receptor owners.
+        :param zones: Optional indices of the patrol locations to rebuild, all locations if None
+        """
+        grid = settings.world.receptor_grid
+        radii = np.array([pl.radius for pl in self.patrol_locations], dtype=float)
+        hulls, waypoints = route_planning.plan_routes(grid.coordinates, self.receptor_owner, radii,
+                                                      fallback=self.patrol_layout(), zones=zones)
+        for index in range(len(self.patrol_locations)) if zones is None else zones:
+            self.patrol_locations[index].set_route(hulls[index], waypoints[index])
+
+    def patrol_layout(self) -> np.ndarray:
+        """
+        :return: (k, 2) array of the current patrol location centres, usable as a warm start
+        """
+        return np.array([[pl.x, pl.y] for pl in self.patrol_locations], dtype=float).reshape(-1, 2)
+
+    def relax_patrol_locations(self, warm_start: np.ndarray = None) -> list[dict]:
+        grid = settings.world.receptor_grid
+        centers = self.patrol_layout() if warm_start is None else np.asarray(warm_start, dtype=float)
+        if len(centers) != len(self.patrol_locations):
+            raise ValueError(f"Warm start has {len(centers)} centres for {len(self.patrol_locations)} "
+                             f"patrol locations.")
+        strengths = np.array([pl.strength for pl in self.patrol_locations], dtype=float)
+
+        centers, owner, history = relaxation.relax_patrol_centers(grid.coordinates[grid.in_zone_mask],
+                                                                  centers, strengths,
+                                                                  fallback_xy=grid.coordinates)
+        for pl, (x, y) in zip(self.patrol_locations, centers):
+            pl.x, pl.y = float(x), float(y)
+
+        self.update_patrol_assignments(owner)
+        return history
+
+    def update_patrol_assignments(self, owner: np.ndarray = None) -> None:
+        """
+        Hands every in-zone receptor to its patrol location.
+        :param owner: Owning patrol location index per in-zone receptor, computed from the current centres if None
+        """
         # TODO: Think about whether we should assign points outside the area of interest
         #  (currently off, might affect edge behaviour)
-        logger.debug(f"Assigning {len(settings.world.receptor_grid.receptors)} Receptors to Patrol Locations")
-        for pl in self.patrol_locations:
-            pl.receptors = []
+        grid = settings.world.receptor_grid
+        logger.debug(f"Assigning {len(grid.coordinates)} Receptors to Patrol Locations")
+        if owner is None:
+            strengths = np.array([pl.strength for pl in self.patrol_locations], dtype=float)
+            owner = relaxation.assign_receptors(grid.coordinates[grid.in_zone_mask], self.patrol_layout(), strengths)
+
+        self.receptor_owner = np.full(len(grid.coordinates), -1, dtype=np.int32)
+        self.receptor_owner[grid.in_zone_mask] = owner
+
+        zone_owner = grid.to_dense(self.receptor_owner, fill=-1)
+        if self.zone_owner is None:
+            self.zone_owner = zone_owner
+        else:
+            # Written in place, pheromone routes hold on to this array
+            self.zone_owner[:] = zone_owner
+
+        for zone_index, pl in enumerate(self.patrol_locations):
+            pl.zone_index = zone_index
+            pl.zone_owner = self.zone_owner
+
+    def deposit_pheromones(self) -> None:
+        grid = settings.world.receptor_grid
+        amount = settings.PHEROMONE_DEPOSIT * settings.time_step
+        for at in self.agent_types:
+            for agent in at.active_agents:
+                grid.deposit_pheromones(agent.location.x, agent.location.y, amount)
 
-        for receptor in settings.world.receptor_grid.receptors:
-            if not receptor.in_zone:
-                continue
+    def color_receptors(self) -> None:
+        """
+        Gives every assigned receptor the plot colour of its patrol location.
+        """
+        receptors = settings.world.receptor_grid.receptors
+        for receptor_index in np.flatnonzero(self.receptor_owner >= 0):
+            receptors[receptor_index].color = self.patrol_locations[self.receptor_owner[receptor_index]].color
 
-            closest_patrol = min(self.patrol_locations,
-                                 key=lambda p:
-                                 p.distance_to(receptor.location, metric="adj manhattan")
-                                 / math.sqrt(p.strength))
-            closest_patrol.receptors.append(receptor)
-            receptor.color = closest_patrol.color
+    def score_patrol_locations(self) -> float:
+        """
+        :return: Sum over patrol locations of the absolute difference between the share of in-zone receptors
+            assigned and the share of total strength, 0 for a perfect tessellation.
+        """
+        strengths = np.array([pl.strength for pl in self.patrol_locations], dtype=float)
+        return relaxation.share_score(self.receptor_owner[self.receptor_owner >= 0], strengths)
 
-    def score_patrol_locations(self) -> None:
-        performances = []
-        total_locations = len(settings.world.receptor_grid.receptors)
+    def active_sensors(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Speed and sensor reach of all active searchers, in the order of active_positions
+        """
+        speeds = [np.full(len(at.active_agents), at.speed, dtype=float) for at in self.agent_types]
+        reaches = [np.full(len(at.active_agents), at.sensor_reach(), dtype=float) for at in self.agent_types]
+        return np.concatenate(speeds), np.concatenate(reaches)
 
-        for pl in self.patrol_locations:
-            assigned_grid_points = len(pl.receptors)
-            assigned_share = assigned_grid_points / total_locations
-            performances.append({"pl": pl,
-                                 "share": assigned_share,
-                                 "strength": pl.strength})
-        total_strength = sum([p["strength"] for p in performances])
-        score = sum([abs(p["share"] - (p["strength"] / total_strength)) for p in performances])
-        print(f"Patrol locations score: {score}")
-
-    def plot_agent_types(self, ax) -> None:
-        for at in self.agent_types:
-            at.plot_agents(ax)
+    def active_positions(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (n, 2) locations of all active searchers and the zone index of their patrol locations
+        """
+        positions = [at.active_positions() for at in self.agent_types]
+        return (np.concatenate([xy for xy, _ in positions]).reshape(-1, 2),
+                np.concatenate([zones for _, zones in positions]).astype(np.int64))
 
 
 class TravelManager(Manager):
     """
     Oversees agents passing through the zone directly
     """
+    # Placeholder entry process and traveller characteristics, see generate_entries and new_entry
+    ENTRY_PROBABILITY = 0.2
+    TRAVELLER_MODEL = "tbd"
+    TRAVELLER_SPEED = 25
+    TRAVELLER_AIR_VISIBILITY = settings.SMALL
+    TRAVELLER_SURFACE_VISIBILITY = settings.MEDIUM
 
     def __init__(self):
         super().__init__()
-        self.active_agents = []
+        self.active_agents = IndexedSet()
+        # Number of travellers that entered, the target id of the next one
+        self.entries = 0
+        # Online aggregates of the finished travellers, the raw records are only kept with KEEP_RAW_STATS
+        self.aggregates = DetectionStatistics()
         self.stats = []
+        # Shared cost-to-go field of the evasive travellers, created on the first entry, see evasion.py
+        self.cost_field = None
 
         self.create_agents()
 
     def create_agents(self) -> None:
         self.generate_entries()
 
-    def generate_entries(self):
+    def generate_entries(self, entry_time: float = None):
         # TODO: change random entry process
-        if random.uniform(0, 1) > 0.8:
-            self.new_entry()
+        if crn.arrival_random().uniform(0, 1) > 1 - self.ENTRY_PROBABILITY:
+            self.new_entry(entry_time)
 
-    def new_entry(self):
+    def new_entry(self, entry_time: float = None):
         # TODO: Replace placeholder characteristics with actual sampling values
-        entry_y = random.uniform(settings.ENTRY_Y_MIN, settings.ENTRY_Y_MAX)
+        entry_y = crn.arrival_random().uniform(settings.ENTRY_Y_MIN, settings.ENTRY_Y_MAX)
         entry_point = points.Point(settings.ENTRY_X, entry_y)
-        model = "tbd"
-        speed = 25
-        new_agent = Traveller(model,
+        new_agent = Traveller(self.TRAVELLER_MODEL,
                               endurance=math.inf,
-                              speed=speed,
+                              speed=self.TRAVELLER_SPEED,
                               maintenance=0,
                               base=exit_point,
-                              air_visibility=settings.SMALL,
-                              surface_visibility=settings.MEDIUM)
+                              air_visibility=self.TRAVELLER_AIR_VISIBILITY,
+                              surface_visibility=self.TRAVELLER_SURFACE_VISIBILITY,
+                              target_id=self.entries)
+        self.entries += 1
+        if entry_time is not None:
+            new_agent.spawn_time = entry_time
         self.active_agents.append(new_agent)
         new_agent.location = entry_point
-        new_agent.return_to_base()
-
-    def manage_agents(self) -> None:
-        self.generate_entries()
+        self.route_traveller(new_agent)
 
-        for agent in copy.copy(self.active_agents):
-            event = agent.move_through_route()
+    def route_traveller(self, traveller: Traveller) -> None:
+        """
+        Sends the traveller to the exit: straight, or with EVASIVE_TRAVEL down the cost-to-go field.
+        """
+        if settings.TRAVEL_BEHAVIOUR != settings.EVASIVE_TRAVEL:
+            traveller.return_to_base()
+            return
+        field = self.cost_to_go()
+        traveller.returning = True
+        traveller.route = routes.FieldRoute(field, field.start_cell(traveller.location), traveller.base)
+
+    def cost_to_go(self) -> "evasion.CostToGoField":
+        """
+        :return: The cost-to-go field, refreshed if the last refresh lies EVASION_REFRESH_INTERVAL or more behind
+        """
+        import evasion
+        if self.cost_field is None:
+            self.cost_field = evasion.CostToGoField(settings.world.receptor_grid, settings.world.search_manager,
+                                                    self.TRAVELLER_SPEED)
+        field = self.cost_field
+        if not field.refresh_time <= settings.world_time < field.refresh_time + settings.EVASION_REFRESH_INTERVAL:
+            field.refresh()
+        return field
+
+    def manage_agents(self, entry_times: list[float] = None) -> None:
+        """
+        :param entry_times: Base ticks within the current step, each gets one entry draw. Defaults to the step start.
+        """
+        for entry_time in [settings.world_time] if entry_times is None else entry_times:
+            self.generate_entries(entry_time)
+
+        if self.cost_field is not None:
+            # Travellers under way follow the shared field, keep it in line with the patrol layout
+            self.cost_to_go()
+        step_end = settings.world_time + settings.time_step
+        for agent in list(self.active_agents):
+            # Travellers entering during the step only move for the rest of it
+            event = agent.move_through_route(step_end - max(agent.spawn_time, settings.world_time))
             if event == events.ENTERED_BASE:
                 self.active_agents.remove(agent)
                 self.write_to_stat(agent, detected=False)
-                agent.deactivate()
 
     def register_detection(self, detected_agents: list[Traveller]) -> None:
         for traveller in detected_agents:
             self.active_agents.remove(traveller)
-            traveller.deactivate()
             self.write_to_stat(traveller, detected=True)
 
     def write_to_stat(self, traveller: Traveller, detected: bool) -> None:
-        time_spent = settings.world_time - traveller.spawn_time
-        self.stats.append({"model": traveller.model,
-                           "detected": detected,
-                           "time": time_spent})
-
-    def plot_agents(self, ax) -> None:
-        for agent in self.active_agents:
-            if agent.plot_object is None:
-                agent.plot_object = ax.scatter(agent.location.x, agent.location.y,
-                                               color="forestgreen", marker="<", zorder=2,
-                                               edgecolor="black")
-            else:
-                agent.plot_object.set_offsets([[agent.location.x, agent.location.y]])
-
-    def stats_to_df(self) -> pd.DataFrame:
+        # Detections and exits happen during the step, count the time up to its end
+        time_spent = settings.world_time + settings.time_step - traveller.spawn_time
+        self.aggregates.update(traveller.model, detected, time_spent)
+        if settings.KEEP_RAW_STATS:
+            self.stats.append({"model": traveller.model,
+                               "detected": detected,
+                               "time": time_spent})
+
+    def active_speeds(self) -> np.ndarray:
+        return np.array([agent.speed for agent in self.active_agents], dtype=float)
+
+    def active_positions(self) -> np.ndarray:
+        """
+        :return: (n, 2) locations of the active travellers
+        """
+        return np.array([agent.location.get_tuple() for agent in self.active_agents], dtype=float).reshape(-1, 2)
+
+    def stats_to_df(self) -> "pandas.DataFrame":
+        """
+        :return: The raw records of the finished travellers, requires KEEP_RAW_STATS
+        """
+        import pandas as pd
+        if not settings.KEEP_RAW_STATS:
+            raise ValueError("Raw traveller statistics are not kept, enable KEEP_RAW_STATS or use the aggregates.")
         return pd.DataFrame.from_records(self.stats)
@@ -0,0 +1,254 @@
+"""
+Memory accounting of a world, and a dry-run estimate of the footprint of a scenario before building it.
+
+    python memory.py [--grid-size 5] [--simulation-time 10000] [--sparse] [--measure TICKS]
+
+memory_report walks the objects of a built world and attributes their bytes to subsystems, every object is counted
+once (in the first subsystem that reaches it). estimate_memory extrapolates the same subsystems from the settings and
+scenario, using the measured size of a few sample objects.
+"""
+import argparse
+import logging
+import math
+import sys
+
+import numpy as np
+
+import settings
+from recorder import RECORD_DTYPE
+
+logger = logging.getLogger(__name__)
+
+
+def deep_size(obj, seen: set = None, exclude: set = None) -> int:
+    """
+    Bytes held by an object and everything it references that is not in seen. NumPy arrays count their buffer
+    (views count nothing for data owned by another array). Modules, classes and functions are not followed.
+    :param seen: Ids of objects already counted, extended with every object counted here
+    :param exclude: Ids of objects that are not followed, but stay uncounted for a later call
+    """
+    seen = set() if seen is None else seen
+    exclude = set() if exclude is None else exclude
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if (id(current) in seen or id(current) in exclude
+                or isinstance(current, (type, type(sys), type(deep_size)))):
+            continue
+        seen.add(id(current))
+
+        # getsizeof of an array includes its buffer only if the array owns it
+        total += sys.getsizeof(current)
+        if isinstance(current, np.ndarray):
+            if current.base is not None:
+                stack.append(current.base)
+            continue
+
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        if hasattr(current, "__dict__"):
+            stack.append(current.__dict__)
+        for slot in getattr(type(current), "__slots__", ()):
+            if hasattr(current, slot):
+                stack.append(getattr(current, slot))
+    return total
+
+
+def peak_resident_memory() -> int | None:
+    """
+    :return: Peak resident set size of this process in bytes, None where the platform does not report it
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memory_report(world) -> dict:
+    """
+    :return: Bytes per subsystem of the world, the total and the peak resident memory of the process
+    """
+    seen = set()
+    # Settings, the scenario and plotting are shared infrastructure, not part of any subsystem
+    for shared in (settings.AGENT_DATA, settings.COMPILED_SCENARIO, settings.WORLD_POLYGON, world.fig, world.ax,
+                   world.live_view):
+        deep_size(shared, seen)
+    seen.add(id(world))
+
+    report = {}
+    search_manager = world.search_manager
+    agents = {at.model: at.all_agents() for at in search_manager.agent_types}
+    # Agents, routes and patrol locations reference each other and the receptors, each is left to its own subsystem
+    agent_ids = {id(a) for agent_list in agents.values() for a in agent_list}
+    routes = [a.route for agent_list in agents.values() for a in agent_list if a.route is not None]
+    location_ids = {id(pl) for pl in search_manager.patrol_locations} | {id(r) for r in routes}
+
+    report["receptor_grid"] = deep_size(world.receptor_grid, seen, exclude=agent_ids | location_ids)
+    report["patrol_locations"] = deep_size([search_manager.patrol_locations, routes, search_manager.receptor_owner,
+                                            search_manager.zone_owner, search_manager.relaxation_history], seen,
+                                           exclude=agent_ids)
+    for model, agent_list in agents.items():
+        report[f"agents-{model}"] = deep_size(agent_list, seen)
+    report["travellers"] = deep_size(list(world.travel_manager.active_agents), seen)
+    report["stats"] = deep_size([world.travel_manager.aggregates, world.travel_manager.stats], seen)
+
+    coverage = getattr(world, "coverage", None)
+    report["coverage"] = deep_size(coverage, seen) if coverage is not None else 0
+    recorder = getattr(world, "recorder", None)
+    # The trace lives on disk, reported as the bytes written so far
+    report["trace"] = 0 if recorder is None else recorder.records * RECORD_DTYPE.itemsize
+
+    report["total"] = sum(report.values()) - report["trace"]
+    report["peak_resident"] = peak_resident_memory()
+    return report
+
+
+def polygon_cells(grid_size: float) -> tuple[int, int, int]:
+    """
+    :return: Number of dense cells, cells inside the world polygon and the perimeter of the polygon in cells
+    """
+    rows = int((settings.TOTAL_HEIGHT + 2 * settings.AREA_BORDER) // grid_size)
+    cols = int((settings.AREA_WIDTH + 2 * settings.AREA_BORDER) // grid_size)
+    # Trapezoid with parallel vertical sides of BASELINE_HEIGHT and TOTAL_HEIGHT
+    area = settings.AREA_WIDTH * (settings.BASELINE_HEIGHT + settings.TOTAL_HEIGHT) / 2
+    slanted = 2 * math.hypot(settings.AREA_WIDTH, settings.EXTENSION)
+    perimeter = settings.BASELINE_HEIGHT + settings.TOTAL_HEIGHT + slanted
+    return rows * cols, int(area / grid_size ** 2), int(perimeter / grid_size)
+
+
+def sample_sizes() -> dict:
+    """
+    Measures the marginal size of a patrol location, a searcher per agent type, a traveller and a raw
+    statistics record.
+    """
+    import agent
+    import aggregators
+    import points
+
+    # Sampling must not shift the id counters of the simulation
+    agent_id, point_id = agent.agent_id, points.point_id
+    base = points.Point(settings.BASE_X, settings.BASE_Y)
+    shared = {id(base), id(settings.COMPILED_SCENARIO)}
+
+    def sized(create) -> int:
+        # The first object stays alive while the second is measured, so its ids cannot be reused
+        seen = set(shared)
+        first = create()
+        deep_size(first, seen)
+        return deep_size(create(), seen)
+
+    searchers = {}
+    for model, values in settings.AGENT_DATA.items():
+        if values["team"] == settings.SEARCHER:
+            searchers[model] = sized(lambda: agent.Searcher(model=model, speed=values["speed"],
+                                                            endurance=values["endurance"],
+                                                            maintenance=values["maintenance"],
+                                                            skill_level=values["detection_skill"], base=base,
+                                                            operating_domain=values["operating_domain"]))
+    sizes = {"patrol_location": sized(lambda: points.PatrolLocation(0., 0., strength=1., radius=1., color="black")),
+             "searchers": searchers,
+             "traveller": sized(lambda: agent.Traveller("tbd", endurance=math.inf, speed=25, maintenance=0,
+                                                        base=base, air_visibility=settings.SMALL,
+                                                        surface_visibility=settings.MEDIUM)),
+             "stats_record": sized(lambda: {"model": "tbd", "detected": True, "time": 1.})}
+
+    statistics = aggregators.DetectionStatistics()
+    statistics.update("tbd", True, 1.)
+    sizes["aggregates"] = deep_size(statistics)
+    agent.agent_id, points.point_id = agent_id, point_id
+    return sizes
+
+
+def estimate_memory(grid_size: float = None, simulation_time: float = None, sparse: bool = None) -> dict:
+    """
+    Dry run: estimates the bytes per subsystem of a world with the loaded scenario, without building it.
+    :param grid_size: Defaults to GRID_SIZE
+    :param simulation_time: Defaults to SIMULATION_TIME
+    :param sparse: Defaults to SPARSE_GRID
+    """
+    from manager import AgentType, TravelManager
+
+    if settings.AGENT_DATA is None:
+        raise ValueError("No scenario loaded, call settings.load_scenario() before estimating.")
+    grid_size = settings.GRID_SIZE if grid_size is None else grid_size
+    simulation_time = settings.SIMULATION_TIME if simulation_time is None else simulation_time
+    sparse = settings.SPARSE_GRID if sparse is None else sparse
+    sizes = sample_sizes()
+
+    dense, in_zone, perimeter = polygon_cells(grid_size)
+    stored = min(in_zone + 2 * settings.SPARSE_GRID_HALO * perimeter, dense) if sparse else dense
+    report = {}
+    # The coordinate, mask and index arrays and the sea state with its two uniform values per stored cell,
+    # the dense index map and the pheromone field with its buffer
+    report["receptor_grid"] = stored * (16 + 1 + 8 + 3 * 8) + dense * (4 + 2 * 4)
+
+    searcher_types = {model: values for model, values in settings.AGENT_DATA.items()
+                      if values["team"] == settings.SEARCHER}
+    concurrent = {model: AgentType(model, values).concurrent_locations for model, values in searcher_types.items()}
+    locations = sum(concurrent.values())
+    # All patrol locations share the zones, each plans a boustrophedon lattice with spacing radius over its zone
+    zone_area = in_zone * grid_size ** 2 / max(locations, 1)
+    waypoints = sum(concurrent[model] * zone_area / values["radius"] ** 2 for model, values in searcher_types.items())
+    # Owners are stored per receptor and per cell
+    report["patrol_locations"] = int(locations * sizes["patrol_location"] + waypoints * 16 + stored * 4 + dense * 4)
+    for model, values in searcher_types.items():
+        report[f"agents-{model}"] = values["quantity"] * sizes["searchers"][model]
+
+    # Entries arrive once per tick with ENTRY_PROBABILITY and cross from ENTRY_X to the exit
+    transit = (settings.ENTRY_X - settings.BASE_X) / TravelManager.TRAVELLER_SPEED
+    in_flight = TravelManager.ENTRY_PROBABILITY / settings.TIME_DELTA * transit
+    finished = TravelManager.ENTRY_PROBABILITY / settings.TIME_DELTA * simulation_time
+    report["travellers"] = int(in_flight * (sizes["traveller"] + 8))
+    report["stats"] = sizes["aggregates"]
+    if settings.KEEP_RAW_STATS:
+        report["stats"] += int(finished * (sizes["stats_record"] + 8))
+
+    types = len(searcher_types)
+    report["coverage"] = dense * (types * 4 + 4 + 1) if settings.TRACK_COVERAGE else 0
+    if settings.TRAJECTORY_FILE is not None:
+        ticks = simulation_time / settings.TIME_DELTA / settings.TRAJECTORY_EVERY
+        report["trace"] = int(ticks * (locations + in_flight) * RECORD_DTYPE.itemsize)
+    else:
+        report["trace"] = 0
+
+    report["total"] = sum(report.values()) - report["trace"]
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = []
+    for name, size in report.items():
+        lines.append(f"{name:<28} {'n/a' if size is None else f'{size / 2 ** 20:10.2f} MiB'}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--grid-size", type=float, default=None)
+    parser.add_argument("--simulation-time", type=float, default=None)
+    parser.add_argument("--sparse", action="store_true", default=None)
+    parser.add_argument("--measure", type=int, default=None,
+                        help="Also build the world, simulate this many ticks and report the measured footprint")
+    args = parser.parse_args()
+
+    settings.load_scenario()
+    print("Estimate")
+    print(format_report(estimate_memory(args.grid_size, args.simulation_time, args.sparse)))
+
+    if args.measure is not None:
+        from world import World
+        if args.grid_size is not None:
+            settings.GRID_SIZE = args.grid_size
+        if args.sparse:
+            settings.SPARSE_GRID = True
+        world = World(plot=False)
+        world.simulate(until=args.measure * settings.TIME_DELTA)
+        print(f"\nMeasured after {args.measure} ticks")
+        print(format_report(memory_report(world)))
@@ -1,7 +1,5 @@
 import math
-import shapely
-
-import matplotlib.pyplot as plt
+import numpy as np
 
 import geometry
 import settings
@@ -48,28 +46,63 @@ class Point:
 
 
 class PatrolLocation(Point):
-    def __init__(self, x, y, strength: float, radius: float):
+    def __init__(self, x, y, strength: float, radius: float, color: str = None):
         super().__init__(x, y)
         self.strength = strength
         self.radius = radius
 
-        self.receptors = []
-        self.color = settings.colors.pop()
+        # Index of this location in SearchManager.patrol_locations and the shared dense owner array of all zones
+        self.zone_index = None
+        self.zone_owner = None
+        # Set while no agent of the owning type is available, the zone's receptors are then handed to its neighbours
+        self.suspended = False
+        # Plot colour, only drawn from the palette once it is used
+        self.color_name = color
 
         self.boustrophedon_path = None
 
     def __str__(self):
         return f"Patrol Location {self.color}"
 
+    @property
+    def color(self) -> str:
+        if self.color_name is None:
+            self.color_name = settings.next_color()
+        return self.color_name
+
+    @color.setter
+    def color(self, color: str) -> None:
+        self.color_name = color
+
+    def receptor_indices(self) -> np.ndarray:
+        """
+        :return: Indices of the stored receptors this location owns, read from the shared zone owner array
+        """
+        grid = settings.world.receptor_grid
+        if self.zone_owner is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.zone_owner.ravel()[grid.dense_indices] == self.zone_index)
+
+    @property
+    def receptors(self) -> list:
+        grid = settings.world.receptor_grid
+        return [grid.receptors[index] for index in self.receptor_indices().tolist()]
+
+    def receptor_coordinates(self) -> np.ndarray:
+        """
+        :return: (n, 2) coordinates of the receptors this location owns
+        """
+        return settings.world.receptor_grid.coordinates[self.receptor_indices()]
+
     def centralize(self) -> None:
-        receptors_inside_zone = [r for r in self.receptors if r.in_zone]
+        xy = self.receptor_coordinates()
 
-        if len(receptors_inside_zone) == 0:
+        if len(xy) == 0:
             self.move_to_closest_receptor()
             return
 
-        avg_x = sum(r.location.x for r in receptors_inside_zone) / len(receptors_inside_zone)
-        avg_y = sum(r.location.y for r in receptors_inside_zone) / len(receptors_inside_zone)
+        avg_x = sum(xy[:, 0].tolist()) / len(xy)
+        avg_y = sum(xy[:, 1].tolist()) / len(xy)
 
         self.x = avg_x
         self.y = avg_y
@@ -78,19 +111,45 @@ class PatrolLocation(Point):
         self.centralize()
 
     def move_to_closest_receptor(self):
-        closest_receptor = min(settings.world.receptor_grid.receptors, key=lambda r: self.distance_to(r.location))
-        self.x = closest_receptor.location.x
-        self.y = closest_receptor.location.y
+        xy = settings.world.receptor_grid.coordinates
+        closest = int(np.argmin(np.sqrt((self.x - xy[:, 0]) ** 2 + (self.y - xy[:, 1]) ** 2)))
+        self.x, self.y = xy[closest].tolist()
 
     def calculate_convex_hull(self):
-        self.convex_hull = geometry.graham_scan([r.location for r in self.receptors])
+        self.convex_hull = geometry.graham_scan([Point(x, y) for x, y in self.receptor_coordinates().tolist()])
 
     def create_boustrophedon_path(self):
+        """
+        Plans the hull and route of this location alone, see SearchManager.create_patrol_routes for all zones at once.
+        """
+        import route_planning
+        xy = self.receptor_coordinates()
+        hulls, waypoints = route_planning.plan_routes(xy, np.zeros(len(xy), dtype=np.int32),
+                                                      radii=np.array([self.radius]),
+                                                      fallback=np.array([[self.x, self.y]]))
+        self.set_route(hulls[0], waypoints[0])
+
+    def set_route(self, hull: np.ndarray, waypoints: np.ndarray) -> None:
+        """
+        Stores a planned hull and boustrophedon route given as coordinate arrays.
+        """
         import routes
-        self.calculate_convex_hull()
-        self.boustrophedon_path = routes.create_boustrophedon_path(self)
+        self.convex_hull = [Point(x, y) for x, y in hull]
+        self.boustrophedon_path = routes.Route(waypoints)
+
+    def create_patrol_route(self, start: Point = None):
+        """
+        :return: Route for an agent arriving at this location. With the boustrophedon behaviour all agents share the
+            fixed path (a replacement continues where the previous agent left), with the pheromone behaviour every
+            agent steers on its own.
+        """
+        if settings.SEARCH_BEHAVIOUR == settings.PHEROMONE_SEARCH:
+            import routes
+            return routes.PheromoneRoute(self, settings.world.receptor_grid, self.zone_owner, start=start)
+        return self.boustrophedon_path
 
     def show_boustrophedon_path(self):
+        import matplotlib.pyplot as plt
         fig = plt.figure()
         ax = fig.add_subplot()
 
@@ -105,6 +164,7 @@ class PatrolLocation(Point):
         plt.show()
 
     def select_contained_points(self, points) -> list[Point]:
+        import shapely
         polygon = shapely.Polygon([p.get_tuple() for p in self.convex_hull])
         contained_points = []
         for p in points:
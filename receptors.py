@@ -1,30 +1,26 @@
 from __future__ import annotations
 
 import settings
+import crn
 import numpy as np
-import pandas as pd
-import shapely
-
-from perlin_noise import PerlinNoise
+import weather
 
 from points import Point
 
+# Sea state of every cell before the first weather update
+INITIAL_SEA_STATE = 2
+
 
 class Receptor:
-    def __init__(self, point):
+    def __init__(self, point, in_zone: bool = None):
         self.location = point
         self.color = None
 
-        self.in_zone = self.check_if_in_zone()
+        self.in_zone = self.check_if_in_zone() if in_zone is None else in_zone
 
         self.pheromones = 0
         self.decay = True
 
-        # Sea State Variables
-        self.sea_state = 2
-        self.last_uniform_value = 0.5
-        self.new_uniform_value = 0.5
-
     def __repr__(self):
         return f'Receptor at ({self.location}) with pheromones {self.pheromones}'
 
@@ -38,6 +34,7 @@ class Receptor:
             return False
 
     def check_if_in_zone(self) -> bool:
+        import shapely
         if settings.WORLD_POLYGON.contains(shapely.Point(self.location.x, self.location.y)):
             return True
         else:
@@ -45,8 +42,22 @@ class Receptor:
 
 
 class ReceptorGrid:
-    def __init__(self):
-        self.receptors = []
+    def __init__(self, sparse: bool = None, halo: int = None, layout: dict = None):
+        """
+        Regular grid of receptors covering the world polygon plus AREA_BORDER on every side.
+        In sparse mode only the in-zone cells and a halo of cells around them are stored.
+        The grid is kept as arrays, Receptor objects are only created when they are asked for (plots, radius queries).
+        :param sparse: Store only in-zone cells (plus halo), defaults to settings.SPARSE_GRID
+        :param halo: Number of out-of-zone cells kept around the zone in sparse mode,
+            defaults to settings.SPARSE_GRID_HALO
+        :param layout: Optional precomputed grid arrays (receptor_coordinates, receptor_in_zone,
+            receptor_dense_indices, receptor_dense_to_sparse), e.g. read-only views on shared memory.
+            These are used as-is instead of being recomputed.
+        """
+        self.sparse = settings.SPARSE_GRID if sparse is None else sparse
+        self.halo = settings.SPARSE_GRID_HALO if halo is None else halo
+        self.layout = layout
+        self.receptor_list = None
 
         self.max_cols = None
         self.max_rows = None
@@ -56,11 +67,32 @@ class ReceptorGrid:
         self.area_y_start = None
         self.area_y_end = None
 
+        # Array views of the stored receptors, in the same order as self.receptors
+        self.coordinates = None
+        self.in_zone_mask = None
+        # Maps stored receptor index -> dense (row * max_cols + col) index, and dense index -> stored index or -1
+        self.dense_indices = None
+        self.dense_to_sparse = None
+
+        # Optional (t, n) array of precomputed weather noise, cycled through instead of sampling Perlin noise
+        self.weather_fields = None
+        self.weather_tick = 0
+
         self.initiate_grid()
 
+        # Sea state per stored receptor and the uniform values of the last two weather updates that drive it
+        self.sea_states = np.full(len(self.dense_indices), INITIAL_SEA_STATE, dtype=np.int64)
+        self.last_uniform_values = np.full(len(self.dense_indices), 0.5)
+        self.new_uniform_values = np.full(len(self.dense_indices), 0.5)
+        self.transition_tables = weather.transition_tables()
+
+        # Dense (rows, cols) pheromone field and the scratch buffer of its diffusion step
+        self.pheromones = np.zeros((self.max_rows, self.max_cols), dtype=np.float32)
+        self.pheromone_buffer = np.empty_like(self.pheromones)
+
     def initiate_grid(self):
         """
-        Creates all receptors in the grid given the settings.
+        Lays out the stored cells of the grid given the settings.
         """
         self.area_x_start = -settings.AREA_BORDER
         self.area_x_end = settings.AREA_WIDTH + settings.AREA_BORDER
@@ -74,27 +106,115 @@ class ReceptorGrid:
         self.max_cols = int(np.ceil(num_cols))
         self.max_rows = int(np.ceil(num_rows))
 
-        for row in range(self.max_rows):
-            for col in range(self.max_cols):
-                x_location = self.area_x_start + col * settings.GRID_SIZE
-                y_location = self.area_y_start + row * settings.GRID_SIZE
+        if self.layout is not None:
+            self.coordinates = self.layout["receptor_coordinates"]
+            self.in_zone_mask = self.layout["receptor_in_zone"]
+            self.dense_indices = self.layout["receptor_dense_indices"]
+            self.dense_to_sparse = self.layout["receptor_dense_to_sparse"]
+            if len(self.dense_to_sparse) != self.max_rows * self.max_cols:
+                raise ValueError("Receptor layout does not match the grid settings.")
+        else:
+            self.compute_layout()
 
-                self.receptors.append(Receptor(Point(x_location, y_location)))
+    @property
+    def receptors(self) -> list[Receptor]:
+        """
+        Receptor objects of the stored cells, created on first use.
+        """
+        if self.receptor_list is None:
+            self.receptor_list = [Receptor(Point(x_location, y_location), in_zone=receptor_in_zone)
+                                  for (x_location, y_location), receptor_in_zone
+                                  in zip(self.coordinates.tolist(), self.in_zone_mask.tolist())]
+        return self.receptor_list
 
-    def get_receptor_at_location(self, point: Point) -> Receptor | None:
+    def compute_layout(self) -> None:
+        """
+        Determines the coordinates and in-zone flags of the stored cells.
+        """
+        import shapely
+        rows, cols = np.divmod(np.arange(self.max_rows * self.max_cols), self.max_cols)
+        x_locations = self.area_x_start + cols * settings.GRID_SIZE
+        y_locations = self.area_y_start + rows * settings.GRID_SIZE
+        in_zone = shapely.contains_xy(settings.WORLD_POLYGON, x_locations, y_locations)
+
+        if self.sparse:
+            stored = self.dilate(in_zone.reshape(self.max_rows, self.max_cols), self.halo).ravel()
+        else:
+            stored = np.ones(len(in_zone), dtype=bool)
 
-        if (point.x < self.area_y_start
-                or self.area_x_end < point.x
-                or point.y < self.area_y_start
-                or self.area_y_end < point.y):
-            raise ValueError(f"Illegal location - {point}")
+        self.dense_indices = np.flatnonzero(stored)
+        self.dense_to_sparse = np.full(len(stored), -1, dtype=np.int32)
+        self.dense_to_sparse[self.dense_indices] = np.arange(len(self.dense_indices), dtype=np.int32)
 
-        row = int((point.y - self.area_y_start) / settings.GRID_SIZE)
-        col = int((point.x - self.area_x_start) / settings.GRID_SIZE)
-        index = row * self.max_cols + col
+        self.coordinates = np.column_stack((x_locations[stored], y_locations[stored])).astype(float)
+        self.in_zone_mask = in_zone[stored]
+
+    @staticmethod
+    def dilate(mask: np.ndarray, cells: int) -> np.ndarray:
+        """
+        Grows a 2-D boolean mask by a square of the given number of cells.
+        """
+        grown = mask.copy()
+        rows, cols = mask.shape
+        for d_row in range(-cells, cells + 1):
+            for d_col in range(-cells, cells + 1):
+                shifted = np.zeros_like(mask)
+                shifted[max(d_row, 0):rows + min(d_row, 0), max(d_col, 0):cols + min(d_col, 0)] = \
+                    mask[max(-d_row, 0):rows + min(-d_row, 0), max(-d_col, 0):cols + min(-d_col, 0)]
+                grown |= shifted
+        return grown
+
+    def dense_index_at(self, x: float, y: float) -> int:
+        """
+        :return: Dense (row * max_cols + col) index of the cell containing the coordinates
+        """
+        if (x < self.area_x_start
+                or self.area_x_end < x
+                or y < self.area_y_start
+                or self.area_y_end < y):
+            raise ValueError(f"Illegal location - ({x}, {y})")
 
+        row = min(int((y - self.area_y_start) / settings.GRID_SIZE), self.max_rows - 1)
+        col = min(int((x - self.area_x_start) / settings.GRID_SIZE), self.max_cols - 1)
+        return row * self.max_cols + col
+
+    def cell_at(self, x: float, y: float) -> tuple[int, int] | None:
+        """
+        :return: (row, col) of the cell containing the coordinates, None outside the grid
+        """
+        row = int((y - self.area_y_start) // settings.GRID_SIZE)
+        col = int((x - self.area_x_start) // settings.GRID_SIZE)
+        if 0 <= row < self.max_rows and 0 <= col < self.max_cols:
+            return row, col
+        return None
+
+    def to_dense(self, values: np.ndarray, fill=0) -> np.ndarray:
+        """
+        Scatters an array with one value per stored receptor onto the dense (rows, cols) grid.
+        """
+        values = np.asarray(values)
+        dense = np.full(self.max_rows * self.max_cols, fill, dtype=values.dtype)
+        dense[self.dense_indices] = values
+        return dense.reshape(self.max_rows, self.max_cols)
+
+    def get_receptor_at_location(self, point: Point) -> Receptor | None:
+        """
+        :return: The receptor of the cell containing the point, None if the cell is not stored (sparse mode)
+        """
+        index = self.dense_to_sparse[self.dense_index_at(point.x, point.y)]
+        if index < 0:
+            return None
         return self.receptors[index]
 
+    def sea_state_at(self, point: Point) -> int:
+        """
+        :return: Sea state of the cell containing the point, DEFAULT_SEA_STATE if the cell is not stored (sparse mode)
+        """
+        index = self.dense_to_sparse[self.dense_index_at(point.x, point.y)]
+        if index < 0:
+            return settings.DEFAULT_SEA_STATE
+        return int(self.sea_states[index])
+
     def select_receptors_in_radius(self, point: Point, radius: float) -> list:
         """
         Select all the receptors within a radius of a point.
@@ -106,22 +226,20 @@ class ReceptorGrid:
         # only check receptors in the rectangle of size radius - select receptors in the list based on
         # how the list is constructed.
         x, y = point.x, point.y
-        min_x = x - radius
-        max_x = x + radius
-        min_y = y - radius
-        max_y = y + radius
 
         # see in which rows and columns this rectangle is:
-        min_row = int(max(np.floor((min_x - self.area_x_start) / settings.GRID_SIZE), 0))
-        max_row = int(min(np.ceil((max_x - self.area_x_end) / settings.GRID_SIZE), self.max_rows))
+        min_col = int(max(np.floor((x - radius - self.area_x_start) / settings.GRID_SIZE), 0))
+        max_col = int(min(np.ceil((x + radius - self.area_x_start) / settings.GRID_SIZE) + 1, self.max_cols))
 
-        min_col = int(max(np.floor((min_y - self.area_y_start) / settings.GRID_SIZE), 0))
-        max_col = int(min(np.ceil((max_y - self.area_y_end) / settings.GRID_SIZE), self.max_cols))
+        min_row = int(max(np.floor((y - radius - self.area_y_start) / settings.GRID_SIZE), 0))
+        max_row = int(min(np.ceil((y + radius - self.area_y_start) / settings.GRID_SIZE) + 1, self.max_rows))
 
         receptors_in_radius = []
         for row_index in range(min_row, max_row):
             for col_index in range(min_col, max_col):
-                index = self.max_cols * row_index + col_index
+                index = self.dense_to_sparse[self.max_cols * row_index + col_index]
+                if index < 0:
+                    continue
                 r = self.receptors[index]
 
                 if r.in_range_of_point(point, radius):
@@ -135,41 +253,54 @@ class ReceptorGrid:
         :return:
         """
         self.update_u_values()
-
-        for receptor in self.receptors:
-            transition_probabilities = settings.weather_markov_dict[receptor.sea_state]
-            prob = 0
-            for key in transition_probabilities.keys():
-                prob += transition_probabilities[key]
-                if prob > receptor.new_uniform_value:
-                    receptor.sea_state = key
-                    break
+        self.sea_states = weather.next_sea_states(self.sea_states, self.new_uniform_values, self.transition_tables)
 
     def update_u_values(self) -> None:
         """
         Updates the uniform probabilities for each receptor, which serves as input to sample the next transition
         in the Markov Chain.
+        The noise is normalised over the dense grid in both modes, so sparse grids store the same values as the cells
+        of a dense grid.
         :return:
         """
-        cols = self.max_cols
-        rows = self.max_rows
-
-        noise = PerlinNoise(octaves=8)
-        noise_data = [[noise([j / rows, i / cols]) for i in range(cols)] for j in range(rows)]
-        # normalize noise
-        min_value = min(x if isinstance(x, int) else min(x) for x in noise_data)
-        noise_data = [[n + abs(min_value) for n in rows] for rows in noise_data]
-        max_value = max(x if isinstance(x, int) else max(x) for x in noise_data)
-        noise_data = [[n / max_value for n in rows] for rows in noise_data]
-        min(x if isinstance(x, int) else min(x) for x in noise_data)
-        max(x if isinstance(x, int) else max(x) for x in noise_data)
-        new_u_matrix = noise_data
-
-        for index, receptor in enumerate(self.receptors):
-            receptor.last_uniform_value = receptor.new_uniform_value
-            receptor.new_uniform_value = new_u_matrix[index // cols][index % cols]
-
-    def receptors_as_dataframe(self) -> pd.DataFrame:
+        self.last_uniform_values = self.new_uniform_values
+        if self.weather_fields is not None:
+            self.new_uniform_values = self.weather_fields[self.weather_tick % len(self.weather_fields)].astype(float)
+            self.weather_tick += 1
+            return
+
+        self.new_uniform_values = weather.uniform_field(self.max_rows, self.max_cols,
+                                                        crn.weather_seed())[self.dense_indices]
+
+    def deposit_pheromones(self, x: float, y: float, amount: float) -> None:
+        cell = self.cell_at(x, y)
+        if cell is not None:
+            self.pheromones[cell] += amount
+
+    def update_pheromones(self) -> None:
+        """
+        Decays the pheromone field and diffuses it with the separable kernel [a, 1 - 2a, a] along rows and
+        columns (reflecting edges, so diffusion itself conserves the total amount).
+        """
+        field = self.pheromones
+        buffer = self.pheromone_buffer
+        a = settings.PHEROMONE_DIFFUSION * settings.TIME_DELTA
+        field *= (1 - settings.PHEROMONE_DECAY) ** settings.TIME_DELTA
+
+        np.multiply(field, 1 - 2 * a, out=buffer)
+        buffer[1:] += a * field[:-1]
+        buffer[:-1] += a * field[1:]
+        buffer[0] += a * field[0]
+        buffer[-1] += a * field[-1]
+
+        np.multiply(buffer, 1 - 2 * a, out=field)
+        field[:, 1:] += a * buffer[:, :-1]
+        field[:, :-1] += a * buffer[:, 1:]
+        field[:, 0] += a * buffer[:, 0]
+        field[:, -1] += a * buffer[:, -1]
+
+    def receptors_as_dataframe(self) -> "pandas.DataFrame":
+        import pandas as pd
         records = []
         for receptor in self.receptors:
             if receptor.color is None:
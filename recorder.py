@@ -0,0 +1,117 @@
+"""
+Records the trajectories of a run to a compact binary file for later inspection, see replay.py.
+
+A trajectory file starts with MAGIC, the length of the JSON header as a little-endian uint32 and the header itself
+(settings, searcher models, patrol layout, record dtype). The rest of the file is a flat array of RECORD_DTYPE
+records: one per active agent per recorded tick, plus one per detection.
+"""
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SDTRAJ01"
+
+SEARCHER = 0
+TRAVELLER = 1
+DETECTION = 2
+
+RECORD_DTYPE = np.dtype([("tick", "<u4"),
+                         ("time", "<f4"),
+                         ("kind", "u1"),
+                         ("returning", "u1"),
+                         ("agent_type", "<i2"),
+                         ("zone", "<i2"),
+                         ("agent_id", "<u4"),
+                         ("x", "<f4"),
+                         ("y", "<f4")])
+
+
+class TrajectoryRecorder:
+    def __init__(self, world, path: str, every: int = None):
+        """
+        :param world: World to record, writes the header immediately
+        :param path: Output file, overwritten
+        :param every: Record agent positions every n ticks, defaults to TRAJECTORY_EVERY. Detections are always
+            recorded.
+        """
+        self.world = world
+        self.path = path
+        self.every = settings.TRAJECTORY_EVERY if every is None else every
+        self.tick = 0
+        self.records = 0
+
+        search_manager = world.search_manager
+        header = {"time_delta": settings.TIME_DELTA,
+                  "every": self.every,
+                  "area_width": settings.AREA_WIDTH,
+                  "total_height": settings.TOTAL_HEIGHT,
+                  "polygon": [list(c) for c in settings.WORLD_POLYGON.exterior.coords],
+                  "agent_types": [at.model for at in search_manager.agent_types],
+                  "patrol_centers": [[pl.x, pl.y] for pl in search_manager.patrol_locations],
+                  "patrol_colors": [pl.color for pl in search_manager.patrol_locations],
+                  "base": [settings.BASE_X, settings.BASE_Y],
+                  "dtype": RECORD_DTYPE.descr}
+        encoded = json.dumps(header).encode()
+
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, detected_agents: list = (), ticks: int = 1) -> None:
+        """
+        Writes the active agents (if the step holds a recorded tick) and the given detected travellers of the step.
+        :param ticks: Number of base ticks (TIME_DELTA) in the step, under ADAPTIVE_TIME_STEP one step can hold
+            several or none
+        """
+        rows = []
+        time = settings.world_time
+        if -self.tick % self.every < ticks:
+            for type_index, at in enumerate(self.world.search_manager.agent_types):
+                for a in at.active_agents:
+                    rows.append((self.tick, time, SEARCHER, a.returning, type_index, a.patrol_location.zone_index,
+                                 a.agent_id, a.location.x, a.location.y))
+            for t in self.world.travel_manager.active_agents:
+                rows.append((self.tick, time, TRAVELLER, False, -1, -1, t.agent_id, t.location.x, t.location.y))
+        for t in detected_agents:
+            rows.append((self.tick, time, DETECTION, False, -1, -1, t.agent_id, t.location.x, t.location.y))
+
+        if rows:
+            np.array(rows, dtype=RECORD_DTYPE).tofile(self.file)
+            self.records += len(rows)
+        self.tick += ticks
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+            logger.info(f"Recorded {self.records} records over {self.tick} ticks to {self.path}")
+
+
+def read_trajectory(path: str) -> tuple[dict, np.ndarray]:
+    """
+    :return: The header and the records of a trajectory file, the records are memory mapped
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file.")
+        (length,) = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(length))
+    offset = len(MAGIC) + 4 + length
+    dtype = np.dtype([tuple(field) for field in header["dtype"]])
+    if os.path.getsize(path) == offset:
+        return header, np.empty(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode="r", offset=offset)
@@ -0,0 +1,148 @@
+"""
+Vectorized Lloyd-style relaxation of the patrol locations over the receptor grid.
+
+Every iteration moves each patrol centre to the centroid of the receptors it owns and then reassigns the receptors
+to the closest centre (weighted adjusted manhattan distance, see Point.distance_to). The loop stops as soon as the
+centres stop moving and the strength-share score stops improving, instead of running a fixed number of rounds.
+"""
+import logging
+
+import numpy as np
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+def assign_receptors(receptor_xy: np.ndarray, centers: np.ndarray, strengths: np.ndarray,
+                     chunk_size: int = 65536) -> np.ndarray:
+    """
+    Assigns every receptor to the patrol location with the smallest "adj manhattan" distance scaled by
+    1 / sqrt(strength).
+    :param receptor_xy: (n, 2) array of receptor coordinates
+    :param centers: (k, 2) array of patrol location centres
+    :param strengths: (k,) array of patrol location strengths
+    :param chunk_size: Number of receptors evaluated at once, bounds the (chunk, k) distance matrix
+    :return: (n,) array with the index of the owning patrol location for each receptor
+    """
+    vertical_weight = 1 - settings.SEARCH_VERTICAL_ALIGNMENT
+    scale = 1 / np.sqrt(strengths)
+    owner = np.empty(len(receptor_xy), dtype=np.int32)
+
+    for start in range(0, len(receptor_xy), chunk_size):
+        block = receptor_xy[start:start + chunk_size]
+        distance = (np.abs(block[:, 0, None] - centers[None, :, 0])
+                    + vertical_weight * np.abs(block[:, 1, None] - centers[None, :, 1]))
+        owner[start:start + chunk_size] = np.argmin(distance * scale[None, :], axis=1)
+    return owner
+
+
+def zone_centroids(receptor_xy: np.ndarray, owner: np.ndarray, centers: np.ndarray,
+                   fallback_xy: np.ndarray) -> np.ndarray:
+    """
+    Computes the centroid of the receptors owned by each patrol location.
+    Locations without receptors move to their closest point in fallback_xy, like PatrolLocation.centralize.
+    :param receptor_xy: (n, 2) coordinates of the assigned receptors
+    :param owner: (n,) owning patrol location per receptor
+    :param centers: (k, 2) current centres
+    :param fallback_xy: (m, 2) candidate coordinates for centres that own no receptors
+    :return: (k, 2) array of new centres
+    """
+    k = len(centers)
+    counts = np.bincount(owner, minlength=k)
+    sum_x = np.bincount(owner, weights=receptor_xy[:, 0], minlength=k)
+    sum_y = np.bincount(owner, weights=receptor_xy[:, 1], minlength=k)
+
+    new_centers = centers.copy()
+    filled = counts > 0
+    new_centers[filled, 0] = sum_x[filled] / counts[filled]
+    new_centers[filled, 1] = sum_y[filled] / counts[filled]
+
+    for index in np.flatnonzero(~filled):
+        squared_distance = ((fallback_xy - centers[index]) ** 2).sum(axis=1)
+        new_centers[index] = fallback_xy[np.argmin(squared_distance)]
+    return new_centers
+
+
+def adjacent_zones(zone_owner: np.ndarray, zones) -> set[int]:
+    """
+    :param zone_owner: Dense (rows, cols) owning zone per cell, negative for unassigned cells
+    :param zones: Zone indices
+    :return: The zones sharing a cell edge with any of the given zones, the given zones excluded
+    """
+    zones = np.asarray(list(zones), dtype=zone_owner.dtype)
+    pairs = np.concatenate([np.stack([zone_owner[:, :-1].ravel(), zone_owner[:, 1:].ravel()], axis=1),
+                            np.stack([zone_owner[:-1].ravel(), zone_owner[1:].ravel()], axis=1)])
+    pairs = pairs[(pairs[:, 0] != pairs[:, 1]) & (pairs >= 0).all(axis=1)]
+    neighbours = np.concatenate([pairs[np.isin(pairs[:, 0], zones), 1], pairs[np.isin(pairs[:, 1], zones), 0]])
+    return set(np.unique(neighbours).tolist()) - set(zones.tolist())
+
+
+def share_score(owner: np.ndarray, strengths: np.ndarray) -> float:
+    """
+    Sum of absolute differences between the share of receptors owned by each patrol location and its share of the
+    total strength. A perfect tessellation scores 0.
+    """
+    shares = np.bincount(owner, minlength=len(strengths)) / max(len(owner), 1)
+    return float(np.abs(shares - strengths / strengths.sum()).sum())
+
+
+def relax_patrol_centers(receptor_xy: np.ndarray,
+                         centers: np.ndarray,
+                         strengths: np.ndarray,
+                         fallback_xy: np.ndarray = None,
+                         owner: np.ndarray = None,
+                         max_iterations: int = None,
+                         center_tolerance: float = None,
+                         score_tolerance: float = None) -> tuple[np.ndarray, np.ndarray, list[dict]]:
+    """
+    Runs the relaxation until both the largest centre displacement and the change in share score fall below their
+    tolerances, or until max_iterations is reached.
+    Passing the centres (and optionally the owner array) of a previous layout warm-starts the relaxation.
+    :param receptor_xy: (n, 2) coordinates of the in-zone receptors
+    :param centers: (k, 2) starting centres
+    :param strengths: (k,) strengths of the patrol locations
+    :param fallback_xy: Coordinates used to re-seat centres that own no receptors, defaults to receptor_xy
+    :param owner: Assignment belonging to centers, if None the first iteration starts from an empty assignment
+    :param max_iterations: Defaults to settings.PATROL_ZONE_ITERATIONS
+    :param center_tolerance: Defaults to settings.PATROL_CENTER_TOLERANCE
+    :param score_tolerance: Defaults to settings.PATROL_SCORE_TOLERANCE
+    :return: Relaxed centres, owner per receptor and the convergence history (one dict per iteration)
+    """
+    if max_iterations is None:
+        max_iterations = settings.PATROL_ZONE_ITERATIONS
+    if center_tolerance is None:
+        center_tolerance = settings.PATROL_CENTER_TOLERANCE
+    if score_tolerance is None:
+        score_tolerance = settings.PATROL_SCORE_TOLERANCE
+    if fallback_xy is None:
+        fallback_xy = receptor_xy
+
+    centers = np.asarray(centers, dtype=float).copy()
+    strengths = np.asarray(strengths, dtype=float)
+    if owner is None:
+        # Mirrors the object based version, where patrol locations without receptors move to the closest receptor
+        owner = np.full(len(receptor_xy), -1, dtype=np.int32)
+
+    history = []
+    previous_score = None
+    for iteration in range(max_iterations):
+        assigned = owner >= 0
+        new_centers = zone_centroids(receptor_xy[assigned], owner[assigned], centers, fallback_xy)
+        displacement = float(np.sqrt(((new_centers - centers) ** 2).sum(axis=1)).max()) if len(centers) else 0.
+        centers = new_centers
+
+        owner = assign_receptors(receptor_xy, centers, strengths)
+        score = share_score(owner, strengths)
+        score_change = np.inf if previous_score is None else abs(previous_score - score)
+        previous_score = score
+
+        history.append({"iteration": iteration,
+                        "displacement": displacement,
+                        "score": score,
+                        "score_change": score_change})
+
+        if displacement < center_tolerance and score_change < score_tolerance:
+            logger.debug(f"Patrol relaxation converged after {iteration + 1} iterations")
+            break
+    return centers, owner, history
@@ -0,0 +1,98 @@
+"""
+Replays a trajectory file written by recorder.TrajectoryRecorder, in an interactive window or to a video file.
+
+    python replay.py run.traj [--fps 20] [--save run.mp4]
+"""
+import argparse
+import logging
+
+import numpy as np
+
+import recorder
+
+logger = logging.getLogger(__name__)
+
+# Number of frames a detection stays marked
+DETECTION_FRAMES = 10
+
+
+class Replay:
+    def __init__(self, path: str):
+        self.header, self.records = recorder.read_trajectory(path)
+        kind = self.records["kind"]
+        positions = self.records[kind != recorder.DETECTION]
+        self.detections = self.records[kind == recorder.DETECTION]
+
+        # Records are written tick by tick, so each frame is a contiguous slice
+        self.ticks, starts = np.unique(positions["tick"], return_index=True)
+        self.bounds = np.append(starts, len(positions))
+        self.positions = positions
+        self.detection_ticks = self.detections["tick"].astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def frame(self, index: int) -> dict:
+        """
+        :return: Time, searcher and traveller locations and recent detections of a frame
+        """
+        rows = self.positions[self.bounds[index]:self.bounds[index + 1]]
+        searchers = rows[rows["kind"] == recorder.SEARCHER]
+        travellers = rows[rows["kind"] == recorder.TRAVELLER]
+
+        tick = int(self.ticks[index])
+        window = self.header["every"] * DETECTION_FRAMES
+        recent = self.detections[(self.detection_ticks <= tick) & (self.detection_ticks > tick - window)]
+        return {"time": float(rows["time"][0]),
+                "searchers": np.column_stack([searchers["x"], searchers["y"]]),
+                "searcher_zones": searchers["zone"].astype(np.int64),
+                "travellers": np.column_stack([travellers["x"], travellers["y"]]),
+                "detections": np.column_stack([recent["x"], recent["y"]])}
+
+    def render(self, fps: float = 20, save: str = None) -> None:
+        import matplotlib.colors as mcolors
+        from matplotlib import pyplot as plt
+        from matplotlib.animation import FuncAnimation
+
+        header = self.header
+        fig, ax = plt.subplots()
+        polygon = np.array(header["polygon"])
+        ax.plot(polygon[:, 0], polygon[:, 1], color="grey", zorder=0)
+        centers = np.array(header["patrol_centers"]).reshape(-1, 2)
+        ax.scatter(centers[:, 0], centers[:, 1], color=header["patrol_colors"], edgecolors="black", alpha=0.4)
+        ax.scatter(*header["base"], color="black", marker="s")
+        ax.set_xlim(0, header["area_width"])
+        ax.set_ylim(0, header["total_height"])
+
+        zone_colors = np.array([mcolors.to_rgba(c) for c in header["patrol_colors"]]).reshape(-1, 4)
+        empty = np.empty((0, 2))
+        searchers = ax.scatter(empty[:, 0], empty[:, 1], marker="X", zorder=2, edgecolor="black")
+        travellers = ax.scatter(empty[:, 0], empty[:, 1], color="forestgreen", marker="<", zorder=2,
+                                edgecolor="black")
+        detections = ax.scatter(empty[:, 0], empty[:, 1], color="red", marker="*", s=120, zorder=3)
+        title = ax.set_title("")
+
+        def draw(index):
+            frame = self.frame(index)
+            searchers.set_offsets(frame["searchers"])
+            searchers.set_facecolor(zone_colors[frame["searcher_zones"]])
+            travellers.set_offsets(frame["travellers"])
+            detections.set_offsets(frame["detections"])
+            title.set_text(f"World At {frame['time']:.2f}")
+            return searchers, travellers, detections, title
+
+        animation = FuncAnimation(fig, draw, frames=len(self), interval=1000 / fps, blit=save is None)
+        if save is None:
+            plt.show()
+        else:
+            animation.save(save, fps=fps)
+            logger.info(f"Saved {len(self)} frames to {save}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--fps", type=float, default=20)
+    parser.add_argument("--save", default=None, help="Video file to write instead of showing the replay")
+    args = parser.parse_args()
+    Replay(args.path).render(fps=args.fps, save=args.save)
@@ -0,0 +1,112 @@
+"""
+Runs independent replications of a scenario in a pool of worker processes.
+The static world (grid, patrol layout, routes, optional precomputed weather) is built once in the parent and
+shared through shared memory. Each worker creates its own agents, random streams and statistics, and its own weather
+and pheromone arrays on top of the shared grid arrays (see shared_world.py).
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import random
+from functools import partial
+
+import numpy as np
+
+import checkpoint
+from crn import RandomStreams
+from aggregators import DetectionStatistics, merge_statistics
+import settings
+import shared_world
+import steady_state
+
+logger = logging.getLogger(__name__)
+
+# Static arrays attached by the worker initializer, kept alive for the lifetime of the worker
+worker_static = None
+worker_memory = None
+
+
+def attach_worker(handle: dict) -> None:
+    global worker_static, worker_memory
+    worker_static, worker_memory = shared_world.attach_static(handle)
+
+
+def run_replication(seed: int, simulation_time: float = None, static=None,
+                    common_random_numbers: bool = False, callbacks: list = None) -> dict:
+    """
+    Simulates one replication on the static world.
+    :param seed: Seed of the Python and NumPy random generators of this replication
+    :param simulation_time: Defaults to settings.SIMULATION_TIME
+    :param static: Static arrays, defaults to the arrays attached by the worker initializer
+    :param common_random_numbers: Draw arrivals, weather and detections from the streams of crn.RandomStreams(seed),
+        so replications of other layouts with the same seed share them
+    :param callbacks: Registered with the world before it runs, see World.add_callback
+    :return: Summary of the replication, see summarize_replication
+    """
+    static = worker_static if static is None else static
+    random.seed(seed)
+    np.random.seed(seed)
+    settings.random_streams = RandomStreams(seed) if common_random_numbers else None
+    settings.world_time = 0
+
+    world = checkpoint.build_world(static)
+    if settings.STEADY_STATE_START:
+        steady_state.initialize_sea_states(world.receptor_grid)
+    world.search_manager.activate_patrol_locations()
+    for callback in [] if callbacks is None else callbacks:
+        world.add_callback(callback)
+    # Activation consumed random numbers, store the generators the world starts its run with, see World.resume
+    world.suspend()
+    world.simulate(until=simulation_time)
+    return summarize_replication(world, seed)
+
+
+def summarize_replication(world, seed: int) -> dict:
+    """
+    :return: Counts and detection rate, the mergeable aggregates and (with KEEP_RAW_STATS) the raw records
+    """
+    aggregates = world.travel_manager.aggregates
+    return {"seed": seed,
+            "travellers": aggregates.travellers,
+            "detected": aggregates.detected,
+            "detection_rate": aggregates.detection_rate,
+            "aggregates": aggregates,
+            "stats": world.travel_manager.stats}
+
+
+def merge_replications(results: list[dict]) -> DetectionStatistics:
+    """
+    :return: Aggregates over all replications
+    """
+    return merge_statistics([r["aggregates"] for r in results])
+
+
+def run_replications(world, seeds: list[int], simulation_time: float = None, processes: int = None,
+                     weather_fields: np.ndarray = None, common_random_numbers: bool = False) -> list[dict]:
+    """
+    Runs one replication per seed on the patrol layout of the given world.
+    :param world: World providing the static layout, its own dynamic state is not used
+    :param seeds: One seed per replication
+    :param simulation_time: Defaults to settings.SIMULATION_TIME
+    :param processes: Number of worker processes, defaults to the number of cores. With 1 no pool is created.
+    :param weather_fields: Optional precomputed weather noise shared by all replications
+    :param common_random_numbers: See run_replication
+    :return: List of replication summaries, in the order of seeds
+    """
+    if processes == 1:
+        static = checkpoint.capture_static(world)
+        if weather_fields is not None:
+            static["weather_fields"] = weather_fields
+        world_time = settings.world_time
+        results = [run_replication(seed, simulation_time, static=static,
+                                   common_random_numbers=common_random_numbers) for seed in seeds]
+        settings.world, settings.world_time, settings.random_streams = world, world_time, None
+        return results
+
+    with shared_world.publish_static_world(world, weather_fields) as shared:
+        with multiprocessing.Pool(processes, initializer=attach_worker, initargs=(shared.handle,)) as pool:
+            results = pool.map(partial(run_replication, simulation_time=simulation_time,
+                                       common_random_numbers=common_random_numbers), seeds)
+    logger.info(f"Finished {len(results)} replications")
+    return results
@@ -0,0 +1,137 @@
+"""
+Builds the convex hulls and boustrophedon (lawnmower) waypoints of all patrol zones in one pass over the
+receptor-owner array, working on coordinate and index arrays instead of Point objects.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def cross(o: np.ndarray, a: np.ndarray, b: np.ndarray) -> float:
+    """
+    z-component of (a - o) x (b - o), positive for a counter-clockwise turn o -> a -> b.
+    """
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def monotone_chain(xy: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Andrew's monotone chain convex hull on a subset of points.
+    :param xy: (n, 2) array of all coordinates
+    :param indices: Indices into xy, sorted by x and then by y
+    :return: Indices of the hull vertices in counter-clockwise order, starting at the lowest-left point
+    """
+    if len(indices) < 3:
+        return np.asarray(indices)
+
+    lower = []
+    for i in indices:
+        while len(lower) >= 2 and cross(xy[lower[-2]], xy[lower[-1]], xy[i]) <= 0:
+            lower.pop()
+        lower.append(i)
+
+    upper = []
+    for i in indices[::-1]:
+        while len(upper) >= 2 and cross(xy[upper[-2]], xy[upper[-1]], xy[i]) <= 0:
+            upper.pop()
+        upper.append(i)
+
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def hull_candidates(xy: np.ndarray, owner: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    On a regular grid only the lowest and highest receptor of every column of a zone can be a hull vertex.
+    Selects those for all zones at once.
+    :param xy: (n, 2) receptor coordinates
+    :param owner: (n,) owning zone per receptor, negative for unassigned receptors
+    :return: Candidate receptor indices sorted by (owner, x, y) and their owners
+    """
+    assigned = np.flatnonzero(owner >= 0)
+    order = assigned[np.lexsort((xy[assigned, 1], xy[assigned, 0], owner[assigned]))]
+
+    zone = owner[order]
+    column = xy[order, 0]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (zone[1:] != zone[:-1]) | (column[1:] != column[:-1])
+    last_in_group = np.roll(new_group, -1)
+
+    candidates = order[new_group | last_in_group]
+    return candidates, owner[candidates]
+
+
+def contained_mask(points: np.ndarray, hull: np.ndarray) -> np.ndarray:
+    """
+    Vectorized strict containment test of points in a counter-clockwise convex polygon.
+    :param points: (n, 2) coordinates to test
+    :param hull: (m, 2) hull vertices in counter-clockwise order
+    :return: (n,) boolean mask, points on the boundary are not contained (as shapely's contains)
+    """
+    if len(hull) < 3 or len(points) == 0:
+        return np.zeros(len(points), dtype=bool)
+    start = hull
+    edge = np.roll(hull, -1, axis=0) - hull
+    relative = points[:, None, :] - start[None, :, :]
+    turn = edge[None, :, 0] * relative[:, :, 1] - edge[None, :, 1] * relative[:, :, 0]
+    return (turn > 0).all(axis=1)
+
+
+def boustrophedon_waypoints(hull: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Lays a lattice with spacing radius inside the bounding box of the hull (shrunk by radius), orders it column by
+    column while alternating up and down, and keeps the lattice points inside the hull.
+    :param hull: (m, 2) hull vertices in counter-clockwise order
+    :param radius: Patrol radius, used as lattice spacing
+    :return: (w, 2) waypoints in boustrophedon order
+    """
+    min_x, min_y = hull.min(axis=0) + radius
+    max_x, max_y = hull.max(axis=0) - radius
+
+    horizontal_dots = max(int((max_x - min_x) // radius), 0)
+    vertical_dots = max(int((max_y - min_y) // radius), 0)
+
+    xs = min_x + radius * np.arange(horizontal_dots)
+    ys = min_y + radius * np.arange(vertical_dots)
+    lattice_y = np.tile(ys, (horizontal_dots, 1))
+    lattice_y[1::2] = lattice_y[1::2, ::-1]
+    lattice_x = np.repeat(xs, vertical_dots).reshape(horizontal_dots, vertical_dots)
+
+    lattice = np.column_stack((lattice_x.ravel(), lattice_y.ravel()))
+    return lattice[contained_mask(lattice, hull)]
+
+
+def plan_routes(xy: np.ndarray, owner: np.ndarray, radii: np.ndarray,
+                fallback: np.ndarray = None, zones: np.ndarray = None) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """
+    Creates the hull and the boustrophedon waypoints for every zone.
+    :param xy: (n, 2) receptor coordinates
+    :param owner: (n,) owning zone per receptor, negative for unassigned receptors
+    :param radii: (k,) patrol radius per zone
+    :param fallback: (k, 2) waypoint used for zones too small to fit a single lattice point, e.g. the zone centres
+    :param zones: Only plan these zone indices, the others are returned as None
+    :return: List of hull arrays and list of waypoint arrays, indexed by zone
+    """
+    k = len(radii)
+    hulls = [None] * k
+    waypoints = [None] * k
+
+    candidates, candidate_owner = hull_candidates(xy, owner)
+    bounds = np.searchsorted(candidate_owner, np.arange(k + 1))
+    wanted = range(k) if zones is None else zones
+
+    for zone in wanted:
+        zone_candidates = candidates[bounds[zone]:bounds[zone + 1]]
+        hull = xy[monotone_chain(xy, zone_candidates)] if len(zone_candidates) else np.empty((0, 2))
+        hulls[zone] = hull
+
+        route = boustrophedon_waypoints(hull, radii[zone]) if len(hull) >= 3 else np.empty((0, 2))
+        if len(route) == 0:
+            logger.debug(f"Zone {zone} is too small for radius {radii[zone]}, patrolling a single waypoint.")
+            if fallback is not None:
+                route = np.asarray(fallback[zone], dtype=float).reshape(1, 2)
+            elif len(hull):
+                route = hull.mean(axis=0).reshape(1, 2)
+        waypoints[zone] = route
+    return hulls, waypoints
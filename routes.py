@@ -1,28 +1,138 @@
+import numpy as np
+
 import points
+import settings
 
 
 class Route:
-    def __init__(self, waypoints: list[points.Point]):
-        self.waypoints = waypoints
+    def __init__(self, waypoints: list[points.Point] | np.ndarray):
+        """
+        Cyclic route over a set of waypoints, stored as a coordinate array with a cursor on the next waypoint.
+        :param waypoints: List of Points or (n, 2) array of coordinates
+        """
+        if isinstance(waypoints, np.ndarray):
+            self.coordinates = np.asarray(waypoints, dtype=float).reshape(-1, 2)
+            self.fixed_points = None
+        else:
+            self.coordinates = np.array([p.get_tuple() for p in waypoints], dtype=float).reshape(-1, 2)
+            # Routes handed existing Points (e.g. a base) keep returning these same objects
+            self.fixed_points = list(waypoints)
+        self.cursor = 0
+        self.next_point = None
 
     def __repr__(self) -> str:
         return str([str(p) for p in self.waypoints])
 
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    @property
+    def waypoints(self) -> list[points.Point]:
+        """
+        The waypoints as Points, starting at the next point in line.
+        """
+        order = np.roll(np.arange(len(self.coordinates)), -self.cursor)
+        if self.fixed_points is not None:
+            return [self.fixed_points[i] for i in order]
+        return [points.Point(*self.coordinates[i]) for i in order]
+
     def cycle_next_point(self) -> None:
         """
         Moves the next point in line to the back of the route
         :return:
         """
-        waypoint = self.waypoints.pop(0)
-        self.waypoints.append(waypoint)
+        self.cursor = (self.cursor + 1) % len(self.coordinates)
+        self.next_point = None
+
+    def get_next_point(self) -> points.Point:
+        if self.next_point is None:
+            if self.fixed_points is not None:
+                self.next_point = self.fixed_points[self.cursor]
+            else:
+                x, y = self.coordinates[self.cursor]
+                self.next_point = points.Point(float(x), float(y))
+        return self.next_point
+
+
+class PheromoneRoute:
+    # The eight compass directions a searcher can steer to
+    DIRECTIONS = np.array([[1, 0], [1, 1], [0, 1], [-1, 1], [-1, 0], [-1, -1], [0, -1], [1, -1]], dtype=float)
+
+    def __init__(self, patrol_location: points.PatrolLocation, receptor_grid, zone_owner: np.ndarray,
+                 start: points.Point = None):
+        """
+        Adaptive route that steers towards the least visited part of a patrol zone: every next waypoint is the
+        neighbouring step (one of eight directions) with the lowest pheromone level that stays inside the zone.
+        Exposes the same interface as Route.
+        :param patrol_location: Zone to patrol
+        :param receptor_grid: Grid holding the pheromone field
+        :param zone_owner: Dense (rows, cols) array with the owning patrol location index per cell
+        :param start: First waypoint, defaults to the patrol location centre
+        """
+        self.patrol_location = patrol_location
+        self.receptor_grid = receptor_grid
+        self.zone_owner = zone_owner
+        self.step = max(patrol_location.radius, settings.GRID_SIZE)
+        self.next_point = points.Point(patrol_location.x, patrol_location.y) if start is None else start
+
+    def __repr__(self) -> str:
+        return f"Pheromone route towards {self.next_point}"
+
+    def get_next_point(self) -> points.Point:
+        return self.next_point
+
+    def cycle_next_point(self) -> None:
+        grid = self.receptor_grid
+        candidates = np.array(self.next_point.get_tuple()) + self.step * self.DIRECTIONS
+        rows = ((candidates[:, 1] - grid.area_y_start) // settings.GRID_SIZE).astype(int)
+        cols = ((candidates[:, 0] - grid.area_x_start) // settings.GRID_SIZE).astype(int)
+
+        inside = (rows >= 0) & (rows < grid.max_rows) & (cols >= 0) & (cols < grid.max_cols)
+        rows, cols, candidates = rows[inside], cols[inside], candidates[inside]
+        in_zone = self.zone_owner[rows, cols] == self.patrol_location.zone_index
+
+        if not in_zone.any():
+            self.next_point = points.Point(self.patrol_location.x, self.patrol_location.y)
+            return
+        levels = grid.pheromones[rows[in_zone], cols[in_zone]]
+        x, y = candidates[in_zone][np.argmin(levels)]
+        self.next_point = points.Point(float(x), float(y))
+
+
+class FieldRoute:
+    def __init__(self, field, cell: int, exit_point: points.Point):
+        """
+        Route down a cost-to-go field (see evasion.py): every next waypoint is the next cell on the best path from the
+        previous one, after the last cell the exit. The field is shared, a refreshed field reroutes all travellers on
+        it. Exposes the same interface as Route.
+        :param field: evasion.CostToGoField
+        :param cell: Dense index of the first cell to head for
+        :param exit_point: Final waypoint
+        """
+        self.field = field
+        self.cell = cell
+        self.exit_point = exit_point
+        self.next_point = field.cell_point(cell)
+
+    def __repr__(self) -> str:
+        return f"Field route towards {self.next_point}"
 
     def get_next_point(self) -> points.Point:
-        return self.waypoints[0]
+        return self.next_point
+
+    def cycle_next_point(self) -> None:
+        if self.cell < 0:
+            return
+        self.cell = int(self.field.next_cell[self.cell])
+        self.next_point = self.exit_point if self.cell < 0 else self.field.cell_point(self.cell)
 
 
 def create_boustrophedon_path(patrol_location: points.PatrolLocation) -> Route:
     interior_points = create_sorted_interior_points(patrol_location)
     contained_points = patrol_location.select_contained_points(interior_points)
+    if not contained_points:
+        # Zone too small to fit a single lattice point, patrol its centre
+        contained_points = [points.Point(patrol_location.x, patrol_location.y)]
     return Route(contained_points)
 
 
@@ -41,8 +151,8 @@ def create_sorted_interior_points(patrol_location: points.PatrolLocation) -> lis
     min_y = min([p.y for p in patrol_location.convex_hull]) + r
     max_y = max([p.y for p in patrol_location.convex_hull]) - r
 
-    horizontal_dots = (max_x - min_x) // r
-    vertical_dots = (max_y - min_y) // r
+    horizontal_dots = int((max_x - min_x) // r)
+    vertical_dots = int((max_y - min_y) // r)
 
     dots = []
 
@@ -0,0 +1,92 @@
+"""
+Compiled scenario layer: the categorical agent characteristics (operating domain, skill level, visibility classes)
+are encoded as small integers once when the scenario is loaded, and the detection models are precomputed into dense
+lookup tables. Hot paths and vectorized kernels index these arrays instead of hashing strings.
+"""
+import numpy as np
+
+import settings
+
+OPERATING_DOMAINS = [settings.SURFACE_SEARCHER, settings.AIR_SEARCHER]
+SKILL_LEVELS = [settings.BASIC_SKILL, settings.ADVANCED_SKILL]
+SIZE_CLASSES = [settings.STEALTHY, settings.VSMALL, settings.SMALL, settings.MEDIUM, settings.LARGE]
+SEA_STATES = sorted(settings.weather_markov_dict.keys())
+
+SURFACE_CODE = OPERATING_DOMAINS.index(settings.SURFACE_SEARCHER)
+AIR_CODE = OPERATING_DOMAINS.index(settings.AIR_SEARCHER)
+
+
+def encode(value: str, categories: list[str], kind: str) -> int:
+    try:
+        return categories.index(value)
+    except ValueError:
+        raise ValueError(f"Unknown {kind} {value}, expected one of {categories}.") from None
+
+
+class CompiledScenario:
+    def __init__(self, agent_data: dict):
+        """
+        :param agent_data: Scenario agent data as returned by settings.import_agent_data
+        """
+        self.agent_data = agent_data
+
+        # Surface detection range by (skill, target size)
+        self.detection_range = np.array([[settings.SURFACE_DETECTING_SURFACE[skill][size] for size in SIZE_CLASSES]
+                                         for skill in SKILL_LEVELS], dtype=float)
+
+        # Air detection probability by (skill, target rcs, sea state, distance bin)
+        self.bin_width = settings.AIR_DETECTION_BIN_WIDTH
+        self.distance_bins = np.arange(0, settings.MAX_AIR_DETECTION_DISTANCE + 2 * self.bin_width, self.bin_width)
+        self.air_detection_table = self.compute_air_detection_table(self.distance_bins)
+        # Nested lists are faster than array indexing for the scalar lookups of the object based path
+        self.air_detection_rows = self.air_detection_table.tolist()
+
+    @staticmethod
+    def detection_probability(skill: np.ndarray, rcs: np.ndarray, sea_state_factor: np.ndarray,
+                              distance: np.ndarray) -> np.ndarray:
+        """
+        The air-to-surface detection model, 1 - exp(-k h r s / d^3) with d at least 1.
+        :param skill: Skill codes, select k from settings.AIR_DETECTION_K
+        """
+        k = np.array([settings.AIR_DETECTION_K[level] for level in SKILL_LEVELS], dtype=float)[skill]
+        distance = np.maximum(distance, 1)
+        return 1 - np.exp(-(k * settings.AIR_DETECTION_HEIGHT * rcs * sea_state_factor) / distance ** 3)
+
+    def compute_air_detection_table(self, distances: np.ndarray) -> np.ndarray:
+        rcs = np.array([settings.rcs_dict[size] for size in SIZE_CLASSES], dtype=float)
+        sea_state_factor = np.array([settings.sea_state_values.get(state, settings.DEFAULT_SEA_STATE_FACTOR)
+                                     for state in SEA_STATES], dtype=float)
+        return self.detection_probability(np.arange(len(SKILL_LEVELS))[:, None, None, None],
+                                          rcs[None, :, None, None],
+                                          sea_state_factor[None, None, :, None],
+                                          distances[None, None, None, :])
+
+    def air_detection_probability(self, skill: int, rcs: int, sea_state: int, distance: float) -> float:
+        """
+        Scalar lookup with linear interpolation between distance bins, 0 beyond MAX_AIR_DETECTION_DISTANCE.
+        """
+        if distance > settings.MAX_AIR_DETECTION_DISTANCE:
+            return 0.
+        position = distance / self.bin_width
+        index = int(position)
+        share = position - index
+        row = self.air_detection_rows[skill][rcs][sea_state]
+        return row[index] * (1 - share) + row[index + 1] * share
+
+    def air_detection_probabilities(self, skill: np.ndarray, rcs: np.ndarray, sea_state: np.ndarray,
+                                    distance: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of air_detection_probability, all arguments broadcast against each other.
+        """
+        distance = np.asarray(distance, dtype=float)
+        position = np.clip(distance, 0, settings.MAX_AIR_DETECTION_DISTANCE) / self.bin_width
+        index = position.astype(np.int64)
+        share = position - index
+        table = self.air_detection_table
+        probability = (table[skill, rcs, sea_state, index] * (1 - share)
+                       + table[skill, rcs, sea_state, index + 1] * share)
+        return np.where(distance > settings.MAX_AIR_DETECTION_DISTANCE, 0., probability)
+
+
+def compile_scenario(agent_data: dict) -> CompiledScenario:
+    return CompiledScenario(agent_data)
@@ -1,6 +1,6 @@
 import json
+import os
 import random
-import matplotlib.colors as mcolors
 import math
 
 ####################################################
@@ -8,8 +8,16 @@ import math
 ####################################################
 world = None
 world_time = 0
-TIME_DELTA = 1
+random_streams = None  # crn.RandomStreams of a common random numbers replication, None draws from the global generators
+TIME_DELTA = 1  # Base tick: weather, entries and pheromone diffusion happen once per tick
 SIMULATION_TIME = 1000
+# Adaptive stepping: long steps while no traveller can reach a sensor, short ones around contacts
+ADAPTIVE_TIME_STEP = False
+MAX_TIME_STEP = 4
+MIN_TIME_STEP = 0.05
+CONTACT_STEP_DISTANCE = 10  # Near contacts no searcher-traveller pair closes in by more than this per step
+time_step = TIME_DELTA  # Length of the current step
+STEADY_STATE_START = False  # Start fleets mid-rotation and weather from its stationary distribution
 
 BASELINE_HEIGHT = 600
 AREA_WIDTH = 4500
@@ -28,21 +36,69 @@ WORLD_POLYGON = None
 
 AREA_BORDER = 100
 GRID_SIZE = 20
+SPARSE_GRID = False  # Only store receptors inside the world polygon (plus halo), recommended for GRID_SIZE <= 5
+SPARSE_GRID_HALO = 1  # Number of out-of-zone cells kept around the world polygon in sparse mode
 
 ####################################################
 # VISUAL/ZONE SETTINGS
 ####################################################
 SEARCH_VERTICAL_ALIGNMENT = 0.6  # Val between 0-1, the higher the more vertical the zones
 
-colors = list(mcolors.CSS4_COLORS.keys())
-random.shuffle(colors)
+# How searchers move through their patrol zone: the fixed lawnmower path, or steering to low pheromone cells
+BOUSTROPHEDON_SEARCH = "boustrophedon"
+PHEROMONE_SEARCH = "pheromone"
+SEARCH_BEHAVIOUR = BOUSTROPHEDON_SEARCH
+PHEROMONE_DEPOSIT = 1.0  # Amount deposited per unit of time by an active searcher
+PHEROMONE_DECAY = 0.01  # Share of the pheromones that evaporates per unit of time
+PHEROMONE_DIFFUSION = 0.1  # Share that spreads to each neighbouring cell per unit of time, at most 0.25
+
+# How travellers cross: straight to the exit, or around the patrol zones along a cost-to-go field (evasion.py)
+DIRECT_TRAVEL = "direct"
+EVASIVE_TRAVEL = "evasive"
+TRAVEL_BEHAVIOUR = DIRECT_TRAVEL
+EVASION_RISK_WEIGHT = 1000  # Travel time an evasive traveller spends to avoid one expected detection
+EVASION_REFRESH_INTERVAL = 10  # Least time between refreshes of the cost-to-go field after patrol layout changes
+
+PLOT_BACKEND = "TkAgg"
+PLOT_FPS = 10  # Upper bound on live view redraws per second of wall clock time
+
+# Shuffled palette of plot colours, only filled (importing matplotlib) once a colour is requested
+colors = []
+
+
+def next_color() -> str:
+    if len(colors) == 0:
+        import matplotlib.colors as mcolors
+        colors.extend(mcolors.CSS4_COLORS.keys())
+        # Separate generator, drawing colours must not shift the simulation's random streams
+        random.Random().shuffle(colors)
+    return colors.pop()
+
+
+####################################################
+# OUTPUT SETTINGS
+####################################################
+TRACK_COVERAGE = False  # Accumulate the sensor coverage heatmap, see coverage.py
+COVERAGE_REFERENCE_SIZE = "medium"  # Target size the coverage footprint of a searcher is based on
+COVERAGE_MIN_DETECTION_PROBABILITY = 0.5  # Air searchers cover a cell if the detection probability is this high
+TRAJECTORY_FILE = None  # Path to record agent trajectories to, see replay.py
+TRAJECTORY_EVERY = 1  # Record positions every n ticks
+BATCH_WEATHER_FIELDS = 16  # Noise fields of the shared pool the exact equivalence tests run on, see equivalence.py
+MEMORY_REPORT = False  # Log the bytes per subsystem and the peak resident memory after each simulate call
+KEEP_RAW_STATS = False  # Keep one record per finished traveller next to the online aggregates
+STATS_BIN_WIDTH = 5  # Bin width of the time histograms
+STATS_MAX_TIME = 500  # Times beyond this share the last histogram bin
+STATS_SKETCH_ACCURACY = 0.01  # Relative accuracy of the streaming quantiles
 
 ####################################################
 # CALCULATION SETTINGS
 ####################################################
-PATROL_ZONE_ITERATIONS = 50
+PATROL_ZONE_ITERATIONS = 50  # Upper bound, the relaxation stops earlier once converged
+PATROL_CENTER_TOLERANCE = 0.5  # Largest centre displacement (distance units) between iterations to be converged
+PATROL_SCORE_TOLERANCE = 1e-4  # Change in strength-share score between iterations to be converged
 DISTANCE_SAFETY_MARGIN = 0.01
 MAX_DISCOVER_DISTANCE = 100
+DETECTION_REFERENCE_TIME = 1  # Exposure time the air detection probabilities apply to
 
 """
 This weather dict is a Markov Chain estimate from sea state transitions as estimated in a 
@@ -79,6 +135,11 @@ weather_markov_dict = {0: {0: 0.86797, 1: 0.13202, 2: 1e-05, 3: 0, 4: 0, 5: 0, 6
                        14: {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0,
                             8: 0, 9: 0, 10: 0, 11: 0.5, 12: 0.5, 13: 0, 14: 0}}
 
+# Sea state assumed where no receptor is stored (outside the sparse grid)
+DEFAULT_SEA_STATE = 2
+# Detection adjustment factor for sea states not listed in sea_state_values
+DEFAULT_SEA_STATE_FACTOR = 0.4
+
 # Maps sea state level to corresponding detection adjustment factor
 sea_state_values = {0: 1,
                     1: 0.89,
@@ -118,6 +179,13 @@ rcs_dict = {STEALTHY: 0.25,
             MEDIUM: 1.25,
             LARGE: 1.5}
 
+# Air-to-surface detection model 1 - exp(-k h r s / d^3), k by skill level and h the sensor height
+AIR_DETECTION_K = {BASIC_SKILL: 2747,
+                   ADVANCED_SKILL: 39633}
+AIR_DETECTION_HEIGHT = 10
+MAX_AIR_DETECTION_DISTANCE = 300
+AIR_DETECTION_BIN_WIDTH = 1  # Distance resolution of the precomputed air detection table
+
 SURFACE_DETECTING_SURFACE = {BASIC_SKILL: {LARGE: 56,
                                            MEDIUM: 56,
                                            SMALL: 37,
@@ -134,8 +202,11 @@ SURFACE_DETECTING_SURFACE = {BASIC_SKILL: {LARGE: 56,
 # DATA IMPORT
 ####################################################
 
-def import_agent_data() -> dict:
-    with open("agent_data.json", "r") as file:
+SCENARIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_data.json")
+
+
+def import_agent_data(path: str = SCENARIO_FILE) -> dict:
+    with open(path, "r") as file:
         data = json.load(file)
 
         agent_dict = {}
@@ -147,4 +218,24 @@ def import_agent_data() -> dict:
         return agent_dict
 
 
-AGENT_DATA = import_agent_data()
+# Scenario data and its compiled lookup tables (see scenario.py), set by load_scenario
+AGENT_DATA = None
+COMPILED_SCENARIO = None
+
+
+def load_scenario(path: str = SCENARIO_FILE) -> dict:
+    """
+    Loads the agent data of a scenario, has to be called before creating a World.
+    """
+    set_scenario(import_agent_data(path))
+    return AGENT_DATA
+
+
+def set_scenario(agent_data: dict) -> None:
+    """
+    Activates the given agent data and compiles its detection lookup tables.
+    """
+    global AGENT_DATA, COMPILED_SCENARIO
+    import scenario
+    AGENT_DATA = agent_data
+    COMPILED_SCENARIO = scenario.compile_scenario(agent_data)
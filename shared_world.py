@@ -0,0 +1,94 @@
+"""
+Publishes the read-only arrays of a World (receptor grid, patrol layout, routes and optionally precomputed weather)
+once into a multiprocessing.shared_memory block, so that worker processes attach to them as read-only NumPy views
+instead of recomputing or unpickling private copies.
+What is shared are the arrays themselves. A worker keeps the mutable state of the cells (sea states, uniform values,
+pheromones) in its own arrays next to the shared views and builds no object per cell, which saves the tessellation,
+the polygon tests and a private copy of the layout.
+"""
+from __future__ import annotations
+
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import checkpoint
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT = 64
+
+
+class SharedStaticWorld:
+    def __init__(self, arrays: dict):
+        """
+        Copies the given arrays into a single shared memory block.
+        Non-numeric arrays (strings) are small and travel inside the handle instead.
+        :param arrays: Mapping of name to array, e.g. checkpoint.capture_static(world)
+        """
+        self.layout = {}
+        self.inline = {}
+
+        size = 0
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if array.dtype.kind in "US" or array.ndim == 0:
+                self.inline[name] = array.tolist()
+                continue
+            self.layout[name] = (size, array.shape, array.dtype.str)
+            size += int(np.ceil(array.nbytes / ALIGNMENT) * ALIGNMENT)
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for name, (offset, shape, dtype) in self.layout.items():
+            view = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)
+            view[...] = arrays[name]
+        logger.info(f"Published {len(self.layout)} static arrays ({size / 1e6:.1f} MB) as {self.memory.name}")
+
+    @property
+    def handle(self) -> dict:
+        """
+        Small picklable description that workers pass to attach_static.
+        """
+        return {"name": self.memory.name, "layout": self.layout, "inline": self.inline}
+
+    def close(self) -> None:
+        """
+        Releases and removes the shared block, call once all workers are done.
+        """
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def publish_static_world(world, weather_fields: np.ndarray = None) -> SharedStaticWorld:
+    """
+    :param world: World whose patrol layout is shared
+    :param weather_fields: Optional (t, n) array of precomputed weather noise, see weather.precompute_weather_fields
+    """
+    arrays = checkpoint.capture_static(world)
+    if weather_fields is not None:
+        arrays["weather_fields"] = np.asarray(weather_fields, dtype=np.float32)
+    return SharedStaticWorld(arrays)
+
+
+def attach_static(handle: dict) -> tuple[dict, shared_memory.SharedMemory]:
+    """
+    Attaches to a published block.
+    :return: Mapping of name to read-only array view, and the SharedMemory object that has to be kept alive
+        for as long as the views are used
+    """
+    memory = shared_memory.SharedMemory(name=handle["name"])
+    arrays = {}
+    for name, (offset, shape, dtype) in handle["layout"].items():
+        view = np.ndarray(tuple(shape), dtype=dtype, buffer=memory.buf, offset=offset)
+        view.flags.writeable = False
+        arrays[name] = view
+    for name, value in handle["inline"].items():
+        arrays[name] = np.array(value)
+    return arrays, memory
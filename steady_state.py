@@ -0,0 +1,134 @@
+"""
+Initialises a World directly in a steady state, so no warm-up ticks need to be simulated and discarded.
+
+Per patrol location the fleet of an AgentType rotates with a fixed spacing: an agent on station calls its
+replacement once its remaining endurance drops below (2 + margin) times the return distance, and returns below
+(1 + margin) times the return distance (see Searcher.check_if_need_replacement / check_if_need_to_return).
+Agents are therefore placed at phases (time since leaving the base) spaced by that replacement interval, with a
+uniformly sampled offset, which puts them on station, in transit or in maintenance as in a long-running simulation.
+Initial sea states are drawn from the stationary distribution of the weather Markov chain.
+"""
+import copy
+import logging
+
+import numpy as np
+
+import points
+import routes
+import settings
+import weather
+
+logger = logging.getLogger(__name__)
+
+
+def rotation_timing(agent_type, patrol_location: points.PatrolLocation) -> dict:
+    """
+    Timing of one agent cycle at a patrol location, all measured from the moment the agent leaves the base.
+    :return: Dict with the ingress distance and the times of arrival, return, entering base,
+        end of maintenance (cycle) and the spacing between consecutive departures
+    """
+    base = points.Point(settings.BASE_X, settings.BASE_Y)
+    distance = patrol_location.distance_to(base)
+    margin = settings.DISTANCE_SAFETY_MARGIN
+    speed = agent_type.speed
+    endurance = agent_type.endurance
+
+    return {"distance": distance,
+            "arrival": distance / speed,
+            "return": (endurance - (1 + margin) * distance) / speed,
+            "in_base": (endurance - margin * distance) / speed,
+            "cycle": (endurance - margin * distance) / speed + agent_type.maintenance,
+            "spacing": (endurance - (2 + margin) * distance) / speed}
+
+
+def place_agent(agent_type, a, patrol_location: points.PatrolLocation, phase: float, timing: dict,
+                called_replacement: bool) -> None:
+    """
+    Puts an agent in the state it has `phase` time units after leaving the base for the patrol location.
+    """
+    base = a.base
+    a.patrol_location = patrol_location
+    a.called_replacement = called_replacement
+    a.remaining_endurance = a.endurance - min(phase, timing["in_base"]) * a.speed
+    share_to_base = None
+
+    if phase < timing["arrival"]:
+        share_to_base = 1 - phase / timing["arrival"]
+        a.route = patrol_location.create_patrol_route()
+        a.returning = False
+        agent_type.active_agents.append(a)
+    elif phase < timing["return"]:
+        waypoints = patrol_location.boustrophedon_path.coordinates
+        x, y = waypoints[np.random.randint(len(waypoints))]
+        a.location = points.Point(float(x), float(y))
+        a.route = patrol_location.create_patrol_route(start=points.Point(float(x), float(y)))
+        a.returning = False
+        agent_type.active_agents.append(a)
+    elif phase < timing["in_base"]:
+        share_to_base = (phase - timing["return"]) / (timing["in_base"] - timing["return"])
+        a.route = routes.Route([base])
+        a.returning = True
+        agent_type.active_agents.append(a)
+    elif phase < timing["cycle"]:
+        a.location = copy.deepcopy(base)
+        a.route = routes.Route([base])
+        a.returning = False
+        a.called_replacement = False
+        a.remaining_maintenance = timing["cycle"] - phase
+        agent_type.maintenance_agents.append(a)
+    else:
+        a.location = copy.deepcopy(base)
+        a.remaining_endurance = a.endurance
+        a.called_replacement = False
+        agent_type.inactive_agents.append(a)
+
+    if share_to_base is not None:
+        a.location = points.Point(patrol_location.x + (base.x - patrol_location.x) * share_to_base,
+                                  patrol_location.y + (base.y - patrol_location.y) * share_to_base)
+    a.update_current_return_distance()
+
+
+def initialize_fleet(search_manager) -> None:
+    """
+    Distributes the agents of every AgentType over its patrol locations in a staggered steady-state rotation.
+    Replaces SearchManager.activate_patrol_locations, call it after the patrol routes are created.
+    """
+    for at in search_manager.agent_types:
+        pool = at.all_agents()
+        at.reset_fleet()
+
+        for pl_index, pl in enumerate(at.patrol_locations):
+            timing = rotation_timing(at, pl)
+            remaining_locations = len(at.patrol_locations) - pl_index
+            # Split the agents that are left evenly over the remaining locations
+            share = int(np.ceil(len(pool) / remaining_locations))
+
+            if timing["spacing"] <= 0 or share == 0:
+                logger.warning(f"{at.model} cannot sustain a rotation at {pl}, starting it cold.")
+                at.inactive_agents.extend(pool[:share])
+                del pool[:share]
+                at.call_next_agent(pl)
+                continue
+
+            needed = int(np.ceil(timing["cycle"] / timing["spacing"]))
+            offset = np.random.uniform(0, timing["spacing"])
+            for k in range(min(share, needed)):
+                place_agent(at, pool.pop(), pl, phase=offset + k * timing["spacing"], timing=timing,
+                            called_replacement=k > 0)
+
+        at.inactive_agents.extend(pool)
+        logger.debug(f"Steady state start: {at}")
+
+
+def initialize_sea_states(receptor_grid) -> None:
+    """
+    Samples the initial sea states from the stationary distribution of the weather Markov chain, using a Perlin
+    noise field as input so the initial weather is spatially correlated like the updates.
+    The noise is far from uniform (it clusters around 0.5), so it is rank-transformed first to make the sea state
+    shares match the stationary distribution.
+    """
+    receptor_grid.update_u_values()
+    noise = receptor_grid.new_uniform_values
+    uniform_values = (np.argsort(np.argsort(noise, kind="stable"), kind="stable") + 0.5) / len(noise)
+    receptor_grid.sea_states = weather.sample_sea_states(uniform_values, weather.stationary_distribution())
+    receptor_grid.last_uniform_values = receptor_grid.new_uniform_values
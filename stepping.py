@@ -0,0 +1,109 @@
+"""
+Stop conditions and an asyncio driver for the step-wise simulation API, see World.run.
+
+World.run yields a snapshot (a small dict) every few steps: the world time, the number of steps run, the finished,
+detected and active travellers, the active searchers, the wall clock seconds since the run started and the reason the
+run stopped (None while it continues). A stop condition is any callable taking a snapshot and returning the reason to
+stop, or None to continue; the conditions below cover a target count, a wall clock budget and a stable estimate.
+
+run_async wraps World.run as an async generator that hands control back to the event loop between chunks, so one
+driver can multiplex many worlds with asyncio and drop each one the moment it has what it needs. Worlds swap the
+global clock and random generators in and out between chunks (see World.resume), so interleaved runs give the same
+results as runs one after the other. All worlds share the loaded scenario.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+from statistics import NormalDist
+
+logger = logging.getLogger(__name__)
+
+UNTIL_REACHED = "until reached"
+STEPS_DONE = "steps done"
+
+
+class TargetCount:
+    def __init__(self, detected: int = None, travellers: int = None):
+        """
+        Stops once this many travellers were detected, or this many finished (detected or not).
+        """
+        self.detected = detected
+        self.travellers = travellers
+
+    def __call__(self, snapshot: dict) -> str | None:
+        if self.detected is not None and snapshot["detected"] >= self.detected:
+            return f"{snapshot['detected']} travellers detected"
+        if self.travellers is not None and snapshot["travellers"] >= self.travellers:
+            return f"{snapshot['travellers']} travellers finished"
+        return None
+
+
+class WallClockBudget:
+    def __init__(self, seconds: float):
+        """
+        Stops once the run took this many seconds of wall clock time.
+        """
+        self.seconds = seconds
+
+    def __call__(self, snapshot: dict) -> str | None:
+        if snapshot["elapsed"] >= self.seconds:
+            return f"wall clock budget of {self.seconds}s spent"
+        return None
+
+
+class StableEstimate:
+    def __init__(self, half_width: float = 0.02, confidence: float = 0.95, min_travellers: int = 30):
+        """
+        Stops once the Wilson interval of the detection rate is at most half_width on either side.
+        :param min_travellers: Finished travellers required before the interval is trusted
+        """
+        self.half_width = half_width
+        self.confidence = confidence
+        self.min_travellers = min_travellers
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    def interval_half_width(self, detected: int, travellers: int) -> float:
+        if travellers == 0:
+            return math.inf
+        p = detected / travellers
+        z2 = self.z ** 2
+        return self.z * math.sqrt(p * (1 - p) / travellers + z2 / (4 * travellers ** 2)) / (1 + z2 / travellers)
+
+    def __call__(self, snapshot: dict) -> str | None:
+        if snapshot["travellers"] < self.min_travellers:
+            return None
+        half_width = self.interval_half_width(snapshot["detected"], snapshot["travellers"])
+        if half_width <= self.half_width:
+            return f"detection rate {snapshot['detection_rate']:.4f} +- {half_width:.4f}"
+        return None
+
+
+async def run_async(world, until: float = None, every: int = 1, stop_conditions: list = None):
+    """
+    World.run as an async generator, yielding to the event loop after every snapshot.
+    """
+    for snapshot in world.run(until, every=every, stop_conditions=stop_conditions):
+        yield snapshot
+        await asyncio.sleep(0)
+
+
+async def run_to_end(world, until: float = None, every: int = 1, stop_conditions: list = None) -> dict:
+    """
+    :return: The last snapshot of the run
+    """
+    snapshot = None
+    async for snapshot in run_async(world, until, every, stop_conditions):
+        pass
+    return snapshot
+
+
+async def multiplex(worlds: list, until: float = None, every: int = 1, stop_conditions: list = None) -> list[dict]:
+    """
+    Runs the worlds interleaved on the running event loop, each until it stops by itself.
+    :param stop_conditions: Conditions applied to every world, on top of the ones registered with it. Conditions with
+        state of their own should be registered per world instead.
+    :return: The last snapshot of every world, in order
+    """
+    return await asyncio.gather(*(run_to_end(world, until, every, stop_conditions) for world in worlds))
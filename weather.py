@@ -0,0 +1,176 @@
+"""
+Array helpers for the sea state Markov chain defined by settings.weather_markov_dict, and a vectorized version of the
+Perlin noise that drives it.
+"""
+from __future__ import annotations
+
+import math
+import random
+
+import numpy as np
+
+import crn
+import settings
+
+# Lattice cells per unit of the noise coordinates, the "octaves" of perlin_noise.PerlinNoise
+NOISE_OCTAVES = 8
+
+
+def transition_matrix() -> np.ndarray:
+    """
+    :return: (s, s) row-stochastic transition matrix, rows renormalised to absorb the rounding in the estimates
+    """
+    states = sorted(settings.weather_markov_dict.keys())
+    matrix = np.array([[settings.weather_markov_dict[i].get(j, 0) for j in states] for i in states], dtype=float)
+    return matrix / matrix.sum(axis=1, keepdims=True)
+
+
+def stationary_distribution(matrix: np.ndarray = None) -> np.ndarray:
+    """
+    Long-run share of time spent in each sea state, the left eigenvector of the transition matrix for eigenvalue 1.
+    :param matrix: Transition matrix, defaults to transition_matrix()
+    :return: (s,) probability vector
+    """
+    if matrix is None:
+        matrix = transition_matrix()
+    size = len(matrix)
+    # Solve pi (P - I) = 0 together with sum(pi) = 1
+    system = np.vstack((matrix.T - np.eye(size), np.ones(size)))
+    target = np.zeros(size + 1)
+    target[-1] = 1
+    distribution = np.linalg.lstsq(system, target, rcond=None)[0]
+    distribution = np.clip(distribution, 0, None)
+    return distribution / distribution.sum()
+
+
+def sample_sea_states(uniform_values: np.ndarray, distribution: np.ndarray) -> np.ndarray:
+    """
+    Inverse-CDF sampling of sea states, using the same "first state whose cumulative probability exceeds u" rule as
+    ReceptorGrid.update_sea_states.
+    :param uniform_values: Array of values in [0, 1]
+    :param distribution: (s,) probability vector over the sea states
+    :return: Array of sea states with the shape of uniform_values
+    """
+    cumulative = np.cumsum(distribution)
+    return np.minimum(np.searchsorted(cumulative, uniform_values, side="right"), len(distribution) - 1)
+
+
+def transition_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cumulative transition probabilities per state in the key order of weather_markov_dict, shifted by twice the state
+    so that all rows can be searched as one sorted array.
+    :return: (s, w) next states, (s * w,) shifted cumulative probabilities and (s, w) mask of the defined entries
+    """
+    states = sorted(settings.weather_markov_dict)
+    width = max(len(row) for row in settings.weather_markov_dict.values())
+    keys = np.zeros((len(states), width), dtype=np.int64)
+    cumulative = np.full((len(states), width), np.inf)
+    for state in states:
+        row = settings.weather_markov_dict[state]
+        keys[state, :len(row)] = list(row.keys())
+        cumulative[state, :len(row)] = np.cumsum(list(row.values()))
+    shifted = (np.minimum(cumulative, 1.5) + 2 * np.arange(len(states))[:, None]).ravel()
+    return keys, shifted, np.isfinite(cumulative)
+
+
+def next_sea_states(sea_states: np.ndarray, uniform_values: np.ndarray, tables: tuple = None) -> np.ndarray:
+    """
+    One step of the Markov chain for an array of cells: every sea state moves to the first state whose cumulative
+    transition probability exceeds the cell's uniform value, or stays if none does.
+    :param tables: Output of transition_tables, computed if None
+    :return: Array of sea states with the shape of sea_states
+    """
+    keys, shifted, defined = transition_tables() if tables is None else tables
+    width = keys.shape[1]
+    position = np.searchsorted(shifted, uniform_values + 2 * sea_states, side="right")
+    index = position - sea_states * width
+    found = index < width
+    index = np.minimum(index, width - 1)
+    found &= defined[sea_states, index]
+    return np.where(found, keys[sea_states, index], sea_states)
+
+
+def lattice_gradients(seeds: list[int], size: int) -> np.ndarray:
+    """
+    The random gradients perlin_noise.PerlinNoise(seed=seed) places on the integer lattice points of two dimensional
+    coordinates, each drawn from its own seeded generator.
+    :return: (len(seeds), size, size, 2) gradients, indexed by the seed and the lattice coordinates
+    """
+    generator = random.Random()
+    gradients = np.empty((len(seeds), size, size, 2))
+    for index, seed in enumerate(seeds):
+        for c0 in range(size):
+            for c1 in range(size):
+                generator.seed(seed * max(1, abs(c0 + 10 * c1 + 1)))
+                gradients[index, c0, c1] = generator.uniform(-1, 1), generator.uniform(-1, 1)
+    return gradients
+
+
+def fade(values: np.ndarray) -> np.ndarray:
+    """
+    The smoothing of perlin_noise, element by element with math.pow as its results differ in the last bit from numpy's.
+    """
+    return np.array([6 * math.pow(value, 5) - 15 * math.pow(value, 4) + 10 * math.pow(value, 3)
+                     for value in values.tolist()])
+
+
+def perlin_noise(seeds: list[int], first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    perlin_noise.PerlinNoise(octaves=NOISE_OCTAVES, seed=seed)([x, y]) for every seed, every x in first and y in
+    second, all in [0, 1], bit for bit. The weights only depend on one coordinate each, so they are computed per axis
+    and the grids of all seeds are a handful of array operations instead of one Python call per point.
+    :return: (len(seeds), len(first), len(second)) noise values
+    """
+    first, second = np.asarray(first) * NOISE_OCTAVES, np.asarray(second) * NOISE_OCTAVES
+    low_first, low_second = np.floor(first).astype(np.int64), np.floor(second).astype(np.int64)
+    gradients = lattice_gradients(seeds, NOISE_OCTAVES + 2)
+
+    noise = np.zeros((len(seeds), len(first), len(second)))
+    for c0 in (low_first, low_first + 1):
+        d0 = first - c0
+        for c1 in (low_second, low_second + 1):
+            d1 = second - c1
+            gradient = gradients[:, c0[:, None], c1[None, :]]
+            weight = fade(1 - np.abs(d0))[:, None] * fade(1 - np.abs(d1))[None, :]
+            noise = noise + weight * (gradient[..., 0] * d0[:, None] + gradient[..., 1] * d1[None, :])
+    return noise
+
+
+def noise_seed(seed: int = None) -> int:
+    """
+    :return: The given seed, or like PerlinNoise one drawn from the global generator
+    """
+    return seed if seed else random.randint(1, 10 ** 5)
+
+
+def uniform_fields(seeds: list[int], rows: int, cols: int) -> np.ndarray:
+    """
+    The uniform values of one weather update per seed over the dense (rows, cols) grid: Perlin noise at (row / rows,
+    col / cols), shifted by the absolute value of its minimum and divided by the resulting maximum.
+    :return: (len(seeds), rows * cols) values in row-major cell order
+    """
+    noise = perlin_noise(seeds, np.arange(rows) / rows, np.arange(cols) / cols).reshape(len(seeds), -1)
+    noise = noise + np.abs(noise.min(axis=1, keepdims=True))
+    return noise / noise.max(axis=1, keepdims=True)
+
+
+def uniform_field(rows: int, cols: int, seed: int = None) -> np.ndarray:
+    """
+    uniform_fields for a single update.
+    :param seed: Seed of the noise, drawn from the global generator if None (see crn.weather_seed)
+    :return: (rows * cols,) values in row-major cell order
+    """
+    return uniform_fields([noise_seed(seed)], rows, cols)[0]
+
+
+def precompute_weather_fields(receptor_grid, ticks: int) -> np.ndarray:
+    """
+    Samples the Perlin noise fields of the given number of weather updates up front, so they can be shared (and
+    reused) by several replications through ReceptorGrid.weather_fields.
+    :return: (ticks, n_receptors) float32 array
+    """
+    fields = np.empty((ticks, len(receptor_grid.dense_indices)), dtype=np.float32)
+    for tick in range(ticks):
+        fields[tick] = uniform_field(receptor_grid.max_rows, receptor_grid.max_cols,
+                                     crn.weather_seed())[receptor_grid.dense_indices]
+    return fields
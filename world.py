@@ -1,43 +1,228 @@
+import math
+import random
+import time
+
+import numpy as np
+
 import settings
+import steady_state
 from receptors import ReceptorGrid
 from manager import SearchManager, TravelManager
+from coverage import CoverageMap
+from live_view import LiveView
+from recorder import TrajectoryRecorder
+from memory import memory_report
 import logging
 
-import shapely
-import matplotlib
-from matplotlib import pyplot as plt
-
-matplotlib.use("TkAgg")
-
 logger = logging.getLogger(__name__)
 
 
 class World:
-    def __init__(self):
+    def __init__(self, plot: bool = True):
         settings.world = self
         initiate_world_polygon()
 
         self.receptor_grid = ReceptorGrid()
+        if settings.STEADY_STATE_START:
+            steady_state.initialize_sea_states(self.receptor_grid)
         self.search_manager = SearchManager()
         self.travel_manager = TravelManager()
+        self.coverage = CoverageMap(self.receptor_grid, self.search_manager) if settings.TRACK_COVERAGE else None
+        self.recorder = None
+        if settings.TRAJECTORY_FILE is not None:
+            self.record_trajectories(settings.TRAJECTORY_FILE)
 
         self.fig = None
         self.ax = None
-        self.establish_world_plot()
-
-    def simulate(self):
-        while settings.world_time < settings.SIMULATION_TIME:
-            logger.info(f"World time is {settings.world_time} - "
-                        f"active searchers: {sum([len(at.active_agents) for at in self.search_manager.agent_types])}")
-            self.search_manager.manage_agents()
-            self.travel_manager.manage_agents()
-            detected_agents = self.search_manager.check_detection(self.travel_manager.active_agents)
-            self.travel_manager.register_detection(detected_agents)
+        self.live_view = None
+        if plot:
+            self.establish_world_plot()
+
+        # Called with every snapshot of run, and checked for a reason to stop it, see stepping.py
+        self.callbacks = []
+        self.stop_conditions = []
+        # Clock and random generator states of this world while another one runs, see suspend and resume
+        self.suspended_state = None
+        self.suspend()
+
+    def simulate(self, until: float = None):
+        """
+        Runs the simulation until the given time, or until SIMULATION_TIME, or until a registered stop condition holds.
+        Continues from the current world time, e.g. after restoring a checkpoint. Closes the trajectory recorder, if
+        any, when the run ends.
+        """
+        try:
+            for _ in self.run(until):
+                pass
+            if settings.MEMORY_REPORT:
+                for name, size in memory_report(self).items():
+                    logger.info(f"Memory {name}: {size} bytes")
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+
+    def step(self, n: int = 1, until: float = None) -> dict:
+        """
+        Advances the world by n steps, fewer if the given time is reached first.
+        :return: Snapshot after the last step, see run
+        """
+        snapshot = None
+        for snapshot in self.run(until, every=n, steps=n):
+            pass
+        return snapshot
+
+    def run(self, until: float = None, every: int = 1, steps: int = None, stop_conditions: list = None):
+        """
+        Runs the simulation as a generator of snapshots, one every given number of steps and one when the run ends.
+        Registered callbacks get every snapshot; the run ends at the given time (SIMULATION_TIME by default), after
+        the given number of steps, or once a registered or given stop condition returns a reason.
+        :return: Generator of snapshots, the last one holds the reason the run ended under "stop_reason"
+        """
+        import stepping
+        until = settings.SIMULATION_TIME if until is None else until
+        conditions = self.stop_conditions + ([] if stop_conditions is None else list(stop_conditions))
+        start = time.perf_counter()
+        ran = 0
+        while True:
+            self.resume()
+            chunk = 0
+            while settings.world_time < until and chunk < every and (steps is None or ran < steps):
+                self.advance(until)
+                chunk += 1
+                ran += 1
+            self.suspend()
+
+            snapshot = self.snapshot(ran, time.perf_counter() - start)
+            if settings.world_time >= until:
+                snapshot["stop_reason"] = stepping.UNTIL_REACHED
+            elif steps is not None and ran >= steps:
+                snapshot["stop_reason"] = stepping.STEPS_DONE
+            else:
+                for condition in conditions:
+                    snapshot["stop_reason"] = condition(snapshot)
+                    if snapshot["stop_reason"] is not None:
+                        logger.info(f"Stopping at world time {snapshot['time']}: {snapshot['stop_reason']}")
+                        break
+            if snapshot["stop_reason"] is not None and self.recorder is not None:
+                self.recorder.flush()
+            for callback in self.callbacks:
+                callback(snapshot)
+            yield snapshot
+            if snapshot["stop_reason"] is not None:
+                return
+
+    def add_callback(self, callback) -> None:
+        """
+        :param callback: Called with every snapshot of run
+        """
+        self.callbacks.append(callback)
+
+    def add_stop_condition(self, condition) -> None:
+        """
+        :param condition: Called with every snapshot of run, returns the reason to stop or None, see stepping.py
+        """
+        self.stop_conditions.append(condition)
+
+    def snapshot(self, steps: int, elapsed: float) -> dict:
+        aggregates = self.travel_manager.aggregates
+        return {"time": settings.world_time,
+                "steps": steps,
+                "travellers": aggregates.travellers,
+                "detected": aggregates.detected,
+                "detection_rate": aggregates.detection_rate,
+                "active_travellers": len(self.travel_manager.active_agents),
+                "active_searchers": sum(len(at.active_agents) for at in self.search_manager.agent_types),
+                "elapsed": elapsed,
+                "stop_reason": None}
+
+    def suspend(self) -> None:
+        """
+        Stores the global clock and random generator states of this world.
+        """
+        self.suspended_state = (settings.world_time, settings.time_step, settings.random_streams,
+                                random.getstate(), np.random.get_state())
+
+    def resume(self) -> None:
+        """
+        Makes this the world of the simulation. If another world ran since this one was suspended, the global clock
+        and random generators are put back to where this world left them.
+        """
+        if settings.world is self:
+            return
+        settings.world = self
+        (settings.world_time, settings.time_step, settings.random_streams,
+         random_state, numpy_state) = self.suspended_state
+        random.setstate(random_state)
+        np.random.set_state(numpy_state)
+
+    def advance(self, until: float) -> None:
+        """
+        Runs a single step of the simulation, ending at the given time at the latest.
+        """
+        logger.info(f"World time is {settings.world_time} - "
+                    f"active searchers: {sum([len(at.active_agents) for at in self.search_manager.agent_types])}")
+        settings.time_step = self.choose_time_step(until)
+        step_end = settings.world_time + settings.time_step
+        entry_ticks = tick_times(settings.world_time, step_end, closed_start=True)
+        weather_ticks = tick_times(settings.world_time, step_end, closed_start=False)
+
+        self.search_manager.manage_agents()
+        self.travel_manager.manage_agents(entry_ticks)
+        if self.coverage is not None:
+            self.coverage.stamp(settings.world_time, step_end)
+        detected_agents = self.search_manager.check_detection(self.travel_manager.active_agents)
+        self.travel_manager.register_detection(detected_agents)
+        if self.recorder is not None:
+            self.recorder.record(detected_agents, len(entry_ticks))
+        if settings.SEARCH_BEHAVIOUR == settings.PHEROMONE_SEARCH:
+            self.search_manager.deposit_pheromones()
+        for _ in weather_ticks:
             self.receptor_grid.update_sea_states()
-            settings.world_time += settings.TIME_DELTA
-            self.update_world_plot()
+            if settings.SEARCH_BEHAVIOUR == settings.PHEROMONE_SEARCH:
+                self.receptor_grid.update_pheromones()
+        settings.world_time = step_end
+        if self.live_view is not None:
+            self.live_view.update()
+
+    def choose_time_step(self, until: float) -> float:
+        """
+        The base TIME_DELTA, or with ADAPTIVE_TIME_STEP the time until any traveller could come within sensor reach
+        of any searcher, moving straight at each other at full speed. Pairs within reach (or nearly) get steps in
+        which they close in by at most CONTACT_STEP_DISTANCE.
+        """
+        if not settings.ADAPTIVE_TIME_STEP:
+            return settings.TIME_DELTA
+        max_step = min(settings.MAX_TIME_STEP, until - settings.world_time)
+
+        searcher_xy, _ = self.search_manager.active_positions()
+        traveller_xy = self.travel_manager.active_positions()
+        if len(searcher_xy) == 0 or len(traveller_xy) == 0:
+            return max_step
+        searcher_speed, reach = self.search_manager.active_sensors()
+        traveller_speed = self.travel_manager.active_speeds()
+
+        gap = np.hypot(*(traveller_xy[:, None, :] - searcher_xy[None, :, :]).transpose(2, 0, 1)) - reach[None, :]
+        closing_speed = traveller_speed[:, None] + searcher_speed[None, :]
+        step = (np.maximum(gap, settings.CONTACT_STEP_DISTANCE) / closing_speed).min()
+        return float(min(max(step, settings.MIN_TIME_STEP), max_step))
+
+    def record_trajectories(self, path: str, every: int = None) -> TrajectoryRecorder:
+        """
+        Starts writing the agent trajectories of the following ticks to a file, see replay.py to view it. The file is
+        flushed whenever a run ends and closed when simulate returns.
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = TrajectoryRecorder(self, path, every)
+        return self.recorder
 
     def establish_world_plot(self) -> None:
+        import matplotlib
+        matplotlib.use(settings.PLOT_BACKEND)
+        from matplotlib import pyplot as plt
+
+        self.search_manager.color_receptors()
         self.fig, self.ax = plt.subplots()
         logger.info("Plotting Receptors")
         df = self.receptor_grid.receptors_as_dataframe()
@@ -50,11 +235,22 @@ class World:
         self.ax.set_xlim(0, settings.AREA_WIDTH)
         self.ax.set_ylim(0, settings.TOTAL_HEIGHT)
 
-    def update_world_plot(self) -> None:
-        self.search_manager.plot_agent_types(self.ax)
-        self.travel_manager.plot_agents(self.ax)
-        self.ax.set_title(f"World At {settings.world_time}")
-        plt.pause(0.1)
+        plt.show(block=False)
+        self.live_view = LiveView(self.fig, self.ax, self.search_manager, self.travel_manager)
+
+
+def tick_times(start: float, end: float, closed_start: bool = True) -> list[float]:
+    """
+    :return: The base ticks (multiples of TIME_DELTA) in [start, end), or in (start, end] if not closed_start
+    """
+    # Tolerance for steps that end a rounding error away from a tick
+    tolerance = 1e-9
+    start, end = start / settings.TIME_DELTA, end / settings.TIME_DELTA
+    if closed_start:
+        first, last = math.ceil(start - tolerance), math.ceil(end - tolerance) - 1
+    else:
+        first, last = math.floor(start + tolerance) + 1, math.floor(end + tolerance)
+    return [k * settings.TIME_DELTA for k in range(first, last + 1)]
 
 
 def initiate_world_polygon():
@@ -63,6 +259,7 @@ def initiate_world_polygon():
     corner falls out of the positive numbers field. This is just done for convenience, so we only consider positive
     spaces.
     """
+    import shapely
     top_left_corner = shapely.Point(0, settings.EXTENSION + settings.BASELINE_HEIGHT)
     top_right_corner = shapely.Point(settings.AREA_WIDTH, settings.TOTAL_HEIGHT)
     bottom_right_corner = shapely.Point(settings.AREA_WIDTH, 0)